@@ -4,19 +4,31 @@ Krateras 🚧🚧🚧: O Especialista Robótico de Denúncia de Buracos (v10.1 -
 """
 
 import streamlit as st
-import requests
-import google.generativeai as genai
 from datetime import datetime
-from typing import Dict, Any, Optional, Tuple
-from image_analyzer import processar_analise_imagem, mostrar_feedback_analise
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple
+from metrics import iniciar_servidor_metricas, observar_etapa
+from report_store import bytes_imagem, get_report_store, tem_imagem
+from urgency_rules import ORIGEM_REGRAS
 import re
 import json
-import pandas as pd
 import io
+import os
 import urllib.parse
+import uuid
 import subprocess
 import sys
 import textwrap
+import threading
+import time
+import logging
+
+# Configuração de logging do app (os módulos do motor só criam seus loggers)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Imports pesados (google.generativeai, PIL, pandas, requests) ficam nas etapas que os usam: a primeira
+# pintura e cada rerun não pagam por eles, e o aquecimento em segundo plano já os carrega no início do processo.
+if TYPE_CHECKING:
+    import google.generativeai as genai
 
 def check_install_dependencies():
     try:
@@ -33,7 +45,14 @@ def check_install_dependencies():
 
 # check_install_dependencies()
 
-LOGO_URL = "https://raw.githubusercontent.com/icanello01/krateras/refs/heads/main/logo.png"
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png")  # já no tamanho exibido (650px)
+
+# Etapas exibidas em streaming durante o processamento e onde cada texto final fica em `denuncia_completa`
+ETAPAS_STREAMING = {"analise_visual": "👁️ Análise Visual", "insights": "🧠 Insights", "urgencia": "🚦 Urgência",
+                    "sugestao_acao": "🛠️ Causas e Ações", "resumo": "📜 Resumo"}
+INTERVALO_POLLING_JOB_S = 0.3
+CHAVES_TEXTO_IA = {"insights": ("insights_ia", "insights"), "urgencia": ("urgencia_ia", "urgencia_ia"),
+                   "sugestao_acao": ("sugestao_acao_ia", "sugestao_acao_ia"), "resumo": ("resumo_ia", "resumo_ia")}
 
 st.set_page_config(
     page_title="Krateras 🚧🚧🚧 - Denúncia de Buracos",
@@ -42,9 +61,14 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def carregar_logo() -> bytes:
+    # Servido pelo próprio Streamlit: nenhum navegador precisa buscar o logo no GitHub
+    with open(LOGO_PATH, 'rb') as f: return f.read()
+
 col1_logo, col2_logo, col3_logo = st.columns([1, 2, 1])
 with col2_logo:
-    st.image(LOGO_URL, width=650)
+    st.image(carregar_logo(), width=650)
 
 st.markdown("""
 <style>
@@ -79,180 +103,43 @@ def load_api_keys() -> tuple[Optional[str], Optional[str]]:
     return gemini_key, geocoding_key
 
 @st.cache_resource
-def init_gemini_text_model(api_key: Optional[str]) -> Optional[genai.GenerativeModel]:
+def init_gemini_text_model(api_key: Optional[str]) -> Optional["genai.GenerativeModel"]:
     if not api_key: st.error("❌ ERRO: Chave API Gemini não fornecida."); return None
     try:
-        genai.configure(api_key=api_key)
-        models = [m for m in list(genai.list_models()) if 'generateContent' in m.supported_generation_methods]
-        preferred = ['gemini-1.5-flash-latest', 'gemini-1.0-pro-latest', 'gemini-pro']
-        for name_suffix in preferred:
-            if found := next((m for m in models if m.name.endswith(name_suffix)), None):
-                st.success(f"✅ Modelo Texto Gemini: '{found.name.replace('models/','')}'."); return genai.GenerativeModel(found.name)
-        if models: st.warning(f"⚠️ Fallback: '{models[0].name.replace('models/','')}'."); return genai.GenerativeModel(models[0].name)
-        st.error("❌ ERRO: Nenhum modelo texto Gemini compatível."); return None
+        from gemini_text import selecionar_modelo_texto
+        model, fallback = selecionar_modelo_texto(api_key)
+        if model is None: st.error("❌ ERRO: Nenhum modelo texto Gemini compatível."); return None
+        nome = model.model_name.replace('models/','')
+        if fallback: st.warning(f"⚠️ Fallback: '{nome}'.")
+        else: st.success(f"✅ Modelo Texto Gemini: '{nome}'.")
+        return model
     except Exception as e: st.error(f"❌ ERRO: Falha init modelo texto Gemini."); st.exception(e); return None
 
-def buscar_cep_uncached(cep: str) -> Dict[str, Any]:
-    cep_limpo = re.sub(r'\D', '', cep)
-    if len(cep_limpo) != 8: return {"erro": "CEP inválido."}
-    try:
-        r = requests.get(f"https://viacep.com.br/ws/{cep_limpo}/json/", timeout=10); r.raise_for_status()
-        data = r.json()
-        if data.get('erro'): return {"erro": f"CEP '{cep_limpo}' não encontrado."}
-        if not all(data.get(k) for k in ['logradouro', 'localidade', 'uf']): return {"erro": "Dados CEP incompletos."}
-        return data
-    except requests.exceptions.Timeout: return {"erro": "Timeout ViaCEP."}
-    except requests.exceptions.RequestException as e: return {"erro": f"Erro ViaCEP: {e}."}
-    except Exception as e: return {"erro": f"Erro inesperado ViaCEP: {e}."}
-
-def geocodificar_endereco_uncached(rua: str, numero: str, cidade: str, estado: str, api_key: str) -> Dict[str, Any]:
-    if not api_key: return {"erro": "Chave GeoAPI não fornecida."}
-    if not all([rua, numero, cidade, estado]): return {"erro": "Endereço insuficiente."}
-    address = f"{rua}, {numero}, {cidade}, {estado}"
-    url = f"https://maps.googleapis.com/maps/api/geocode/json?address={urllib.parse.quote(address)}&key={api_key}"
-    try:
-        r = requests.get(url, timeout=10); r.raise_for_status()
-        data = r.json()
-        if data['status'] != 'OK':
-            s, msg = data.get('status','DESCONHECIDO'), data.get('error_message','Sem mensagem.')
-            err_map = {'ZERO_RESULTS':"Nenhum local.",'OVER_DAILY_LIMIT':"Limite API.",'OVER_QUERY_LIMIT':"Limite API.",
-                       'REQUEST_DENIED':"Requisição API negada.",'INVALID_REQUEST':"Requisição inválida.",'UNKNOWN_ERROR':"Erro API."}
-            return {"erro": f"Geo falhou. {err_map.get(s, f'Status: {s}. {msg}')}"}
-        if not data['results']: return {"erro": "Geo falhou. Nenhum local."}
-        loc = data['results'][0]['geometry']['location']; lat,lng = loc['lat'],loc['lng']
-        fmt_addr = data['results'][0].get('formatted_address',address)
-        return {"latitude":lat,"longitude":lng,"endereco_formatado_api":fmt_addr,
-                "google_maps_link_gerado":f"https://www.google.com/maps/search/?api=1&query={lat},{lng}",
-                "google_embed_link_gerado":f"https://www.google.com/maps/embed/v1/place?key={api_key}&q={lat},{lng}"}
-    except requests.exceptions.Timeout: return {"erro": f"Timeout Geo: {address}"}
-    except requests.exceptions.RequestException as e: return {"erro": f"Erro Comunicação Geo: {e}"}
-    except Exception as e: return {"erro": f"Erro Inesperado Geo: {e}"}
-
-SAFETY_SETTINGS = [{"category":cat,"threshold":"BLOCK_NONE"} for cat in ["HARM_CATEGORY_HARASSMENT","HARM_CATEGORY_HATE_SPEECH","HARM_CATEGORY_SEXUALLY_EXPLICIT","HARM_CATEGORY_DANGEROUS_CONTENT"]]
-
-def _call_gemini_api(prompt: str, model: Optional[genai.GenerativeModel]) -> Dict[str, Any]:
-    """Helper para chamadas Gemini, tratando bloqueios e erros."""
-    if not model: return {"text": "Modelo IA não disponível.", "error": True}
-    try:
-        response = model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
-        if not response.parts:
-            block = response.prompt_feedback.block_reason.name if hasattr(response,'prompt_feedback') and response.prompt_feedback.block_reason else "Sem conteúdo"
-            finish = response.candidates[0].finish_reason.name if hasattr(response,'candidates') and response.candidates and hasattr(response.candidates[0],'finish_reason') else "N/A"
-            return {"text": f"❌ Bloqueado/sem conteúdo. Bloqueio: {block}. Finalização: {finish}.", "error": True}
-        return {"text": response.text.strip(), "error": False}
-    except Exception as e: return {"text": f"❌ Erro API Gemini: {e}", "error": True}
-
-@st.cache_data(show_spinner="🧠 Analisando características e observações...")
-def analisar_caracteristicas_e_observacoes_gemini(_caracteristicas: Dict[str, Any], _observacoes: str, _model: Optional[genai.GenerativeModel]) -> Dict[str, Any]:
-    if not _model: return {"insights": "🤖 Análise descrição IA offline."}
-    fmt_carac = [f"- {k}: {', '.join(i for i in v if i and i!='Selecione') if isinstance(v,list) and any(i for i in v if i and i!='Selecione') else (v if isinstance(v,str) and v and v!='Selecione' else 'Não informado')}" for k,v in _caracteristicas.items()]
-    carac_txt = "\n".join(fmt_carac)
-    obs_txt = _observacoes.strip() if _observacoes else "N/A."
-    prompt = textwrap.dedent(f"""
-        Analise as características e observações de uma denúncia de buraco. Extraia insights cruciais.
-        Formato: texto claro, marcadores (-). Se não puder inferir com ALTA CONFIANÇA, indique "Não especificado/inferido".
-        Características:
-        {carac_txt}
-        Observações: "{obs_txt}"
-        Categorias para Extrair/Inferir:
-        - Severidade/Tamanho Estimado: [Consolidado]
-        - Profundidade Estimada: [Consolidado]
-        - Presença de Água/Alagamento: [Consolidado]
-        - Tráfego Estimado na Via: [Consolidado]
-        - Contexto da Via: [Consolidado]
-        - Perigos Potenciais e Impactos (Observações): [Riscos das observações]
-        - Contexto Adicional Local/Histórico (Observações): [Info das observações]
-        - Sugestões de Ação/Recursos (Observações): [Sugestões das observações]
-        - Identificadores Visuais Adicionais (Observações): [Ref. visuais das observações]
-        - Palavras-chave Principais: [3-7 palavras-chave de todos os dados]
-        Resposta limpa e estruturada.
-    """)
-    res = _call_gemini_api(prompt, _model)
-    return {"insights": res["text"]}
-
-@st.cache_data(show_spinner="🧠 Calculando Prioridade Robótica...")
-def categorizar_urgencia_gemini(_dados_denuncia: Dict[str, Any], _insights_ia_result: Dict[str, Any], _model: Optional[genai.GenerativeModel]) -> Dict[str, Any]:
-    if not _model: return {"urgencia_ia": "🤖 Sugestão urgência IA offline."}
-    carac = _dados_denuncia.get('buraco',{}).get('caracteristicas_estruturadas',{})
-    obs, ins_txt = _dados_denuncia.get('observacoes_adicionais','N/A.'), _insights_ia_result.get('insights','N/A.')
-    loc_ex = _dados_denuncia.get('localizacao_exata_processada',{}); tipo_loc, in_orig_loc = loc_ex.get('tipo','N/I'), loc_ex.get('input_original','N/I.')
-    loc_ctx = f"Localização: Tipo: {tipo_loc}."
-    if in_orig_loc!='N/I.': loc_ctx+=f" Detalhes: '{in_orig_loc}'."
-    if tipo_loc in ['Coordenadas Fornecidas/Extraídas Manualmente','Geocodificada (API)','Coordenadas Extraídas de Link (Manual)']:
-        loc_ctx+=f" Coords: {loc_ex.get('latitude')},{loc_ex.get('longitude')}. Link: {loc_ex.get('google_maps_link_gerado','N/A')}."
-    fmt_carac = [f"- {k}: {', '.join(i for i in v if i and i!='Selecione') if isinstance(v,list) and any(i for i in v if i and i!='Selecione') else (v if isinstance(v,str) and v and v!='Selecione' else 'N/I')}" for k,v in carac.items()]
-    carac_txt_prompt = "\n".join(fmt_carac)
-    prompt = textwrap.dedent(f"""
-        Sugira a MELHOR categoria de urgência para o reparo. Categorias: Baixa, Média, Alta, Imediata/Crítica.
-        Dados:
-        Local: Rua {(_dados_denuncia.get('buraco',{}).get('endereco',{})).get('rua','N/I')}, Nº Prox: {(_dados_denuncia.get('buraco',{})).get('numero_proximo','N/I')}. Cidade: {(_dados_denuncia.get('buraco',{}).get('endereco',{})).get('cidade_buraco','N/I')}, Estado: {(_dados_denuncia.get('buraco',{}).get('endereco',{})).get('estado_buraco','N/I')}.
-        {loc_ctx}
-        Características:
-        {carac_txt_prompt}
-        Observações: "{obs}"
-        Insights: {ins_txt}
-        Qual categoria e justificativa (máx. 2 frases)? Formato:
-        Categoria Sugerida: [Categoria]
-        Justificativa: [Justificativa]
-    """)
-    res = _call_gemini_api(prompt, _model)
-    return {"urgencia_ia": res["text"]}
-
-@st.cache_data(show_spinner="🧠 IA pensando em causas e ações...")
-def sugerir_causa_e_acao_gemini(_dados_denuncia: Dict[str, Any], _insights_ia_result: Dict[str, Any], _model: Optional[genai.GenerativeModel]) -> Dict[str, Any]:
-    if not _model: return {"sugestao_acao_ia": "🤖 Sugestões causa/ação IA offline."}
-    carac = _dados_denuncia.get('buraco',{}).get('caracteristicas_estruturadas',{})
-    obs, ins_txt = _dados_denuncia.get('observacoes_adicionais','N/A.'), _insights_ia_result.get('insights','N/A.')
-    fmt_carac = [f"- {k}: {', '.join(i for i in v if i and i!='Selecione') if isinstance(v,list) and any(i for i in v if i and i!='Selecione') else (v if isinstance(v,str) and v and v!='Selecione' else 'N/I')}" for k,v in carac.items()]
-    carac_txt_prompt = "\n".join(fmt_carac)
-    prompt = textwrap.dedent(f"""
-        Sugira: 1. PÓSSIVEIS CAUSAS. 2. TIPOS DE AÇÃO/REPARO. Se não houver pistas, indique "Não especificado/inferido".
-        Dados:
-        Características:
-        {carac_txt_prompt}
-        Observações: "{obs}"
-        Insights: {ins_txt}
-        Formato:
-        Possíveis Causas Sugeridas: [Causas ou 'Não especificado/inferido']
-        Sugestões de Ação/Reparo Sugeridas: [Ações ou 'Não especificado/inferido']
-    """)
-    res = _call_gemini_api(prompt, _model)
-    return {"sugestao_acao_ia": res["text"]}
-
-def gerar_resumo_completo_gemini(_dados_denuncia_completa: Dict[str, Any], _insights_ia_result: Dict[str, Any], _urgencia_ia_result: Dict[str, Any], _sugestao_acao_ia_result: Dict[str, Any], _model: Optional[genai.GenerativeModel]) -> Dict[str, Any]:
-    if not _model: return {"resumo_ia": "🤖 Resumo inteligente IA offline."}
-    den, bur, end, carac, obs = _dados_denuncia_completa.get('denunciante',{}), _dados_denuncia_completa.get('buraco',{}), _dados_denuncia_completa.get('buraco',{}).get('endereco',{}), _dados_denuncia_completa.get('buraco',{}).get('caracteristicas_estruturadas',{}), _dados_denuncia_completa.get('observacoes_adicionais','N/A.')
-    loc_ex, ins_txt, urg_ia_txt, sug_ac_txt = _dados_denuncia_completa.get('localizacao_exata_processada',{}), _insights_ia_result.get('insights','N/A.'), _urgencia_ia_result.get('urgencia_ia','N/A.'), (_sugestao_acao_ia_result or {}).get('sugestao_acao_ia','N/A.')
-    tipo_loc_proc, in_orig_loc = loc_ex.get('tipo','N/I'), loc_ex.get('input_original','N/I.')
-    mot_falha_geo = loc_ex.get('motivo_falha_geocodificacao_anterior')
-    loc_info_res = f"Localização: Tipo: {tipo_loc_proc}."
-    if tipo_loc_proc in ['Coordenadas Fornecidas/Extraídas Manualmente','Geocodificada (API)','Coordenadas Extraídas de Link (Manual)']:
-         tipo_disp = tipo_loc_proc.replace('(API)','').replace('(Manual)','').replace('Fornecidas/Extraídas','Manual')
-         loc_info_res = f"Loc. Exata: Coords {loc_ex.get('latitude')},{loc_ex.get('longitude')} (Via: {tipo_disp}). Link: {loc_ex.get('google_maps_link_gerado','N/A')}."
-    elif tipo_loc_proc == 'Descrição Manual Detalhada': loc_info_res = f"Loc. via descrição: '{loc_ex.get('descricao_manual','N/I')}'."
-    if in_orig_loc!='N/I.': loc_info_res += f" (Input: '{in_orig_loc}')"
-    if mot_falha_geo: loc_info_res += f" (Nota: {mot_falha_geo})"
-    fmt_carac = [f"- {k}: {', '.join(i for i in v if i and i!='Selecione') if isinstance(v,list) and any(i for i in v if i and i!='Selecione') else (v if isinstance(v,str) and v and v!='Selecione' else 'N/I')}" for k,v in carac.items()]
-    carac_txt_prompt = "\n".join(fmt_carac)
-    data_h = _dados_denuncia_completa.get('metadata',{}).get('data_hora_utc','N/R')
-    prompt = textwrap.dedent(f"""
-        Resumo narrativo conciso (máx. 10-12 frases) da denúncia. Formal, objetivo.
-        Inclua: Denunciante, localização (rua, ref, bairro, cidade, estado, CEP), loc. EXATA, lado rua, características, observações, Análise Texto, Urgência IA, Causas/Ação IA.
-        Dados:
-        Denunciante: {den.get('nome','N/I')}, de {den.get('cidade_residencia','N/I')}.
-        Endereço: Rua {end.get('rua','N/I')}, Nº Prox: {bur.get('numero_proximo','N/I')}. Bairro: {end.get('bairro','N/I')}. Cidade: {end.get('cidade_buraco','N/I')}, Est: {end.get('estado_buraco','N/I')}. CEP: {bur.get('cep_informado','N/I')}.
-        Lado Rua: {bur.get('lado_rua','N/I')}.
-        Loc. Exata: {loc_info_res}
-        Características:
-        {carac_txt_prompt}
-        Observações: "{obs}"
-        Insights Análise Texto: {ins_txt}
-        Sugestão Urgência IA: {urg_ia_txt}
-        Sugestões Causa/Ação IA: {sug_ac_txt}
-        Resumo em português. Comece "Relatório Krateras: Denúncia de buraco..."
-    """)
-    res = _call_gemini_api(prompt, _model)
-    return {"resumo_ia": res["text"]}
+@st.cache_resource
+def iniciar_aquecimento(api_key: Optional[str]) -> threading.Thread:
+    # Uma vez por processo, em segundo plano: endpoint /metrics, descoberta de modelos, modelos Gemini e caches/índices locais
+    def _aquecer():
+        iniciar_servidor_metricas()
+        from model_registry import aquecer
+        aquecer(api_key)
+    t = threading.Thread(target=_aquecer, name="krateras-aquecimento", daemon=True); t.start()
+    return t
+
+def obter_job_runner():
+    from job_runner import get_job_runner  # puxa o pipeline de IA: só nas etapas que precisam
+    return get_job_runner()
+
+@st.fragment(run_every=INTERVALO_POLLING_JOB_S)
+def acompanhar_job_ia(job_id: str, etapas: list) -> None:
+    # Só este trecho é reexecutado a cada INTERVALO_POLLING_JOB_S (sem prender o script); ao terminar o job, o app roda de novo
+    job = obter_job_runner().obter(job_id)
+    snap = job.snapshot() if job else {'status': 'erro', 'parciais': {}, 'etapas': {}}
+    for etapa in etapas:
+        st.markdown(f"**{ETAPAS_STREAMING[etapa]}**")
+        if etapa in snap['parciais']: st.markdown(snap['parciais'][etapa])
+        elif etapa in snap['etapas']: st.caption(f"Etapa concluída ({snap['etapas'][etapa]['status']}).")
+        else: st.caption("⏳ Aguardando...")
+    if snap['status'] in ('concluido', 'erro'): st.rerun()
 
 def next_step():
     steps = ['start','collect_denunciante','collect_address','collect_buraco_details_and_location','processing_ia','show_report']
@@ -268,12 +155,18 @@ def prev_step():
         if idx > 0: st.session_state.step = steps[idx-1]; st.rerun()
     except ValueError: st.session_state.step = steps[0]; st.rerun()
 
+iniciar_aquecimento(st.secrets.get('GOOGLE_API_KEY'))
+# Sessão nova (refresh do navegador) com ?job=...: retoma o job de IA em andamento ou já concluído
+if st.session_state.step == 'start' and (id_job_url := st.query_params.get('job')) and (job_url := obter_job_runner().obter(id_job_url)):
+    st.session_state.update({'job_ia_id': id_job_url, 'denuncia_completa': job_url.denuncia, 'step': 'processing_ia',
+                             'geocoding_api_key': st.secrets.get('geocoding_api_key'), 'api_keys_loaded': True})
+    st.session_state.gemini_model = init_gemini_text_model(st.secrets.get('GOOGLE_API_KEY'))
 st.subheader("O Especialista Robótico de Denúncia de Buracos")
 
 if st.session_state.step == 'start':
     st.write("Olá! Krateras v10.1! Sua missão: denunciar buracos. Fluxo otimizado, imagem, geolocalização (Google/OSM). IA (Gemini), APIs (Geocoding, ViaCEP).")
     if st.button("Iniciar Missão Denúncia!"):
-        st.session_state.denuncia_completa = {"metadata":{"data_hora_utc":datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")}}
+        st.session_state.denuncia_completa = {"metadata":{"data_hora_utc":datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),"id_denuncia":uuid.uuid4().hex}}
         st.session_state.update({'cep_input_consolidated':'','cep_error_consolidated':False,'cep_success_message':'','cep_error_message':''})
         if 'buraco' in st.session_state: del st.session_state.buraco
         gemini_key, geocoding_key = load_api_keys()
@@ -296,6 +189,7 @@ elif st.session_state.step == 'collect_denunciante':
     st.button("Voltar", on_click=prev_step)
 
 elif st.session_state.step == 'collect_address':
+    from geo_services import buscar_cep
     st.header("--- 🚧 Endereço Base do Buraco ---")
     if 'buraco' not in st.session_state: st.session_state.buraco = {'endereco':{}}
     if 'endereco' not in st.session_state.buraco: st.session_state.buraco['endereco'] = {}
@@ -313,7 +207,7 @@ elif st.session_state.step == 'collect_address':
              st.session_state.cep_success_message, st.session_state.cep_error_message = '', ''
              if not st.session_state.cep_input_consolidated: st.session_state.cep_error_consolidated,st.session_state.cep_error_message=True,"❗ Digite CEP."
              else:
-                 with st.spinner("⏳ Buscando..."): data_cep_res = buscar_cep_uncached(st.session_state.cep_input_consolidated)
+                 with st.spinner("⏳ Buscando..."): data_cep_res = buscar_cep(st.session_state.cep_input_consolidated)
                  if 'erro' in data_cep_res: st.session_state.cep_error_consolidated,st.session_state.cep_error_message=True,f"❌ {data_cep_res['erro']}"
                  else:
                      st.session_state.cep_error_consolidated,st.session_state.cep_success_message=False,"✅ Endereço Encontrado!"
@@ -341,6 +235,7 @@ elif st.session_state.step == 'collect_address':
     st.button("Voltar", on_click=prev_step)
 
 elif st.session_state.step == 'collect_buraco_details_and_location':
+    from geo_services import processar_localizacao_exata
     st.header("--- 🚧 Detalhes Finais e Localização Exata ---")
     bur_data_curr = st.session_state.denuncia_completa.get('buraco',{})
     end_base = bur_data_curr.get('endereco',{})
@@ -365,7 +260,7 @@ elif st.session_state.step == 'collect_buraco_details_and_location':
              st.selectbox("Água/Alagamento:", opts_agua, key='a_b'); st.selectbox("Tráfego Via:", opts_traf, key='traf_b_k_f'); st.multiselect("Contexto Via:", opts_ctx, key='c_b')
         st.subheader("✍️ Localização Exata e Outros"); k_np,k_lr,k_lm,k_ob = 'npbk','lrbk','lmbk','obk'
         st.text_input("Nº próximo/referência (ESSENCIAL!):",key=k_np); st.text_input("Lado da rua:",key=k_lr)
-        st.markdown("""<p style="font-weight:bold;">Loc. EXATA (opc, recomendado):</p><p>COORDS (Lat,Long) ou LINK Maps. Ou DESCRIÇÃO DETALHADA.</p>""",unsafe_allow_html=True)
+        st.markdown("""<p style="font-weight:bold;">Loc. EXATA (opc, recomendado):</p><p>COORDS (-23.5505,-46.6333 ou 23°33'01"S 46°38'00"W), PLUS CODE ou LINK (Google Maps, Waze, OpenStreetMap, geo:). Ou DESCRIÇÃO DETALHADA.</p>""",unsafe_allow_html=True)
         st.text_input("Coords/Link/Descrição:",key=k_lm)
         st.subheader("📷 Foto (Opcional)"); upl_img = st.file_uploader("Carregar Imagem:",type=['jpg','jpeg','png','webp'],key='img_b_k')
         if upl_img: st.info(f"'{upl_img.name}' carregada.")
@@ -387,74 +282,51 @@ elif st.session_state.step == 'collect_buraco_details_and_location':
                     'observacoes_adicionais':st.session_state[k_ob].strip()})
                 st.session_state.denuncia_completa['buraco']['imagem_denuncia']=None
                 if upl_img:
-                    try: st.session_state.denuncia_completa['buraco']['imagem_denuncia'] = {"filename":upl_img.name,"type":upl_img.type,"bytes":upl_img.getvalue()}
+                    try: st.session_state.denuncia_completa['buraco']['imagem_denuncia'] = get_report_store().guardar_imagem(upl_img.name, upl_img.type, upl_img.getvalue())
                     except Exception as e: st.error(f"❌ Erro imagem: {e}."); st.session_state.denuncia_completa['buraco']['imagem_denuncia']={"erro":f"Erro: {e}"}
-                st.session_state.denuncia_completa['localizacao_exata_processada']={"tipo":"Não informada"}
-                t_geo,geo_ok,geo_r=False,False,{}
-                r_b,c_b,e_b=end_base.get('rua'),end_base.get('cidade_buraco'),end_base.get('estado_buraco')
-                num_ref_g = st.session_state[k_np].strip()
-                tem_d_g = (st.session_state.geocoding_api_key and r_b and num_ref_g and c_b and e_b)
-                if tem_d_g:
-                    t_geo=True
-                    with st.spinner("⏳ Geocodificando..."): geo_r=geocodificar_endereco_uncached(r_b,num_ref_g,c_b,e_b,st.session_state.geocoding_api_key)
-                    if 'erro' not in geo_r:
-                        geo_ok=True
-                        st.session_state.denuncia_completa['localizacao_exata_processada'] = {"tipo":"Geocodificada (API)","latitude":geo_r['latitude'],"longitude":geo_r['longitude'],"endereco_formatado_api":geo_r.get('endereco_formatado_api',''),"google_maps_link_gerado":geo_r['google_maps_link_gerado'],"google_embed_link_gerado":geo_r.get('google_embed_link_gerado'),"input_original":num_ref_g}
-                loc_m_v = st.session_state[k_lm].strip(); lat_m,lon_m,tipo_m_p=None,None,"Descrição Manual Detalhada"
-                if loc_m_v:
-                     mc=re.search(r'(-?\d+\.\d+)[,\s]+(-?\d+\.\d+)',loc_m_v)
-                     if mc:
-                         try: t_la,t_lo=float(mc.group(1)),float(mc.group(2)); 
-                         except ValueError: t_la,t_lo = None,None # Garantir que são None se falhar
-                         if t_la is not None and -90<=t_la<=90 and t_lo is not None and -180<=t_lo<=180: lat_m,lon_m,tipo_m_p=t_la,t_lo,"Coordenadas Fornecidas/Extraídas Manualmente"
-                     if lat_m is None and loc_m_v.startswith("http"):
-                          mml=re.search(r'(?:/@|/search/\?api=1&query=)(-?\d+\.?\d*),(-?\d+\.?\d*)',loc_m_v)
-                          if mml:
-                              try: t_la,t_lo=float(mml.group(1)),float(mml.group(2)); 
-                              except ValueError: t_la,t_lo = None,None
-                              if t_la is not None and -90<=t_la<=90 and t_lo is not None and -180<=t_lo<=180: lat_m,lon_m,tipo_m_p=t_la,t_lo,"Coordenadas Extraídas de Link (Manual)"
-                     if lat_m and lon_m:
-                         st.session_state.denuncia_completa['localizacao_exata_processada']={"tipo":tipo_m_p,"input_original":loc_m_v,"latitude":lat_m,"longitude":lon_m,"google_maps_link_gerado":f"https://www.google.com/maps/search/?api=1&query={lat_m},{lon_m}","google_embed_link_gerado":f"https://www.google.com/maps/embed/v1/place?key={st.session_state.geocoding_api_key}&q={lat_m},{lon_m}" if st.session_state.geocoding_api_key else None}; geo_ok=True
-                     elif loc_m_v and not geo_ok: st.session_state.denuncia_completa['localizacao_exata_processada']={"tipo":"Descrição Manual Detalhada","input_original":loc_m_v,"descricao_manual":loc_m_v}
-                f_loc_d = st.session_state.denuncia_completa.get('localizacao_exata_processada',{}); f_loc_t=f_loc_d.get('tipo')
-                if f_loc_t not in ['Coordenadas Fornecidas/Extraídas Manualmente','Coordenadas Extraídas de Link (Manual)','Geocodificada (API)']:
-                     rsns=[];
-                     if t_geo and 'erro' in geo_r: rsns.append(f"GeoAutoFalhou:{geo_r['erro']}")
-                     elif not st.session_state.geocoding_api_key: rsns.append("ChaveGeoAPInãoFornecida.")
-                     elif st.session_state.geocoding_api_key and not tem_d_g: rsns.append("DadosInsuficientesGeoAuto.")
-                     if loc_m_v and not (lat_m and lon_m): rsns.append("CoordsNãoExtraídasInputManual.")
-                     if rsns: f_loc_d['motivo_falha_geocodificacao_anterior']=" / ".join(rsns)
-                     elif f_loc_t=="Não informada" and not f_loc_d.get('motivo_falha_geocodificacao_anterior'): f_loc_d['motivo_falha_geocodificacao_anterior']="CoordsNãoObtidas."
-                     st.session_state.denuncia_completa['localizacao_exata_processada']=f_loc_d
+                with st.spinner("⏳ Processando localização..."):
+                    st.session_state.denuncia_completa['localizacao_exata_processada'] = processar_localizacao_exata(end_base, st.session_state[k_np], st.session_state[k_lm], st.session_state.geocoding_api_key)
                 next_step()
     if st.button("Voltar",on_click=prev_step,key="v_det_btn_k"):pass
 
 elif st.session_state.step == 'processing_ia':
     st.header("--- 🧠 Processamento Robótico de IA ---")
-    bur_data,img_data_dict = st.session_state.denuncia_completa.get('buraco',{}), st.session_state.denuncia_completa.get('buraco',{}).get('imagem_denuncia')
-    carac,obs = bur_data.get('caracteristicas_estruturadas',{}), bur_data.get('observacoes_adicionais','')
-    st.session_state.denuncia_completa['resultado_analise_visual_krateras'] = None
-    if img_data_dict and 'bytes' in img_data_dict:
-        st.info("👁️‍🗨️ Iniciando Análise Visual..."); res_an_vis=processar_analise_imagem(img_data_dict)
-        st.session_state.denuncia_completa['resultado_analise_visual_krateras']=res_an_vis
-        if res_an_vis and res_an_vis.get("status")!="error" and "nivel_severidade" in res_an_vis:
-            st.markdown("---");st.subheader("Feedback Adicional (Análise Visual)");mostrar_feedback_analise(res_an_vis["nivel_severidade"])
-        elif res_an_vis and res_an_vis.get("status")=="error": st.caption("Nota: Análise visual reportou erro.")
-        st.markdown("---")
+    img_data_dict = st.session_state.denuncia_completa.get('buraco',{}).get('imagem_denuncia')
+    if tem_imagem(img_data_dict): st.info("👁️‍🗨️ Análise Visual e análises de texto em paralelo...")
+    else: st.info("ℹ️ Nenhuma imagem, análise visual pulada.")
+    # O pipeline roda num job em segundo plano; reruns e refresh reencontram o mesmo job (sem repetir chamadas às APIs)
+    from image_analyzer import exibir_resultado_analise, mostrar_feedback_analise
+    runner = obter_job_runner()
+    if not st.session_state.get('job_ia_id') or runner.obter(st.session_state.job_ia_id) is None:
+        st.session_state.job_ia_id = runner.submeter(st.session_state.denuncia_completa, st.session_state.gemini_model, st.secrets.get('GOOGLE_API_KEY'))
+        st.query_params['job'] = st.session_state.job_ia_id
+    job = runner.obter(st.session_state.job_ia_id)
+    st.caption(f"Job `{job.id}`: as análises aparecem abaixo enquanto são geradas. Recarregar a página não interrompe o processamento.")
+    etapas = [e for e in ETAPAS_STREAMING if e != 'analise_visual' or tem_imagem(img_data_dict)]
+    snap = job.snapshot()
+    if snap['status'] not in ('concluido', 'erro'):
+        acompanhar_job_ia(job.id, etapas)
+    elif snap['status'] == 'erro':
+        st.error(f"❌ Falha no processamento de IA: {snap['erro']}")
+        if st.button("Tentar novamente", key="retry_job_ia"): del st.session_state.job_ia_id; st.rerun()
     else:
-        st.info("ℹ️ Nenhuma imagem, análise visual pulada.")
-        st.session_state.denuncia_completa['resultado_analise_visual_krateras'] = {"status":"skipped","analise_visual":"Nenhuma imagem.","timestamp":datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")}
-    fbks={'insights_ia':{"insights":"Análise IA Texto não realizada/erro."},'urgencia_ia':{"urgencia_ia":"Sugestão urgência IA Texto não gerada/erro."},'sugestao_acao_ia':{"sugestao_acao_ia":"Sugestões causa/ação IA Texto não geradas/erro."},'resumo_ia':{"resumo_ia":"Resumo IA Texto não gerado/erro."}}
-    for k,v in fbks.items():
-        if k not in st.session_state.denuncia_completa:st.session_state.denuncia_completa[k]=v.copy()
-    with st.spinner("Executando análises IA (Texto)..."):
-        st.session_state.denuncia_completa['insights_ia']=analisar_caracteristicas_e_observacoes_gemini(carac,obs,st.session_state.gemini_model)
-        st.session_state.denuncia_completa['urgencia_ia']=categorizar_urgencia_gemini(st.session_state.denuncia_completa,st.session_state.denuncia_completa['insights_ia'],st.session_state.gemini_model)
-        st.session_state.denuncia_completa['sugestao_acao_ia']=sugerir_causa_e_acao_gemini(st.session_state.denuncia_completa,st.session_state.denuncia_completa['insights_ia'],st.session_state.gemini_model)
-        st.session_state.denuncia_completa['resumo_ia']=gerar_resumo_completo_gemini(st.session_state.denuncia_completa,st.session_state.denuncia_completa['insights_ia'],st.session_state.denuncia_completa['urgencia_ia'],st.session_state.denuncia_completa['sugestao_acao_ia'],st.session_state.gemini_model)
-    next_step()
+        paineis = {}
+        for etapa in etapas: st.markdown(f"**{ETAPAS_STREAMING[etapa]}**"); paineis[etapa] = st.empty()
+        res_pipeline = st.session_state.denuncia_completa = snap['denuncia']
+        for etapa, (chave, sub) in CHAVES_TEXTO_IA.items(): paineis[etapa].markdown((res_pipeline.get(chave) or {}).get(sub, 'N/A'))
+        res_an_vis = res_pipeline['resultado_analise_visual_krateras']
+        if tem_imagem(img_data_dict):
+            exibir_resultado_analise(res_an_vis)
+            if res_an_vis and res_an_vis.get("status")!="error" and "nivel_severidade" in res_an_vis:
+                st.markdown("---");st.subheader("Feedback Adicional (Análise Visual)");mostrar_feedback_analise(res_an_vis["nivel_severidade"])
+            elif res_an_vis and res_an_vis.get("status")=="error": st.caption("Nota: Análise visual reportou erro.")
+            st.markdown("---")
+        next_step()
 
 elif st.session_state.step == 'show_report':
+    from geo_services import TIPOS_LOC_COM_COORDS
+    from image_analyzer import mostrar_feedback_analise
+    inicio_render = time.perf_counter()
     st.header("📊 RELATÓRIO FINAL DA DENÚNCIA KRATERAS 📊"); st.balloons()
     st.success("✅ MISSÃO CONCLUÍDA! RELATÓRIO GERADO. ✅")
     dados = st.session_state.denuncia_completa
@@ -462,7 +334,7 @@ elif st.session_state.step == 'show_report':
     loc_exata = dados.get('localizacao_exata_processada',{})
     res_analise_vis_rep = dados.get('resultado_analise_visual_krateras') # resultado_analise_visual_krateras é a chave correta
     ins_ia, urg_ia, sug_ia, res_ia = dados.get('insights_ia',{}), dados.get('urgencia_ia',{}), dados.get('sugestao_acao_ia',{}), dados.get('resumo_ia',{})
-    st.write(f"📅 Data/Hora (UTC): **{dados.get('metadata',{}).get('data_hora_utc','N/R')}**"); st.markdown("---")
+    st.write(f"📅 Data/Hora (UTC): **{dados.get('metadata',{}).get('data_hora_utc','N/R')}**"); st.caption(f"🗂️ ID da denúncia: `{dados.get('metadata',{}).get('id_denuncia','N/R')}`"); st.markdown("---")
 
     with st.expander("👤 Denunciante", expanded=True):
         st.write(f"**Nome:** {den.get('nome','N/I')}"); st.write(f"**Idade:** {den.get('idade') if den.get('idade') is not None else 'N/I'}")
@@ -488,7 +360,9 @@ elif st.session_state.step == 'show_report':
 
     with st.expander("📍 Localização Exata Processada", expanded=True):
         tipo_loc_r = loc_exata.get('tipo','N/I'); st.write(f"**Tipo Coleta:** {tipo_loc_r}")
-        if tipo_loc_r in ['Coordenadas Fornecidas/Extraídas Manualmente', 'Geocodificada (API)', 'Coordenadas Extraídas de Link (Manual)']:
+        cluster_r = dados.get('cluster_buracos')
+        if cluster_r and not cluster_r.get('novo'): st.info(f"🔁 Este buraco já foi denunciado: anexado a um grupo de {cluster_r.get('n_denuncias')} denúncias" + (f" a {cluster_r.get('distancia_m')} m daqui." if cluster_r.get('distancia_m') is not None else ".") + (" Análises de IA reaproveitadas." if cluster_r.get('analises_reaproveitadas') else ""))
+        if tipo_loc_r in TIPOS_LOC_COM_COORDS:
             lat_r, lon_r = loc_exata.get('latitude'), loc_exata.get('longitude')
             if lat_r is not None and lon_r is not None:
                  st.write(f"**Coords:** `{lat_r}, {lon_r}`"); st.subheader("Visualizações de Mapa")
@@ -508,9 +382,12 @@ elif st.session_state.step == 'show_report':
                  except Exception as e_o: st.error(f"❌ Erro mapa OSM: {e_o}")
                  st.markdown(f"[Abrir no OpenStreetMap.org](https://www.openstreetmap.org/?mlat={lat_r}&mlon={lon_r}#map=18/{lat_r}/{lon_r})")
                  st.markdown("---"); st.write("**OpenStreetMap (Simplificado):**")
-                 try: st.map(pd.DataFrame({'lat':[lat_r],'lon':[lon_r]}), zoom=17)
+                 try: import pandas as pd; st.map(pd.DataFrame({'lat':[lat_r],'lon':[lon_r]}), zoom=17)
                  except Exception as e_stmap: st.error(f"❌ Erro mapa OSM simplificado: {e_stmap}")
                  if loc_exata.get('endereco_formatado_api'): st.write(f"**Endereço Formatado (API):** {loc_exata.get('endereco_formatado_api')}")
+                 if loc_exata.get('endereco_formatado_local'): st.write(f"**Endereço pelo Índice Local de Ruas:** {loc_exata.get('endereco_formatado_local')} (~{loc_exata.get('endereco_local',{}).get('distancia_m','?')} m)")
+                 diverg_l = [c for c, s_c in (loc_exata.get('conferencia_endereco') or {}).items() if s_c == 'diverge']
+                 if diverg_l: st.warning(f"⚠️ Endereço informado diverge do índice local de ruas em: {', '.join(diverg_l)}.")
                  if loc_exata.get('input_original'): st.write(f"(Input Original Loc. Exata: `{loc_exata.get('input_original', 'N/I')}`)")
         elif tipo_loc_r == 'Descrição Manual Detalhada':
             st.info(loc_exata.get('descricao_manual','N/I')); st.write(f"(Input Original Loc. Exata: `{loc_exata.get('input_original', 'N/I')}`)")
@@ -522,9 +399,9 @@ elif st.session_state.step == 'show_report':
         imagem_original_data = dados.get('buraco', {}).get('imagem_denuncia') # Pega os dados da imagem original
 
         # 1. Tenta exibir a imagem original primeiro
-        if imagem_original_data and 'bytes' in imagem_original_data:
+        if tem_imagem(imagem_original_data):
             try:
-                st.image(io.BytesIO(imagem_original_data['bytes']), 
+                st.image(io.BytesIO(bytes_imagem(imagem_original_data)), 
                          caption=f"Imagem original: {imagem_original_data.get('filename', 'Imagem Carregada')}", 
                          use_container_width=True)
             except Exception as e_img_display_report:
@@ -581,7 +458,7 @@ elif st.session_state.step == 'show_report':
             elif status_vis == "error":
                 mensagem_erro_visual = res_analise_vis_rep.get('analise_visual', 'Detalhe do erro não disponível.')
                 st.error(f"A análise visual da imagem encontrou um erro: {mensagem_erro_visual}")
-                if not (imagem_original_data and 'bytes' in imagem_original_data): # Se não tinha imagem original
+                if not (tem_imagem(imagem_original_data)): # Se não tinha imagem original
                     st.caption("Isso pode ter ocorrido porque nenhuma imagem foi fornecida ou houve falha no carregamento.")
             
             elif status_vis == "skipped":
@@ -592,20 +469,20 @@ elif st.session_state.step == 'show_report':
             else: # Status não é 'success', 'error', nem 'skipped'
                 st.warning("⚠️ Estado da análise visual indeterminado.")
                 # Adicionar contexto se não havia imagem
-                if not (imagem_original_data and 'bytes' in imagem_original_data):
+                if not (tem_imagem(imagem_original_data)):
                      st.caption("(Contexto: Nenhuma imagem foi fornecida para esta denúncia.)")
         else: 
             # res_analise_vis_rep é None ou não existe
             st.warning("⚠️ Dados da análise visual da imagem não encontrados no relatório.")
             # Verificar novamente se a imagem original existia para dar mais contexto
-            if not (imagem_original_data and 'bytes' in imagem_original_data):
+            if not (tem_imagem(imagem_original_data)):
                  st.caption("(Contexto: Nenhuma imagem foi fornecida para esta denúncia.)")
     # --- FIM DA SEÇÃO DE ANÁLISE VISUAL MODIFICADA ---
 
     st.markdown("---"); st.subheader("🤖 Análises Robóticas de IA (Google Gemini Text)")
     if st.session_state.gemini_model:
         with st.expander("🧠 Análise Características/Observações (IA Gemini Text)", expanded=True): st.markdown(ins_ia.get('insights','N/A.'))
-        with st.expander("🚦 Sugestão de Urgência (IA Gemini Text)", expanded=True): st.markdown(urg_ia.get('urgencia_ia','N/A.'))
+        with st.expander("🚦 Sugestão de Urgência (Regras Locais)" if urg_ia.get('origem') == ORIGEM_REGRAS else "🚦 Sugestão de Urgência (IA Gemini Text)", expanded=True): st.markdown(urg_ia.get('urgencia_ia','N/A.'))
         with st.expander("🛠️ Sugestões Causa/Ação (IA Gemini Text)", expanded=True): st.markdown(sug_ia.get('sugestao_acao_ia','N/A.'))
         st.markdown("---"); st.subheader("📜 Resumo Narrativo Inteligente (IA Gemini Text)")
         st.markdown(res_ia.get('resumo_ia','N/A.'))
@@ -614,9 +491,10 @@ elif st.session_state.step == 'show_report':
     if st.button("Iniciar Nova Denúncia", key="nova_den_rep_key"):
         keys_del = [k for k in st.session_state.keys() if k not in ['gemini_model','geocoding_api_key']]
         for k in keys_del: del st.session_state[k]
+        st.query_params.clear()
         st.session_state.step = 'start'; st.rerun()
     with st.expander("🔌 Ver Dados Brutos (JSON)"):
-        dados_json = dados.copy() # Trabalhar com uma cópia para não alterar o session_state
+        dados_json = dados.copy() # Cópia rasa: só o que for alterado abaixo é copiado, o session_state fica intacto
         
         # Omitir bytes da imagem principal da denúncia
         if 'buraco' in dados_json and 'imagem_denuncia' in dados_json['buraco']:
@@ -624,13 +502,14 @@ elif st.session_state.step == 'show_report':
              if img_d_main_json and isinstance(img_d_main_json, dict) and 'bytes' in img_d_main_json:
                   img_d_copy_main_json = img_d_main_json.copy()
                   img_d_copy_main_json['bytes'] = f"<dados binários omitidos - {len(img_d_main_json['bytes'])} bytes>"
-                  dados_json['buraco']['imagem_denuncia'] = img_d_copy_main_json
+                  dados_json['buraco'] = {**dados_json['buraco'], 'imagem_denuncia': img_d_copy_main_json}
         
         # O resultado da análise visual já deve ser JSON-friendly pelo image_analyzer.py
         # Não precisa de tratamento especial aqui, a menos que o image_analyzer.py retorne bytes.
         # No nosso caso, ele retorna o texto da análise e metadados.
 
         st.json(dados_json)
+    observar_etapa("renderizacao_relatorio", time.perf_counter() - inicio_render)
 
 if __name__ == "__main__":
     pass
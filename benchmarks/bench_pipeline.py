@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark ponta a ponta do Krateras contra servidores falsos (ver `fake_servers`).
+
+Gera N denúncias sintéticas (CEP sem endereço, número e imagem própria), processa todas com
+`processar_registro` (ViaCEP, geocodificação, análise visual e etapas de texto) com a concorrência
+pedida e informa relatórios/s, latência ponta a ponta e por etapa (p50/p95/p99) e o pico de RSS.
+Os dados locais (caches, índices, histórico) ficam num diretório temporário novo a cada execução,
+então nenhum resultado vem de cache de execuções anteriores.
+
+    python -m benchmarks.bench_pipeline -n 200 --concorrencia 16 --saida-json atual.json
+    python -m benchmarks.bench_pipeline -n 200 --concorrencia 16 --comparar atual.json
+"""
+
+import io
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fake_servers import ServidoresFalsos, build_parser as parser_servidores, configs_de_args
+
+logger = logging.getLogger("krateras.benchmark")
+
+
+def percentil(valores: List[float], q: float) -> Optional[float]:
+    """Percentil exato (interpolação linear) de uma lista de valores."""
+    if not valores: return None
+    ordenados = sorted(valores)
+    pos = (len(ordenados) - 1) * q
+    i = int(pos)
+    if i + 1 >= len(ordenados): return ordenados[-1]
+    return ordenados[i] + (ordenados[i + 1] - ordenados[i]) * (pos - i)
+
+
+def pico_rss_mb() -> float:
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo / (1024 * 1024) if sys.platform == 'darwin' else maximo / 1024  # macOS em bytes, Linux em KB
+
+
+def gerar_imagens(diretorio: str, n: int, semente: int) -> List[str]:
+    """Imagens JPEG distintas (ruído + retângulo em posição aleatória), acima do mínimo de qualidade do analisador."""
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(semente)
+    caminhos = []
+    for i in range(n):
+        img = Image.merge("RGB", [Image.effect_noise((480, 360), rnd.uniform(40, 90)) for _ in range(3)])
+        x, y = rnd.randint(0, 380), rnd.randint(0, 260)
+        ImageDraw.Draw(img).rectangle((x, y, x + rnd.randint(40, 100), y + rnd.randint(40, 100)), fill=(rnd.randint(0, 255),) * 3)
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=85)
+        caminho = os.path.join(diretorio, f"buraco_{i:05d}.jpg")
+        with open(caminho, 'wb') as f:
+            f.write(buf.getvalue())
+        caminhos.append(caminho)
+    return caminhos
+
+
+def gerar_registros(n: int, imagens: List[str], semente: int) -> List[Dict[str, Any]]:
+    """Registros de entrada do motor: só CEP e número, para passar pelo ViaCEP e pela geocodificação."""
+    rnd = random.Random(semente)
+    return [{"id": f"bench-{i}", "nome": "Benchmark", "cep": f"{rnd.randint(1000000, 99999999):08d}",
+             "numero_proximo": str(rnd.randint(1, 3000)), "lado_rua": rnd.choice(["Lado par", "Lado ímpar"]),
+             "tamanho": "Médio", "perigo": "Alto", "profundidade": "Moderada", "trafego": "Intenso",
+             "contexto": "Perto de escola", "observacoes": "Denúncia sintética de benchmark.",
+             "imagem": imagens[i % len(imagens)]} for i in range(n)]
+
+
+def _teve_erro(denuncia: Dict[str, Any]) -> bool:
+    if (denuncia.get('resultado_analise_visual_krateras') or {}).get('status') == 'error': return True
+    textos = [denuncia.get(k) for k in ('insights_ia', 'urgencia_ia', 'sugestao_acao_ia', 'resumo_ia')]
+    return any(isinstance(t, dict) and any(str(v).startswith('❌') for v in t.values()) for t in textos)
+
+
+def executar(args) -> Dict[str, Any]:
+    servidores = ServidoresFalsos(configs_de_args(args))
+    with tempfile.TemporaryDirectory(prefix="krateras-bench-") as tmp, servidores as env:
+        # Tudo antes do primeiro import do Krateras: settings/limitadores leem o ambiente na importação
+        os.environ.update(env)
+        os.environ.update({"KRATERAS_DATA_DIR": os.path.join(tmp, "dados"), "KRATERAS_METRICS_PORT": "0",
+                           "KRATERAS_GEMINI_RPM": str(args.gemini_rpm), "KRATERAS_GEOCODING_QPS": str(args.geocoding_qps),
+                           "GOOGLE_API_KEY": "chave-benchmark", "GEOCODING_API_KEY": "chave-benchmark"})
+        if args.modo_texto: os.environ["KRATERAS_MODO_TEXTO"] = args.modo_texto
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from krateras_engine import EngineConfig, processar_registro
+        from metrics import get_metricas
+
+        imagens = gerar_imagens(tmp, min(args.relatorios, args.imagens_distintas), args.semente)
+        registros = gerar_registros(args.relatorios, imagens, args.semente)
+
+        inicio_aquecimento = time.perf_counter()
+        config = EngineConfig.from_env(usar_ia=True)
+        config.max_workers_ia = args.workers_ia
+        aquecimento_s = time.perf_counter() - inicio_aquecimento
+        get_metricas().limpar()
+
+        latencias: List[float] = []
+
+        def _um(registro: Dict[str, Any]) -> bool:
+            t0 = time.perf_counter()
+            try:
+                ok = not _teve_erro(processar_registro(registro, config))
+            except Exception as e:
+                logger.error(f"Registro {registro['id']} falhou: {e}")
+                ok = False
+            latencias.append(time.perf_counter() - t0)
+            return ok
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concorrencia, thread_name_prefix="krateras-bench") as executor:
+            erros = sum(1 for ok in executor.map(_um, registros) if not ok)
+        duracao_s = time.perf_counter() - inicio
+
+        return {
+            "parametros": {k: v for k, v in vars(args).items() if k not in ("saida_json", "comparar")},
+            "relatorios": len(registros), "relatorios_com_erro": erros, "duracao_s": round(duracao_s, 3),
+            "aquecimento_s": round(aquecimento_s, 3), "relatorios_por_s": round(len(registros) / duracao_s, 3),
+            "latencia_s": {f"p{int(q * 100)}": round(percentil(latencias, q), 4) for q in (0.5, 0.95, 0.99)},
+            "etapas": get_metricas().resumo(), "pico_rss_mb": round(pico_rss_mb(), 1),
+            "servidores": servidores.estatisticas(),
+        }
+
+
+def imprimir(resultado: Dict[str, Any]) -> None:
+    lat = resultado["latencia_s"]
+    print(f"\nRelatórios: {resultado['relatorios']} ({resultado['relatorios_com_erro']} com erro) em {resultado['duracao_s']}s "
+          f"| {resultado['relatorios_por_s']} relatórios/s | aquecimento {resultado['aquecimento_s']}s | pico RSS {resultado['pico_rss_mb']} MB")
+    print(f"Latência ponta a ponta: p50 {lat['p50']}s | p95 {lat['p95']}s | p99 {lat['p99']}s\n")
+    print(f"{'etapa':<24}{'resultado':<12}{'n':>7}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}")
+    for l in resultado["etapas"]:
+        print(f"{l['etapa']:<24}{l['resultado']:<12}{l['contagem']:>7}{l['p50_s']:>10}{l['p95_s']:>10}{l['p99_s']:>10}")
+    print(f"\nRespostas dos servidores falsos: {json.dumps(resultado['servidores'])}")
+
+
+def comparar(atual: Dict[str, Any], base: Dict[str, Any], tolerancia: float) -> List[str]:
+    """Regressões acima da tolerância: vazão menor ou p95/p99 ponta a ponta e pico de RSS maiores."""
+    regressoes = []
+    if atual["relatorios_por_s"] < base["relatorios_por_s"] * (1 - tolerancia):
+        regressoes.append(f"vazão {atual['relatorios_por_s']} < {base['relatorios_por_s']} relatórios/s")
+    for q in ("p95", "p99"):
+        if atual["latencia_s"][q] > base["latencia_s"][q] * (1 + tolerancia):
+            regressoes.append(f"latência {q} {atual['latencia_s'][q]}s > {base['latencia_s'][q]}s")
+    if atual["pico_rss_mb"] > base["pico_rss_mb"] * (1 + tolerancia):
+        regressoes.append(f"pico RSS {atual['pico_rss_mb']} MB > {base['pico_rss_mb']} MB")
+    return regressoes
+
+
+def build_parser():
+    parser = parser_servidores()
+    parser.description = "Benchmark ponta a ponta do Krateras contra servidores falsos."
+    parser.add_argument("-n", "--relatorios", type=int, default=100, help="Denúncias processadas (padrão: 100).")
+    parser.add_argument("--concorrencia", type=int, default=8, help="Denúncias processadas simultaneamente (padrão: 8).")
+    parser.add_argument("--workers-ia", type=int, default=4, help="Threads de IA por denúncia (padrão: 4).")
+    parser.add_argument("--modo-texto", choices=["etapas", "unico"], help="Modo das etapas de texto (padrão: o do ambiente).")
+    parser.add_argument("--imagens-distintas", type=int, default=50, help="Imagens geradas, reaproveitadas em ciclo (padrão: 50).")
+    parser.add_argument("--gemini-rpm", type=float, default=60000, help="Limite do limitador 'gemini' (padrão alto: mede o pipeline, não a cota).")
+    parser.add_argument("--geocoding-qps", type=float, default=1000, help="Limite do limitador 'geocoding' (padrão: 1000).")
+    parser.add_argument("--semente", type=int, default=42, help="Semente dos dados sintéticos.")
+    parser.add_argument("--saida-json", help="Grava o resultado em JSON (base para --comparar).")
+    parser.add_argument("--comparar", help="Resultado JSON anterior; sai com código 1 se houver regressão.")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="Tolerância de regressão em fração (padrão: 0.10).")
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = build_parser().parse_args(argv)
+    resultado = executar(args)
+    imprimir(resultado)
+    if args.saida_json:
+        with open(args.saida_json, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            regressoes = comparar(resultado, json.load(f), args.tolerancia)
+        for r in regressoes: print(f"REGRESSÃO: {r}")
+        if regressoes: return 1
+        print("Sem regressões acima da tolerância.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
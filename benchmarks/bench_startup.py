@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de partida a frio do app Streamlit.
+
+Cada medida roda num interpretador novo (sem nada em cache de import), repetida N vezes (mediana):
+- tempo de import de cada módulo importado no topo do `app.py` e dos módulos pesados que ele adia;
+- tempo até a primeira pintura: primeira execução do script pelo `AppTest` do Streamlit (a tela inicial
+  completa, com logo), mais o tempo de um rerun, que todo clique paga.
+
+    python -m benchmarks.bench_startup --repeticoes 5
+"""
+
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(RAIZ, "app.py")
+
+# Módulos que o app só deve carregar nas etapas que os usam
+MODULOS_ADIADOS = ["google.generativeai", "PIL.Image", "pandas", "requests", "image_analyzer", "gemini_text", "job_runner", "geo_services"]
+
+_SCRIPT_IMPORT = """
+import json, sys, time
+sys.path.insert(0, {raiz!r})
+inicio = time.perf_counter()
+import {modulo}
+print(json.dumps({{"s": time.perf_counter() - inicio}}))
+"""
+
+_SCRIPT_PINTURA = """
+import json, sys, time
+sys.path.insert(0, {raiz!r})
+inicio = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+import_streamlit = time.perf_counter() - inicio
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.secrets["geocoding_api_key"] = ""
+inicio = time.perf_counter()
+at.run()
+primeira = time.perf_counter() - inicio
+inicio = time.perf_counter()
+at.run()
+rerun = time.perf_counter() - inicio
+pesados = [m for m in {adiados!r} if m in sys.modules]
+print(json.dumps({{"import_streamlit_s": import_streamlit, "primeira_pintura_s": primeira, "rerun_s": rerun,
+                  "excecoes": [str(e.value) for e in at.exception], "modulos_pesados_carregados": pesados}}))
+"""
+
+
+def imports_do_app() -> List[str]:
+    """Módulos importados no nível do topo do app.py (o que cada execução a frio paga antes de pintar)."""
+    with open(APP, 'r', encoding='utf-8') as f:
+        arvore = ast.parse(f.read())
+    modulos = []
+    for no in arvore.body:
+        if isinstance(no, ast.Import): modulos += [a.name for a in no.names]
+        elif isinstance(no, ast.ImportFrom) and no.module and not no.level: modulos.append(no.module)
+    return list(dict.fromkeys(modulos))
+
+
+def _rodar(script: str, env: Dict[str, str]) -> Dict[str, Any]:
+    saida = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env, cwd=RAIZ, timeout=300)
+    if saida.returncode != 0:
+        return {"erro": (saida.stderr.strip().splitlines() or ["falhou"])[-1]}
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def _mediana(medidas: List[Dict[str, Any]], chave: str) -> Any:
+    valores = [m[chave] for m in medidas if chave in m]
+    return round(statistics.median(valores), 4) if valores else None
+
+
+def executar(repeticoes: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="krateras-startup-") as tmp:
+        # Sem chave Gemini e sem endpoint de métricas: mede só a partida do app
+        env = {**os.environ, "KRATERAS_DATA_DIR": tmp, "KRATERAS_METRICS_PORT": "0"}
+        env.pop("GOOGLE_API_KEY", None)
+        imports, topo = {}, imports_do_app()
+        for modulo in topo + [m for m in MODULOS_ADIADOS if m not in topo]:
+            medidas = [_rodar(_SCRIPT_IMPORT.format(raiz=RAIZ, modulo=modulo), env) for _ in range(repeticoes)]
+            imports[modulo] = _mediana(medidas, "s") if not any("erro" in m for m in medidas) else medidas[0]["erro"]
+        pinturas = [_rodar(_SCRIPT_PINTURA.format(raiz=RAIZ, app=APP, adiados=MODULOS_ADIADOS), env) for _ in range(repeticoes)]
+    ok = [p for p in pinturas if "erro" not in p]
+    return {
+        "repeticoes": repeticoes,
+        "import_s": imports,
+        "import_topo_app_s": round(sum(v for m, v in imports.items() if m in topo and isinstance(v, float)), 4),
+        "import_streamlit_s": _mediana(ok, "import_streamlit_s"),
+        "primeira_pintura_s": _mediana(ok, "primeira_pintura_s"),
+        "rerun_s": _mediana(ok, "rerun_s"),
+        "modulos_pesados_carregados": ok[-1]["modulos_pesados_carregados"] if ok else None,
+        "excecoes": ok[-1]["excecoes"] if ok else [p.get("erro") for p in pinturas][:1],
+    }
+
+
+def imprimir(resultado: Dict[str, Any]) -> None:
+    topo = set(imports_do_app())
+    print(f"\nImport a frio (mediana de {resultado['repeticoes']}, interpretador novo por medida):")
+    for modulo, valor in resultado["import_s"].items():
+        marca = "topo do app" if modulo in topo else "adiado"
+        print(f"  {modulo:<24}{marca:<14}{valor if isinstance(valor, str) else f'{valor:.4f}s'}")
+    print(f"\nSoma dos imports do topo do app.py: {resultado['import_topo_app_s']}s (cada um medido isolado; dependências comuns contam mais de uma vez)")
+    def _s(v): return 'n/d' if v is None else f"{v}s"
+    print(f"Import do Streamlit: {_s(resultado['import_streamlit_s'])}")
+    print(f"Primeira pintura (1ª execução do script): {_s(resultado['primeira_pintura_s'])} | rerun: {_s(resultado['rerun_s'])}")
+    print(f"Módulos pesados carregados ao fim das execuções: {resultado['modulos_pesados_carregados']} "
+          f"(o aquecimento em segundo plano os carrega de propósito, fora do caminho da pintura)")
+    if resultado["excecoes"]: print(f"Exceções no app: {resultado['excecoes']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de partida a frio do app Krateras.")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Medidas por item, em interpretadores novos (padrão: 3).")
+    parser.add_argument("--saida-json", help="Grava o resultado em JSON.")
+    args = parser.parse_args(argv)
+    resultado = executar(args.repeticoes)
+    imprimir(resultado)
+    if args.saida_json:
+        with open(args.saida_json, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
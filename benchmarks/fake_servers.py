@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Servidores HTTP locais que imitam o ViaCEP, o Google Geocoding e o Gemini (REST `generateContent`),
+para medir o Krateras sem gastar cota.
+
+Cada serviço tem latência (base + jitter), taxa de erro (HTTP 500) e taxa de cota estourada configuráveis.
+A cota estourada segue o formato de cada API: HTTP 429 no ViaCEP, `OVER_QUERY_LIMIT` no Geocoding e
+429 `RESOURCE_EXHAUSTED` no Gemini. `GET /_stats` devolve a contagem de respostas por resultado.
+
+Uso avulso (p.ex. com o app):
+    python -m benchmarks.fake_servers --latencia-gemini 1.2 --taxa-429 0.05
+e exporte as variáveis de ambiente impressas antes de `streamlit run app.py`.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+MODELOS_FALSOS = ['models/gemini-1.5-flash-latest', 'models/gemini-pro']
+
+ANALISE_VISUAL_FALSA = """DESCRIÇÃO FÍSICA:
+- Tamanho aparente do buraco: médio, cerca de 60 cm de diâmetro
+- Forma e características: irregular, bordas quebradiças
+- Profundidade estimada: moderada, 10 a 15 cm
+- Condições do asfalto ao redor: rachado e desgastado
+
+AVALIAÇÃO DE SEVERIDADE:
+- Nível: {nivel}
+- Justificativa: risco de dano a pneus e suspensão em via com tráfego constante
+
+RISCOS IDENTIFICADOS:
+- Para veículos: danos a pneus/suspensão e desvios bruscos
+- Para pedestres/ciclistas: quedas de ciclistas
+- Outros riscos: acúmulo de água em dias de chuva
+
+CONDIÇÕES AGRAVANTES:
+- Problemas adicionais: fissuras próximas
+- Fatores de risco: tráfego intenso
+
+RECOMENDAÇÕES:
+- Tipo de intervenção: tapa-buraco com recorte
+- Urgência do reparo: em poucos dias
+- Medidas temporárias: sinalização com cones"""
+
+TEXTO_FALSO = ("Relatório Krateras: Denúncia de buraco registrada para benchmark. O defeito apresenta bordas irregulares, "
+               "profundidade moderada e risco para veículos e ciclistas. Recomenda-se reparo em poucos dias e sinalização "
+               "provisória no local. ") * 3
+
+ANALISE_UNICA_FALSA = {
+    "insights": "Buraco médio com bordas irregulares; risco para veículos e ciclistas.",
+    "urgencia": {"categoria": "Alta", "justificativa": "Via com tráfego intenso e profundidade moderada."},
+    "causas": ["Infiltração de água", "Desgaste do pavimento"],
+    "acoes": ["Tapa-buraco com recorte", "Sinalização provisória"],
+    "resumo": TEXTO_FALSO.strip(),
+}
+
+
+class ConfigServico:
+    """Comportamento de um serviço falso: latência (s), jitter (s) e frações de erro 500 e de cota estourada."""
+
+    def __init__(self, latencia_s: float = 0.05, jitter_s: float = 0.0, taxa_erro: float = 0.0, taxa_429: float = 0.0):
+        self.latencia_s = latencia_s
+        self.jitter_s = jitter_s
+        self.taxa_erro = taxa_erro
+        self.taxa_429 = taxa_429
+
+    def sortear(self) -> Tuple[float, str]:
+        """(atraso em segundos, resultado) para uma requisição: resultado em 'ok' | 'erro' | 'cota'."""
+        atraso = self.latencia_s + random.uniform(0, self.jitter_s)
+        r = random.random()
+        return atraso, 'erro' if r < self.taxa_erro else 'cota' if r < self.taxa_erro + self.taxa_429 else 'ok'
+
+    def como_dict(self) -> Dict[str, float]:
+        return dict(vars(self))
+
+
+class _HandlerBase(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como as APIs reais
+    config: ConfigServico = ConfigServico()
+    contagem: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _contar(self, resultado: str) -> None:
+        with self.lock:
+            self.contagem[resultado] = self.contagem.get(resultado, 0) + 1
+
+    def _json(self, status: int, corpo: Any) -> None:
+        dados = json.dumps(corpo, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _stats(self) -> bool:
+        if urlsplit(self.path).path != '/_stats': return False
+        with self.lock:
+            self._json(200, dict(self.contagem))
+        return True
+
+    def _ler_corpo(self) -> Dict[str, Any]:
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        if not tamanho: return {}
+        try: return json.loads(self.rfile.read(tamanho))
+        except ValueError: return {}
+
+
+class _ViaCEPHandler(_HandlerBase):
+    def do_GET(self):
+        if self._stats(): return
+        atraso, resultado = self.config.sortear()
+        time.sleep(atraso)
+        self._contar(resultado)
+        if resultado == 'erro': return self._json(500, {"erro": "falha simulada"})
+        if resultado == 'cota': return self._json(429, {"erro": "muitas requisições"})
+        partes = [p for p in urlsplit(self.path).path.split('/') if p]  # ws/<cep>/json
+        cep = next((p for p in partes if p.isdigit()), '')
+        if len(cep) != 8: return self._json(400, {"erro": True})
+        if cep.startswith('000'): return self._json(200, {"erro": True})
+        self._json(200, {"cep": f"{cep[:5]}-{cep[5:]}", "logradouro": f"Rua Benchmark {cep[-4:]}", "complemento": "",
+                         "bairro": f"Bairro {cep[2:4]}", "localidade": "São Paulo", "uf": "SP", "ibge": "3550308", "ddd": "11"})
+
+
+class _GeocodingHandler(_HandlerBase):
+    def do_GET(self):
+        if self._stats(): return
+        atraso, resultado = self.config.sortear()
+        time.sleep(atraso)
+        self._contar(resultado)
+        if resultado == 'erro': return self._json(500, {"status": "UNKNOWN_ERROR", "results": []})
+        if resultado == 'cota':
+            return self._json(200, {"status": "OVER_QUERY_LIMIT", "results": [], "error_message": "Cota simulada."})
+        endereco = parse_qs(urlsplit(self.path).query).get('address', [''])[0]
+        # Coordenadas determinísticas por endereço, espalhadas por ~50 km: denúncias distintas não se agrupam
+        h = hashlib.sha256(endereco.encode('utf-8')).digest()
+        lat = -23.55 + (int.from_bytes(h[:4], 'big') / 2**32 - 0.5) * 0.5
+        lng = -46.63 + (int.from_bytes(h[4:8], 'big') / 2**32 - 0.5) * 0.5
+        self._json(200, {"status": "OK", "results": [{"formatted_address": f"{endereco}, Brasil",
+                                                      "geometry": {"location": {"lat": round(lat, 7), "lng": round(lng, 7)},
+                                                                   "location_type": "ROOFTOP"}}]})
+
+
+class _GeminiHandler(_HandlerBase):
+    def do_GET(self):
+        if self._stats(): return
+        caminho = urlsplit(self.path).path
+        if caminho.rstrip('/').endswith('/models'):
+            return self._json(200, {"models": [{"name": n, "supportedGenerationMethods": ["generateContent", "countTokens"]}
+                                               for n in MODELOS_FALSOS]})
+        self._json(404, {"error": {"code": 404, "message": "Não encontrado.", "status": "NOT_FOUND"}})
+
+    @staticmethod
+    def _texto_resposta(corpo: Dict[str, Any]) -> str:
+        config = corpo.get('generationConfig') or corpo.get('generation_config') or {}
+        if (config.get('responseMimeType') or config.get('response_mime_type')) == 'application/json':
+            return json.dumps(ANALISE_UNICA_FALSA, ensure_ascii=False)
+        partes = [p for c in corpo.get('contents', []) for p in c.get('parts', [])]
+        if any('inlineData' in p or 'inline_data' in p for p in partes):
+            return ANALISE_VISUAL_FALSA.format(nivel=random.choice(['BAIXO', 'MÉDIO', 'ALTO', 'CRÍTICO']))
+        prompt = ' '.join(p.get('text', '') for p in partes).lower()
+        if 'urgência' in prompt or 'urgencia' in prompt:
+            return "Categoria de Urgência: Alta\nJustificativa: via com tráfego intenso e buraco de profundidade moderada."
+        return TEXTO_FALSO.strip()
+
+    @staticmethod
+    def _candidato(texto: str) -> Dict[str, Any]:
+        return {"candidates": [{"content": {"parts": [{"text": texto}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {"promptTokenCount": 200, "candidatesTokenCount": len(texto) // 4, "totalTokenCount": 200 + len(texto) // 4}}
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        corpo = self._ler_corpo()
+        atraso, resultado = self.config.sortear()
+        self._contar(resultado)
+        if resultado != 'ok':
+            time.sleep(atraso)
+            if resultado == 'cota':
+                return self._json(429, {"error": {"code": 429, "message": "Resource has been exhausted (simulado).", "status": "RESOURCE_EXHAUSTED"}})
+            return self._json(500, {"error": {"code": 500, "message": "Falha interna simulada.", "status": "INTERNAL"}})
+        texto = self._texto_resposta(corpo)
+        if not url.path.endswith(':streamGenerateContent'):
+            time.sleep(atraso)
+            return self._json(200, self._candidato(texto))
+        # Streaming: o texto sai em 4 pedaços espalhados pela latência sorteada
+        sse = 'sse' in parse_qs(url.query).get('alt', [''])[0]
+        n = 4
+        pedacos = [texto[i * len(texto) // n:(i + 1) * len(texto) // n] for i in range(n)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if sse else 'application/json; charset=utf-8')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        if not sse: self.wfile.write(b'[')
+        for i, pedaco in enumerate(pedacos):
+            time.sleep(atraso / n)
+            dados = json.dumps(self._candidato(pedaco), ensure_ascii=False)
+            self.wfile.write(f"data: {dados}\r\n\r\n".encode('utf-8') if sse else ((',' if i else '') + dados).encode('utf-8'))
+            self.wfile.flush()
+        if not sse: self.wfile.write(b']')
+
+
+def _handler(base: type, config: ConfigServico) -> type:
+    # Classe por servidor: configuração e contadores não são compartilhados entre serviços
+    return type(base.__name__, (base,), {"config": config, "contagem": {}, "lock": threading.Lock()})
+
+
+def iniciar_servidores(configs: Dict[str, ConfigServico], host: str = '127.0.0.1',
+                       portas: Optional[Dict[str, int]] = None) -> Dict[str, ThreadingHTTPServer]:
+    """Sobe os servidores 'viacep', 'geocoding' e 'gemini' em threads daemon (porta 0 = livre qualquer)."""
+    handlers = {"viacep": _ViaCEPHandler, "geocoding": _GeocodingHandler, "gemini": _GeminiHandler}
+    servidores = {}
+    for nome, base in handlers.items():
+        srv = ThreadingHTTPServer((host, (portas or {}).get(nome, 0)), _handler(base, configs.get(nome, ConfigServico())))
+        srv.daemon_threads = True
+        threading.Thread(target=srv.serve_forever, name=f"falso-{nome}", daemon=True).start()
+        servidores[nome] = srv
+    return servidores
+
+
+def variaveis_ambiente(portas: Dict[str, int], host: str = '127.0.0.1') -> Dict[str, str]:
+    """Variáveis KRATERAS_* que apontam o Krateras para os servidores falsos."""
+    return {"KRATERAS_VIACEP_URL": f"http://{host}:{portas['viacep']}/ws",
+            "KRATERAS_GEOCODING_URL": f"http://{host}:{portas['geocoding']}/maps/api/geocode/json",
+            "KRATERAS_GEMINI_ENDPOINT": f"http://{host}:{portas['gemini']}"}
+
+
+def _rodar_processo(configs: Dict[str, Dict[str, float]], fila: "multiprocessing.Queue", parar: "multiprocessing.Event") -> None:
+    servidores = iniciar_servidores({n: ConfigServico(**c) for n, c in configs.items()})
+    fila.put({n: s.server_address[1] for n, s in servidores.items()})
+    parar.wait()
+    for s in servidores.values(): s.shutdown()
+
+
+class ServidoresFalsos:
+    """
+    Servidores falsos num processo separado (não disputam GIL nem entram no RSS medido).
+    Uso: `with ServidoresFalsos(configs) as env: os.environ.update(env)`.
+    """
+
+    def __init__(self, configs: Dict[str, ConfigServico]):
+        self.configs = configs
+        self.portas: Dict[str, int] = {}
+        self._ctx = multiprocessing.get_context('spawn')
+        self._parar = self._ctx.Event()
+        self._processo = None
+
+    def __enter__(self) -> Dict[str, str]:
+        fila = self._ctx.Queue()
+        self._processo = self._ctx.Process(target=_rodar_processo, args=({n: c.como_dict() for n, c in self.configs.items()}, fila, self._parar),
+                                           name="krateras-servidores-falsos", daemon=True)
+        self._processo.start()
+        self.portas = fila.get(timeout=30)
+        return variaveis_ambiente(self.portas)
+
+    def estatisticas(self) -> Dict[str, Dict[str, int]]:
+        """Contagem de respostas por resultado em cada servidor (consulta `GET /_stats`)."""
+        from urllib.request import urlopen
+        saida = {}
+        for nome, porta in self.portas.items():
+            with urlopen(f"http://127.0.0.1:{porta}/_stats", timeout=5) as r:
+                saida[nome] = json.loads(r.read())
+        return saida
+
+    def __exit__(self, *exc) -> None:
+        self._parar.set()
+        if self._processo is not None:
+            self._processo.join(timeout=5)
+            if self._processo.is_alive(): self._processo.terminate()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Servidores falsos de ViaCEP, Geocoding e Gemini para testes de carga.")
+    for nome, padrao in (("viacep", 0.05), ("geo", 0.08), ("gemini", 1.0)):
+        parser.add_argument(f"--latencia-{nome}", type=float, default=padrao, help=f"Latência base do {nome} em segundos (padrão: {padrao}).")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Jitter máximo somado à latência, em fração da latência base.")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="Fração de respostas HTTP 500 (0 a 1).")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="Fração de respostas de cota estourada (0 a 1).")
+    return parser
+
+
+def configs_de_args(args: argparse.Namespace) -> Dict[str, ConfigServico]:
+    def _cfg(latencia: float) -> ConfigServico:
+        return ConfigServico(latencia, latencia * args.jitter, args.taxa_erro, args.taxa_429)
+    return {"viacep": _cfg(args.latencia_viacep), "geocoding": _cfg(args.latencia_geo), "gemini": _cfg(args.latencia_gemini)}
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    parser.add_argument("--porta-base", type=int, default=8801, help="Portas base, base+1 e base+2 (padrão: 8801).")
+    args = parser.parse_args(argv)
+    portas = {"viacep": args.porta_base, "geocoding": args.porta_base + 1, "gemini": args.porta_base + 2}
+    iniciar_servidores(configs_de_args(args), portas=portas)
+    for var, valor in variaveis_ambiente(portas).items():
+        print(f"export {var}={valor}")
+    print("# Servidores falsos no ar. Ctrl+C para encerrar.")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Base local de CEPs com índice ordenado e memory-mapped.
+
+O dump de CEPs é convertido uma única vez num arquivo binário compacto:
+
+    cabeçalho  : b"KCEPIDX1" + uint32 (quantidade de registros)
+    registros  : N x (uint32 cep, uint32 offset, uint16 tamanho), ordenados por CEP
+    textos     : "logradouro\\x1fbairro\\x1flocalidade\\x1fuf" em UTF-8, referenciados pelos registros
+
+A consulta é uma busca binária direto no mmap, sem carregar o arquivo em memória.
+CEPs obtidos do ViaCEP depois de um miss vão para um arquivo delta (JSONL) que é
+consultado antes do índice e pode ser incorporado a ele com `compactar()`.
+"""
+
+import csv
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from settings import data_path
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"KCEPIDX1"
+_HEADER = struct.Struct("<8sI")
+_REGISTRO = struct.Struct("<IIH")
+_SEP = "\x1f"
+CAMPOS = ("logradouro", "bairro", "localidade", "uf")
+
+
+def _cep_int(cep: str) -> Optional[int]:
+    cep_limpo = re.sub(r'\D', '', str(cep))
+    return int(cep_limpo) if len(cep_limpo) == 8 else None
+
+
+def construir_indice(registros: Iterable[Tuple[str, Dict[str, str]]], caminho_saida: str) -> int:
+    """
+    Grava o índice binário a partir de pares (cep, {logradouro, bairro, localidade, uf}).
+    Em CEPs repetidos vale o último. Retorna a quantidade de registros gravados.
+    """
+    por_cep: Dict[int, bytes] = {}
+    for cep, dados in registros:
+        cep_i = _cep_int(cep)
+        if cep_i is None: continue
+        por_cep[cep_i] = _SEP.join((dados.get(c) or '').strip().replace(_SEP, ' ') for c in CAMPOS).encode('utf-8')[:0xFFFF]
+
+    ceps = sorted(por_cep)
+    tmp = caminho_saida + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(ceps)))
+        offset = 0
+        for cep_i in ceps:
+            f.write(_REGISTRO.pack(cep_i, offset, len(por_cep[cep_i])))
+            offset += len(por_cep[cep_i])
+        for cep_i in ceps:
+            f.write(por_cep[cep_i])
+    os.replace(tmp, caminho_saida)  # troca atômica: leitores antigos continuam no mmap anterior
+    logger.info(f"Índice de CEP gravado em {caminho_saida} com {len(ceps)} registros.")
+    return len(ceps)
+
+
+def ler_dump_csv(caminho: str) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """
+    Lê um dump CSV de CEPs (colunas cep, logradouro, bairro, localidade ou cidade, uf ou estado).
+    O separador (',' ou ';') é detectado automaticamente.
+    """
+    with open(caminho, 'r', encoding='utf-8', newline='') as f:
+        amostra = f.read(4096); f.seek(0)
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=",;\t|")
+        for linha in csv.DictReader(f, dialect=dialeto):
+            linha = {(k or '').strip().lower(): v for k, v in linha.items()}
+            yield linha.get('cep', ''), {
+                'logradouro': linha.get('logradouro', ''),
+                'bairro': linha.get('bairro', ''),
+                'localidade': linha.get('localidade') or linha.get('cidade', ''),
+                'uf': linha.get('uf') or linha.get('estado', ''),
+            }
+
+
+class CepIndex:
+    """
+    Consulta de CEP em microssegundos sobre o índice mmap + delta de write-back.
+    """
+
+    def __init__(self, caminho_indice: str, caminho_delta: str):
+        self.caminho_indice = caminho_indice
+        self.caminho_delta = caminho_delta
+        self._lock = threading.Lock()
+        # (mmap, nº de registros, início dos textos), trocado de uma vez para os leitores nunca misturarem índices
+        self._indice: Tuple[Optional[mmap.mmap], int, int] = (None, 0, 0)
+        self._delta: Dict[int, Dict[str, str]] = {}
+        self._abrir_indice()
+        self._carregar_delta()
+
+    def _abrir_indice(self) -> None:
+        if not os.path.exists(self.caminho_indice) or os.path.getsize(self.caminho_indice) < _HEADER.size:
+            return
+        with open(self.caminho_indice, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            logger.error(f"Arquivo {self.caminho_indice} não é um índice de CEP válido; ignorado.")
+            return
+        # O mmap anterior não é fechado: buscas em andamento (sem lock) ainda podem lê-lo; o GC o libera depois
+        self._indice = (mm, n, _HEADER.size + n * _REGISTRO.size)
+
+    def _carregar_delta(self) -> None:
+        if not os.path.exists(self.caminho_delta): return
+        with open(self.caminho_delta, 'r', encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    item = json.loads(linha)
+                except json.JSONDecodeError:
+                    continue
+                cep_i = _cep_int(item.get('cep', ''))
+                if cep_i is not None: self._delta[cep_i] = {c: item.get(c, '') for c in CAMPOS}
+
+    def __len__(self) -> int:
+        return self._indice[1] + len(self._delta)
+
+    def _buscar_no_mmap(self, cep_i: int) -> Optional[Dict[str, str]]:
+        mm, n, inicio_textos = self._indice
+        if mm is None or n == 0: return None
+        lo, hi = 0, n - 1
+        while lo <= hi:
+            meio = (lo + hi) >> 1
+            cep_meio, offset, tamanho = _REGISTRO.unpack_from(mm, _HEADER.size + meio * _REGISTRO.size)
+            if cep_meio < cep_i: lo = meio + 1
+            elif cep_meio > cep_i: hi = meio - 1
+            else:
+                ini = inicio_textos + offset
+                return dict(zip(CAMPOS, mm[ini:ini + tamanho].decode('utf-8').split(_SEP)))
+        return None
+
+    def buscar(self, cep: str) -> Optional[Dict[str, Any]]:
+        """Retorna {cep, logradouro, bairro, localidade, uf} (mesmo formato do ViaCEP) ou None."""
+        cep_i = _cep_int(cep)
+        if cep_i is None: return None
+        dados = self._delta.get(cep_i) or self._buscar_no_mmap(cep_i)
+        if dados is None: return None
+        cep_txt = f"{cep_i:08d}"
+        return {"cep": f"{cep_txt[:5]}-{cep_txt[5:]}", **dados}
+
+    def adicionar(self, cep: str, dados: Dict[str, Any]) -> None:
+        """Write-back de um CEP obtido externamente (persistido no arquivo delta)."""
+        cep_i = _cep_int(cep)
+        if cep_i is None: return
+        item = {c: (dados.get(c) or '') for c in CAMPOS}
+        with self._lock:
+            if self._delta.get(cep_i) == item: return
+            self._delta[cep_i] = item
+            with open(self.caminho_delta, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"cep": f"{cep_i:08d}", **item}, ensure_ascii=False) + '\n')
+
+    def _iterar_base(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        mm, n, inicio_textos = self._indice
+        for i in range(n):
+            cep_i, offset, tamanho = _REGISTRO.unpack_from(mm, _HEADER.size + i * _REGISTRO.size)
+            ini = inicio_textos + offset
+            yield f"{cep_i:08d}", dict(zip(CAMPOS, mm[ini:ini + tamanho].decode('utf-8').split(_SEP)))
+
+    def compactar(self) -> int:
+        """Incorpora o delta ao índice binário e zera o delta."""
+        with self._lock:
+            delta = [(f"{c:08d}", d) for c, d in self._delta.items()]
+            total = construir_indice(list(self._iterar_base()) + delta, self.caminho_indice)
+            self._abrir_indice()
+            self._delta.clear()
+            if os.path.exists(self.caminho_delta): os.remove(self.caminho_delta)
+            return total
+
+
+_index: Optional[CepIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_cep_index() -> CepIndex:
+    """Índice de CEP único por processo."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CepIndex(
+                os.environ.get("KRATERAS_CEP_INDEX_PATH", data_path("cep_index.bin")),
+                os.environ.get("KRATERAS_CEP_DELTA_PATH", data_path("cep_index_delta.jsonl")),
+            )
+        return _index
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Etapas de análise de texto do Krateras com Google Gemini (sem dependência do Streamlit).
+"""
+
+import json
+import logging
+from typing import Callable, Dict, Any, Optional, Tuple
+
+import google.generativeai as genai
+
+from llm_cache import get_llm_cache
+from metrics import cronometrado, get_metricas
+from model_registry import get_model_registry
+from prompt_compiler import ContextoPrompt, ModeloPrompt
+from rate_limiter import erro_de_cota, get_rate_limiter
+from resilience import PrazoEsgotado, ServicoIndisponivel, chamar, prazo_atual
+
+logger = logging.getLogger(__name__)
+
+MODELOS_TEXTO_PREFERIDOS = ['gemini-1.5-flash-latest', 'gemini-1.0-pro-latest', 'gemini-pro']
+
+def selecionar_modelo_texto(api_key: str) -> Tuple[Optional[genai.GenerativeModel], bool]:
+    """
+    Escolhe o melhor modelo de texto disponível. Retorna (modelo, usou_fallback); modelo é None se nenhum servir.
+    A descoberta vem do registro de modelos (em disco, com TTL) e o modelo é a instância compartilhada da chave.
+    """
+    registro = get_model_registry()
+    nomes = registro.listar_modelos(api_key)
+    for name_suffix in MODELOS_TEXTO_PREFERIDOS:
+        if found := next((n for n in nomes if n.endswith(name_suffix)), None):
+            return registro.get_model(api_key, found), False
+    if nomes: return registro.get_model(api_key, nomes[0]), True
+    return None, False
+
+SAFETY_SETTINGS = [{"category":cat,"threshold":"BLOCK_NONE"} for cat in ["HARM_CATEGORY_HARASSMENT","HARM_CATEGORY_HATE_SPEECH","HARM_CATEGORY_SEXUALLY_EXPLICIT","HARM_CATEGORY_DANGEROUS_CONTENT"]]
+
+def gerar_conteudo(model: genai.GenerativeModel, conteudo: Any, ao_receber: Optional[Callable[[str], None]] = None, **kwargs) -> Any:
+    """
+    `model.generate_content` com streaming opcional: com `ao_receber`, a resposta chega em pedaços e a função
+    é chamada com o texto acumulado a cada pedaço. A resposta devolvida (já consumida) se comporta como a não-streaming.
+    Toda tentativa passa pelo limitador de taxa 'gemini', que é informado das respostas de cota estourada, e pela
+    camada de resiliência: erros transitórios são repetidos com backoff dentro do prazo da denúncia (o streaming
+    recomeça do zero) e, com o Gemini fora do ar, o disjuntor recusa a chamada na hora (`ServicoIndisponivel`).
+    """
+    limitador = get_rate_limiter('gemini')
+
+    def _tentativa() -> Any:
+        prazo = prazo_atual()
+        limitador.adquirir(prazo.restante() if prazo is not None else None)
+        opcoes = dict(kwargs)
+        if prazo is not None:
+            opcoes.setdefault("request_options", {"timeout": max(prazo.restante(), 1.0)})
+        try:
+            if ao_receber is None:
+                response = model.generate_content(conteudo, **opcoes)
+            else:
+                response = model.generate_content(conteudo, stream=True, **opcoes)
+                acumulado = ''
+                for chunk in response:
+                    if chunk.parts:
+                        acumulado += chunk.text
+                        ao_receber(acumulado)
+        except Exception as e:
+            if erro_de_cota(e): limitador.registrar(True)
+            raise
+        limitador.registrar(False)
+        return response
+
+    return chamar("gemini", _tentativa)
+
+def _contar_chamada(resultado: str) -> None:
+    get_metricas().incrementar("krateras_gemini_texto_chamadas_total", ajuda="Chamadas de texto ao Gemini por resultado.", resultado=resultado)
+
+def _call_gemini_api(prompt: str, model: Optional[genai.GenerativeModel], generation_config: Optional[Dict[str, Any]] = None,
+                     validar: Optional[Callable[[str], bool]] = None, ao_receber: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Helper para chamadas Gemini, tratando bloqueios e erros. Respostas válidas (e aceitas por `validar`) vão para o cache LLM em disco.
+    Com `ao_receber`, a resposta é transmitida em streaming (ver `gerar_conteudo`); um acerto de cache é entregue de uma vez.
+    """
+    if not model: return {"text": "Modelo IA não disponível.", "error": True}
+    cache = get_llm_cache()
+    chave = cache.make_key(prompt, model.model_name, {"generation_config": generation_config or getattr(model, '_generation_config', None), "safety_settings": SAFETY_SETTINGS})
+    if (cached := cache.get(chave)) is not None:
+        _contar_chamada('cache')
+        if ao_receber: ao_receber(cached)
+        return {"text": cached, "error": False, "cache": True}
+    try:
+        response = gerar_conteudo(model, prompt, ao_receber, safety_settings=SAFETY_SETTINGS, **({"generation_config": generation_config} if generation_config else {}))
+        if not response.parts:
+            block = response.prompt_feedback.block_reason.name if hasattr(response,'prompt_feedback') and response.prompt_feedback.block_reason else "Sem conteúdo"
+            finish = response.candidates[0].finish_reason.name if hasattr(response,'candidates') and response.candidates and hasattr(response.candidates[0],'finish_reason') else "N/A"
+            _contar_chamada('bloqueado')
+            return {"text": f"❌ Bloqueado/sem conteúdo. Bloqueio: {block}. Finalização: {finish}.", "error": True}
+        text = response.text.strip()
+        if validar is None or validar(text): cache.set(chave, text)
+        _contar_chamada('ok')
+        return {"text": text, "error": False}
+    except ServicoIndisponivel as e:
+        _contar_chamada('indisponivel')
+        return {"text": f"🤖 IA indisponível no momento: {e}", "error": True}
+    except PrazoEsgotado as e:
+        _contar_chamada('prazo')
+        return {"text": f"❌ {e}", "error": True}
+    except Exception as e:
+        _contar_chamada('cota' if erro_de_cota(e) else 'erro')
+        return {"text": f"❌ Erro API Gemini: {e}", "error": True}
+
+def _resultado_texto(retorno: Dict[str, Any]) -> str:
+    """Rótulo de métrica das etapas de texto: 'erro' (❌), 'offline' (🤖) ou 'ok'."""
+    texto = next(iter(retorno.values()), '') if retorno else ''
+    return 'erro' if texto.startswith('❌') else 'offline' if texto.startswith('🤖') else 'ok'
+
+# Modelos de prompt, compilados uma vez; o contexto da denúncia vem de `ContextoPrompt` (ver prompt_compiler)
+PROMPT_INSIGHTS = ModeloPrompt("insights", """
+    Analise as características e observações de uma denúncia de buraco. Extraia insights cruciais.
+    Formato: texto claro, marcadores (-). Se não puder inferir com ALTA CONFIANÇA, indique "Não especificado/inferido".
+    Características:
+    {caracteristicas_ni}
+    Observações: "{observacoes}"
+    Categorias para Extrair/Inferir:
+    - Severidade/Tamanho Estimado: [Consolidado]
+    - Profundidade Estimada: [Consolidado]
+    - Presença de Água/Alagamento: [Consolidado]
+    - Tráfego Estimado na Via: [Consolidado]
+    - Contexto da Via: [Consolidado]
+    - Perigos Potenciais e Impactos (Observações): [Riscos das observações]
+    - Contexto Adicional Local/Histórico (Observações): [Info das observações]
+    - Sugestões de Ação/Recursos (Observações): [Sugestões das observações]
+    - Identificadores Visuais Adicionais (Observações): [Ref. visuais das observações]
+    - Palavras-chave Principais: [3-7 palavras-chave de todos os dados]
+    Resposta limpa e estruturada.
+""", elasticos=("observacoes",))
+
+PROMPT_URGENCIA = ModeloPrompt("urgencia", """
+    Sugira a MELHOR categoria de urgência para o reparo. Categorias: Baixa, Média, Alta, Imediata/Crítica.
+    Dados:
+    Local: {local}.
+    {localizacao}
+    Características:
+    {caracteristicas}
+    Observações: "{observacoes}"
+    Insights: {insights}
+    Qual categoria e justificativa (máx. 2 frases)? Formato:
+    Categoria Sugerida: [Categoria]
+    Justificativa: [Justificativa]
+""", elasticos=("observacoes", "insights"))
+
+PROMPT_SUGESTAO_ACAO = ModeloPrompt("sugestao_acao", """
+    Sugira: 1. PÓSSIVEIS CAUSAS. 2. TIPOS DE AÇÃO/REPARO. Se não houver pistas, indique "Não especificado/inferido".
+    Dados:
+    Características:
+    {caracteristicas}
+    Observações: "{observacoes}"
+    Insights: {insights}
+    Formato:
+    Possíveis Causas Sugeridas: [Causas ou 'Não especificado/inferido']
+    Sugestões de Ação/Reparo Sugeridas: [Ações ou 'Não especificado/inferido']
+""", elasticos=("observacoes", "insights"))
+
+PROMPT_RESUMO = ModeloPrompt("resumo", """
+    Resumo narrativo conciso (máx. 10-12 frases) da denúncia. Formal, objetivo.
+    Inclua: Denunciante, localização (rua, ref, bairro, cidade, estado, CEP), loc. EXATA, lado rua, características, observações, Análise Texto, Urgência IA, Causas/Ação IA.
+    Dados:
+    Denunciante: {denunciante}.
+    Endereço: {endereco}.
+    Lado Rua: {lado_rua}.
+    Loc. Exata: {localizacao}
+    Características:
+    {caracteristicas}
+    Observações: "{observacoes}"
+    Insights Análise Texto: {insights}
+    Sugestão Urgência IA: {urgencia}
+    Sugestões Causa/Ação IA: {sugestao_acao}
+    Resumo em português. Comece "Relatório Krateras: Denúncia de buraco..."
+""", elasticos=("observacoes", "insights", "urgencia", "sugestao_acao"))
+
+def _contexto(dados_denuncia: Dict[str, Any], contexto: Optional[ContextoPrompt]) -> ContextoPrompt:
+    return contexto if contexto is not None else ContextoPrompt(dados_denuncia)
+
+@cronometrado("gemini_insights", _resultado_texto)
+def analisar_caracteristicas_e_observacoes_gemini(caracteristicas: Dict[str, Any], observacoes: str, model: Optional[genai.GenerativeModel], ao_receber: Optional[Callable[[str], None]] = None,
+                                                  contexto: Optional[ContextoPrompt] = None) -> Dict[str, Any]:
+    if not model: return {"insights": "🤖 Análise descrição IA offline."}
+    ctx = _contexto({"buraco": {"caracteristicas_estruturadas": caracteristicas, "observacoes_adicionais": observacoes}}, contexto)
+    res = _call_gemini_api(ctx.compilar(PROMPT_INSIGHTS), model, ao_receber=ao_receber)
+    return {"insights": res["text"]}
+
+@cronometrado("gemini_urgencia", _resultado_texto)
+def categorizar_urgencia_gemini(dados_denuncia: Dict[str, Any], insights_ia_result: Dict[str, Any], model: Optional[genai.GenerativeModel], ao_receber: Optional[Callable[[str], None]] = None,
+                                contexto: Optional[ContextoPrompt] = None) -> Dict[str, Any]:
+    if not model: return {"urgencia_ia": "🤖 Sugestão urgência IA offline."}
+    prompt = _contexto(dados_denuncia, contexto).compilar(PROMPT_URGENCIA, insights=insights_ia_result.get('insights','N/A.'))
+    res = _call_gemini_api(prompt, model, ao_receber=ao_receber)
+    return {"urgencia_ia": res["text"]}
+
+@cronometrado("gemini_sugestao_acao", _resultado_texto)
+def sugerir_causa_e_acao_gemini(dados_denuncia: Dict[str, Any], insights_ia_result: Dict[str, Any], model: Optional[genai.GenerativeModel], ao_receber: Optional[Callable[[str], None]] = None,
+                                contexto: Optional[ContextoPrompt] = None) -> Dict[str, Any]:
+    if not model: return {"sugestao_acao_ia": "🤖 Sugestões causa/ação IA offline."}
+    prompt = _contexto(dados_denuncia, contexto).compilar(PROMPT_SUGESTAO_ACAO, insights=insights_ia_result.get('insights','N/A.'))
+    res = _call_gemini_api(prompt, model, ao_receber=ao_receber)
+    return {"sugestao_acao_ia": res["text"]}
+
+@cronometrado("gemini_resumo", _resultado_texto)
+def gerar_resumo_completo_gemini(dados_denuncia_completa: Dict[str, Any], insights_ia_result: Dict[str, Any], urgencia_ia_result: Dict[str, Any], sugestao_acao_ia_result: Dict[str, Any], model: Optional[genai.GenerativeModel], ao_receber: Optional[Callable[[str], None]] = None,
+                                 contexto: Optional[ContextoPrompt] = None) -> Dict[str, Any]:
+    if not model: return {"resumo_ia": "🤖 Resumo inteligente IA offline."}
+    prompt = _contexto(dados_denuncia_completa, contexto).compilar(
+        PROMPT_RESUMO, insights=insights_ia_result.get('insights','N/A.'), urgencia=urgencia_ia_result.get('urgencia_ia','N/A.'),
+        sugestao_acao=(sugestao_acao_ia_result or {}).get('sugestao_acao_ia','N/A.'))
+    res = _call_gemini_api(prompt, model, ao_receber=ao_receber)
+    return {"resumo_ia": res["text"]}
+
+# --- Modo "chamada única": um só prompt com saída JSON no lugar das quatro etapas ---
+
+CATEGORIAS_URGENCIA = ['Baixa', 'Média', 'Alta', 'Imediata/Crítica']
+
+# Esquema da resposta (subconjunto de JSON Schema validado localmente por `validar_analise_unica`)
+ESQUEMA_ANALISE_UNICA = {
+    "type": "object",
+    "properties": {
+        "insights": {"type": "string"},
+        "urgencia": {"type": "object", "properties": {"categoria": {"type": "string", "enum": CATEGORIAS_URGENCIA},
+                                                      "justificativa": {"type": "string"}},
+                     "required": ["categoria", "justificativa"]},
+        "causas": {"type": "array", "items": {"type": "string"}},
+        "acoes": {"type": "array", "items": {"type": "string"}},
+        "resumo": {"type": "string"},
+    },
+    "required": ["insights", "urgencia", "causas", "acoes", "resumo"],
+}
+
+PROMPT_ANALISE_UNICA = ModeloPrompt("texto_unico", """
+    Você analisa denúncias de buracos em vias públicas. Responda APENAS com um objeto JSON, em português, com os campos:
+    - "insights": texto com marcadores (-) cobrindo Severidade/Tamanho, Profundidade, Água/Alagamento, Tráfego, Contexto da Via,
+      Perigos (das observações), Contexto Local, Sugestões (das observações), Identificadores Visuais e 3-7 Palavras-chave.
+      Se não puder inferir algo com ALTA CONFIANÇA, escreva "Não especificado/inferido".
+    - "urgencia": {{"categoria": {categoria}, "justificativa": máx. 2 frases}}.
+    - "causas": lista de possíveis causas (ou ["Não especificado/inferido"]).
+    - "acoes": lista de tipos de ação/reparo sugeridos (ou ["Não especificado/inferido"]).
+    - "resumo": resumo narrativo formal e objetivo (máx. 10-12 frases) começando com "Relatório Krateras: Denúncia de buraco...",
+      incluindo denunciante, endereço, localização exata, lado da rua, características, observações, urgência e causas/ações.
+    Dados (registrados em {data_hora} UTC):
+    Denunciante: {denunciante}.
+    Endereço: {endereco}.
+    Lado Rua: {lado_rua}.
+    Loc. Exata: {localizacao}
+    Características:
+    {caracteristicas}
+    Observações: "{observacoes}"
+""", elasticos=("observacoes",))
+
+_TIPOS_JSON = {"object": dict, "string": str, "array": list}
+
+def validar_analise_unica(obj: Any, esquema: Dict[str, Any] = ESQUEMA_ANALISE_UNICA, caminho: str = '$') -> Optional[str]:
+    """Valida `obj` contra o esquema (type/properties/required/items/enum). Retorna a mensagem de erro ou None."""
+    tipo = _TIPOS_JSON[esquema["type"]]
+    if not isinstance(obj, tipo): return f"{caminho}: esperado {esquema['type']}, veio {type(obj).__name__}."
+    if tipo is str:
+        if not obj.strip(): return f"{caminho}: texto vazio."
+        if "enum" in esquema and obj not in esquema["enum"]: return f"{caminho}: '{obj}' não está em {esquema['enum']}."
+    elif tipo is dict:
+        for campo in esquema.get("required", []):
+            if campo not in obj: return f"{caminho}.{campo}: campo obrigatório ausente."
+        for campo, sub in esquema.get("properties", {}).items():
+            if campo in obj and (erro := validar_analise_unica(obj[campo], sub, f"{caminho}.{campo}")): return erro
+    elif tipo is list:
+        for i, item in enumerate(obj):
+            if erro := validar_analise_unica(item, esquema["items"], f"{caminho}[{i}]"): return erro
+    return None
+
+def _ler_analise_unica(texto: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Decodifica a resposta JSON (tolerando cercas ```json) e valida; retorna (objeto, erro)."""
+    texto = texto.strip()
+    if texto.startswith("```"): texto = texto.strip('`').removeprefix('json').strip()
+    try: obj = json.loads(texto)
+    except ValueError as e: return None, f"JSON inválido: {e}"
+    erro = validar_analise_unica(obj)
+    return (None, erro) if erro else (obj, None)
+
+@cronometrado("gemini_texto_unico", lambda r: 'ok' if r else 'fallback')
+def analise_completa_unica_gemini(dados_denuncia_completa: Dict[str, Any], model: Optional[genai.GenerativeModel],
+                                  contexto: Optional[ContextoPrompt] = None, categoria_fixa: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Pede insights, urgência, causas/ações e resumo numa única chamada com saída JSON e distribui o objeto
+    validado nos formatos das etapas separadas: {"insights": {...}, "urgencia": {...}, "sugestao_acao": {...}, "resumo": {...}}.
+    `categoria_fixa` (urgência já decidida, ex.: pelas regras locais) entra no prompt como dado, para o resumo citá-la.
+    Retorna None se o modelo estiver offline ou a resposta não passar no esquema (quem chama volta às etapas separadas).
+    """
+    if not model: return None
+    if categoria_fixa: categoria = f'"{categoria_fixa}" (já decidida; use exatamente esta, inclusive no resumo)'
+    else: categoria = f"uma de {json.dumps(CATEGORIAS_URGENCIA, ensure_ascii=False)}"
+    prompt = _contexto(dados_denuncia_completa, contexto).compilar(PROMPT_ANALISE_UNICA, categoria=categoria)
+
+    def _ler(texto: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        obj, erro = _ler_analise_unica(texto)
+        if not erro and categoria_fixa and obj["urgencia"]["categoria"] != categoria_fixa:
+            erro = f"urgência '{obj['urgencia']['categoria']}' diferente da já decidida '{categoria_fixa}' (o resumo a contradiria)."
+        return obj, erro
+
+    res = _call_gemini_api(prompt, model, generation_config={"response_mime_type": "application/json"},
+                           validar=lambda texto: _ler(texto)[1] is None)
+    if res.get("error"):
+        logger.warning(f"Chamada única Gemini falhou: {res['text']}")
+        return None
+    obj, erro = _ler(res["text"])
+    if erro:
+        logger.warning(f"Resposta da chamada única Gemini rejeitada: {erro}")
+        return None
+    causas, acoes = '; '.join(c.strip() for c in obj["causas"]), '; '.join(a.strip() for a in obj["acoes"])
+    return {
+        "insights": {"insights": obj["insights"].strip()},
+        "urgencia": {"urgencia_ia": f"Categoria Sugerida: {obj['urgencia']['categoria']}\nJustificativa: {obj['urgencia']['justificativa'].strip()}"},
+        "sugestao_acao": {"sugestao_acao_ia": f"Possíveis Causas Sugeridas: {causas or 'Não especificado/inferido'}\nSugestões de Ação/Reparo Sugeridas: {acoes or 'Não especificado/inferido'}"},
+        "resumo": {"resumo_ia": obj["resumo"].strip()},
+    }
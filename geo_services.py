@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Serviços de endereço e localização do Krateras: ViaCEP, Google Geocoding e
+processamento da localização exata (sem dependência do Streamlit).
+"""
+
+import os
+import re
+import urllib.parse
+from typing import Dict, Any, Optional
+
+import requests
+
+from cep_index import get_cep_index
+from geocode_cache import chave_endereco, get_geocode_cache, normalizar_texto
+from http_client import get_http_client
+from location_parser import TIPO_COORDENADAS_LINK, TIPO_COORDENADAS_MANUAIS, extrair_localizacao, tem_plus_code_curto
+from metrics import cronometrado, resultado_por_erro
+from rate_limiter import get_rate_limiter
+from resilience import ErroTransitorio, PrazoEsgotado, ServicoIndisponivel, chamar, prazo_atual, verificar_status
+from reverse_geocoder import get_reverse_geocoder
+
+TIPOS_LOC_COM_COORDS = [TIPO_COORDENADAS_MANUAIS, 'Geocodificada (API)', TIPO_COORDENADAS_LINK]
+# Campo do endereço da denúncia -> campo da geocodificação reversa local
+CAMPOS_ENDERECO_LOCAL = {'rua': 'rua', 'bairro': 'bairro', 'cidade_buraco': 'municipio', 'estado_buraco': 'uf'}
+
+# Endpoints das APIs; sobrescrevíveis por ambiente (ex.: servidores falsos do benchmark)
+VIACEP_URL = os.environ.get("KRATERAS_VIACEP_URL", "https://viacep.com.br/ws").rstrip('/')
+GEOCODING_URL = os.environ.get("KRATERAS_GEOCODING_URL", "https://maps.googleapis.com/maps/api/geocode/json")
+
+@cronometrado("viacep", resultado_por_erro)
+def buscar_cep_uncached(cep: str) -> Dict[str, Any]:
+    cep_limpo = re.sub(r'\D', '', cep)
+    if len(cep_limpo) != 8: return {"erro": "CEP inválido."}
+    def _consultar() -> Dict[str, Any]:
+        r = get_http_client().get(f"{VIACEP_URL}/{cep_limpo}/json/"); verificar_status(r, "ViaCEP")
+        return r.json()
+    try:
+        data = chamar("viacep", _consultar)
+        if data.get('erro'): return {"erro": f"CEP '{cep_limpo}' não encontrado."}
+        if not all(data.get(k) for k in ['logradouro', 'localidade', 'uf']): return {"erro": "Dados CEP incompletos."}
+        return data
+    except ServicoIndisponivel: return {"erro": "ViaCEP indisponível no momento. Tente de novo em instantes ou preencha o endereço manualmente.", "indisponivel": True}
+    except (PrazoEsgotado, requests.exceptions.Timeout): return {"erro": "Timeout ViaCEP."}
+    except ErroTransitorio as e: return {"erro": f"Erro ViaCEP: {e}"}
+    except requests.exceptions.RequestException as e: return {"erro": f"Erro ViaCEP: {e}."}
+    except Exception as e: return {"erro": f"Erro inesperado ViaCEP: {e}."}
+
+def buscar_cep(cep: str) -> Dict[str, Any]:
+    """Consulta a base local de CEPs (mmap); só chama o ViaCEP num miss e grava a resposta na base local."""
+    local = get_cep_index().buscar(cep)
+    if local is not None:
+        if not all(local.get(k) for k in ['logradouro', 'localidade', 'uf']): return {"erro": "Dados CEP incompletos."}
+        return local
+    data = buscar_cep_uncached(cep)
+    if 'erro' not in data: get_cep_index().adicionar(cep, data)
+    return data
+
+def _resultado_geo(lat: float, lng: float, fmt_addr: str, api_key: Optional[str]) -> Dict[str, Any]:
+    return {"latitude":lat,"longitude":lng,"endereco_formatado_api":fmt_addr,
+            "google_maps_link_gerado":f"https://www.google.com/maps/search/?api=1&query={lat},{lng}",
+            "google_embed_link_gerado":f"https://www.google.com/maps/embed/v1/place?key={api_key}&q={lat},{lng}"}
+
+@cronometrado("geocoding", resultado_por_erro)
+def geocodificar_endereco_uncached(rua: str, numero: str, cidade: str, estado: str, api_key: str) -> Dict[str, Any]:
+    if not api_key: return {"erro": "Chave GeoAPI não fornecida."}
+    if not all([rua, numero, cidade, estado]): return {"erro": "Endereço insuficiente."}
+    address = f"{rua}, {numero}, {cidade}, {estado}"
+    url = f"{GEOCODING_URL}?address={urllib.parse.quote(address)}&key={api_key}"
+    limitador = get_rate_limiter('geocoding')
+
+    def _consultar() -> Dict[str, Any]:
+        limitador.adquirir(prazo.restante() if (prazo := prazo_atual()) is not None else None)
+        r = get_http_client().get(url)
+        data = r.json() if r.ok else {}
+        limitador.registrar(r.status_code == 429 or data.get('status') == 'OVER_QUERY_LIMIT')
+        verificar_status(r, "Geocoding")
+        # Status transitórios da API vêm com HTTP 200
+        if data.get('status') in ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'):
+            raise ErroTransitorio(f"Geocoding respondeu {data['status']}.", cota=data['status'] == 'OVER_QUERY_LIMIT')
+        return data
+    try:
+        data = chamar("geocoding", _consultar)
+        if data['status'] != 'OK':
+            s, msg = data.get('status','DESCONHECIDO'), data.get('error_message','Sem mensagem.')
+            err_map = {'ZERO_RESULTS':"Nenhum local.",'OVER_DAILY_LIMIT':"Limite API.",'OVER_QUERY_LIMIT':"Limite API.",
+                       'REQUEST_DENIED':"Requisição API negada.",'INVALID_REQUEST':"Requisição inválida.",'UNKNOWN_ERROR':"Erro API."}
+            return {"erro": f"Geo falhou. {err_map.get(s, f'Status: {s}. {msg}')}", "status_api": s}
+        if not data['results']: return {"erro": "Geo falhou. Nenhum local.", "status_api": "ZERO_RESULTS"}
+        loc = data['results'][0]['geometry']['location']; lat,lng = loc['lat'],loc['lng']
+        fmt_addr = data['results'][0].get('formatted_address',address)
+        return _resultado_geo(lat, lng, fmt_addr, api_key)
+    except ServicoIndisponivel: return {"erro": "Geocodificação indisponível no momento; use a localização manual.", "status_api": "INDISPONIVEL"}
+    except (PrazoEsgotado, requests.exceptions.Timeout): return {"erro": f"Timeout Geo: {address}"}
+    except ErroTransitorio as e: return {"erro": f"Geo falhou. {e}"}
+    except requests.exceptions.RequestException as e: return {"erro": f"Erro Comunicação Geo: {e}"}
+    except Exception as e: return {"erro": f"Erro Inesperado Geo: {e}"}
+
+def geocodificar_endereco(rua: str, numero: str, cidade: str, estado: str, api_key: str) -> Dict[str, Any]:
+    """
+    Geocodificação com cache persistente por endereço normalizado. Guarda também resultados
+    negativos (ZERO_RESULTS), com TTL próprio; erros transitórios não são guardados.
+    """
+    if not api_key: return {"erro": "Chave GeoAPI não fornecida."}
+    if not all([rua, numero, cidade, estado]): return {"erro": "Endereço insuficiente."}
+    cache = get_geocode_cache()
+    chave = chave_endereco(rua, numero, cidade, estado)
+    if (cached := cache.get(chave)) is not None:
+        if 'erro' in cached: return cached
+        # Links são remontados com a chave atual (a chave de API nunca vai para o cache)
+        return {**_resultado_geo(cached['latitude'], cached['longitude'], cached['endereco_formatado_api'], api_key), "fonte": "cache"}
+    res = geocodificar_endereco_uncached(rua, numero, cidade, estado, api_key)
+    if 'erro' not in res:
+        cache.set(chave, {k: res[k] for k in ('latitude', 'longitude', 'endereco_formatado_api')})
+    elif res.get('status_api') == 'ZERO_RESULTS':
+        cache.set(chave, res, negativo=True)
+    return res
+
+def conferir_endereco(endereco: Dict[str, Any], local: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Confronta o endereço informado com o da geocodificação reversa local: preenche os campos vazios de `endereco`
+    (no próprio dicionário) e devolve, por campo, 'confere', 'diverge', 'preenchido' ou 'sem_dados'.
+    """
+    conferencia = {}
+    for campo, campo_local in CAMPOS_ENDERECO_LOCAL.items():
+        informado, achado = (endereco.get(campo) or '').strip(), (local.get(campo_local) or '').strip()
+        if not achado: conferencia[campo] = 'sem_dados'
+        elif not informado:
+            endereco[campo] = achado
+            conferencia[campo] = 'preenchido'
+        else:
+            a, b = normalizar_texto(informado), normalizar_texto(achado)
+            conferencia[campo] = 'confere' if a == b or a in b or b in a else 'diverge'
+    return conferencia
+
+def _enderecar_localmente(loc: Dict[str, Any], endereco: Dict[str, Any]) -> None:
+    """Rua/bairro/município/UF das coordenadas pelo índice local de ruas (se houver), sem nenhuma API."""
+    geocoder = get_reverse_geocoder()
+    if not geocoder.disponivel: return
+    local = geocoder.buscar(loc['latitude'], loc['longitude'])
+    if not local: return
+    loc['endereco_local'] = local
+    loc['endereco_formatado_local'] = ", ".join(p for p in (local['rua'], local['bairro'], local['municipio'], local['uf']) if p)
+    loc['conferencia_endereco'] = conferir_endereco(endereco, local)
+
+def processar_localizacao_exata(endereco: Dict[str, Any], numero_referencia: str, input_manual: str, geocoding_api_key: Optional[str]) -> Dict[str, Any]:
+    """
+    Monta `localizacao_exata_processada`. Coordenadas recuperáveis do input manual (decimais, graus/minutos,
+    plus code, links de mapa) têm prioridade e dispensam a geocodificação; sem elas, tenta geocodificar o
+    endereço base (que também serve de referência para um plus code curto) ou guarda o input como descrição.
+    Com coordenadas, o índice local de ruas confere e completa `endereco` (ver conferir_endereco).
+    """
+    loc = {"tipo":"Não informada"}
+    t_geo,geo_ok,geo_r=False,False,{}
+    r_b,c_b,e_b=endereco.get('rua'),endereco.get('cidade_buraco'),endereco.get('estado_buraco')
+    num_ref_g = (numero_referencia or '').strip()
+    tem_d_g = bool(geocoding_api_key and r_b and num_ref_g and c_b and e_b)
+    loc_m_v = (input_manual or '').strip()
+    coords = extrair_localizacao(loc_m_v) if loc_m_v else None
+    if tem_d_g and not coords:
+        t_geo=True
+        geo_r=geocodificar_endereco(r_b,num_ref_g,c_b,e_b,geocoding_api_key)
+        if 'erro' not in geo_r:
+            geo_ok=True
+            loc = {"tipo":"Geocodificada (API)","latitude":geo_r['latitude'],"longitude":geo_r['longitude'],"endereco_formatado_api":geo_r.get('endereco_formatado_api',''),"google_maps_link_gerado":geo_r['google_maps_link_gerado'],"google_embed_link_gerado":geo_r.get('google_embed_link_gerado'),"input_original":num_ref_g}
+            if tem_plus_code_curto(loc_m_v): coords = extrair_localizacao(loc_m_v, (geo_r['latitude'], geo_r['longitude']))
+    if coords:
+        lat_m,lon_m,tipo_m_p = coords['latitude'],coords['longitude'],coords['tipo']
+        loc={"tipo":tipo_m_p,"formato":coords['formato'],"input_original":loc_m_v,"latitude":lat_m,"longitude":lon_m,"google_maps_link_gerado":f"https://www.google.com/maps/search/?api=1&query={lat_m},{lon_m}","google_embed_link_gerado":f"https://www.google.com/maps/embed/v1/place?key={geocoding_api_key}&q={lat_m},{lon_m}" if geocoding_api_key else None}
+    elif loc_m_v and not geo_ok: loc={"tipo":"Descrição Manual Detalhada","input_original":loc_m_v,"descricao_manual":loc_m_v}
+    if loc.get('tipo') in TIPOS_LOC_COM_COORDS: _enderecar_localmente(loc, endereco)
+    else:
+        rsns=[]
+        if t_geo and 'erro' in geo_r: rsns.append(f"GeoAutoFalhou:{geo_r['erro']}")
+        elif not geocoding_api_key: rsns.append("ChaveGeoAPInãoFornecida.")
+        elif geocoding_api_key and not tem_d_g: rsns.append("DadosInsuficientesGeoAuto.")
+        if loc_m_v and not coords: rsns.append("CoordsNãoExtraídasInputManual.")
+        if rsns: loc['motivo_falha_geocodificacao_anterior']=" / ".join(rsns)
+        elif loc.get('tipo')=="Não informada": loc['motivo_falha_geocodificacao_anterior']="CoordsNãoObtidas."
+    return loc
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Cache persistente (SQLite) de geocodificação com chaves de endereço normalizadas.
+
+"R. José de Alencar, nº 120" e "rua jose de alencar 120" caem na mesma chave:
+acentos, caixa, pontuação e abreviações comuns (R., Av., Trav., ...) são normalizados.
+Resultados positivos e negativos (ZERO_RESULTS) têm TTLs separados; erros transitórios
+(limite de cota, timeout, chave negada) nunca são gravados.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+from settings import data_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_POSITIVO = 90 * 24 * 3600   # 90 dias
+DEFAULT_TTL_NEGATIVO = 24 * 3600        # 1 dia
+
+ABREVIACOES = {
+    'r': 'rua', 'av': 'avenida', 'avd': 'avenida', 'al': 'alameda', 'tv': 'travessa', 'trav': 'travessa',
+    'pc': 'praca', 'pca': 'praca', 'pr': 'praca', 'est': 'estrada', 'estr': 'estrada', 'rod': 'rodovia',
+    'lg': 'largo', 'lgo': 'largo', 'vl': 'vila', 'jd': 'jardim', 'jard': 'jardim', 'pq': 'parque', 'bc': 'beco',
+    'dr': 'doutor', 'dra': 'doutora', 'prof': 'professor', 'profa': 'professora', 'eng': 'engenheiro',
+    'gal': 'general', 'gen': 'general', 'cel': 'coronel', 'cap': 'capitao', 'ten': 'tenente', 'mal': 'marechal',
+    'pres': 'presidente', 'gov': 'governador', 'sen': 'senador', 'dep': 'deputado', 'vol': 'voluntario',
+    'sta': 'santa', 'sto': 'santo', 's': 'sao', 'n': 'nossa', 'sra': 'senhora', 'sr': 'senhor',
+}
+_RE_NAO_ALFANUM = re.compile(r'[^a-z0-9]+')
+_RE_NUMERO = re.compile(r'\d+[a-z]?')
+
+
+def _sem_acentos(texto: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+
+
+def normalizar_texto(texto: str, expandir_abreviacoes: bool = True) -> str:
+    tokens = _RE_NAO_ALFANUM.sub(' ', _sem_acentos(texto or '').lower()).split()
+    if expandir_abreviacoes:
+        tokens = [ABREVIACOES.get(t, t) for t in tokens]
+    return ' '.join(tokens)
+
+
+def normalizar_numero(numero: str) -> str:
+    """'nº 120-A' -> '120a'. Sem dígitos, usa o texto normalizado (ex.: 'em frente ao mercado')."""
+    texto = _sem_acentos(numero or '').lower().replace(' ', '').replace('-', '')
+    achado = _RE_NUMERO.search(texto)
+    return achado.group(0) if achado else normalizar_texto(numero, expandir_abreviacoes=False)
+
+
+def chave_endereco(rua: str, numero: str, cidade: str, estado: str) -> str:
+    """Chave canônica 'rua|numero|cidade|uf' usada no cache."""
+    return '|'.join([normalizar_texto(rua), normalizar_numero(numero),
+                     normalizar_texto(cidade, expandir_abreviacoes=False), _sem_acentos(estado or '').strip().upper()])
+
+
+class GeocodeCache:
+    """
+    Cache de geocodificação em disco, seguro para uso entre threads.
+    """
+
+    def __init__(self, db_path: str, ttl_positivo: int = DEFAULT_TTL_POSITIVO, ttl_negativo: int = DEFAULT_TTL_NEGATIVO):
+        self.ttl_positivo = ttl_positivo
+        self.ttl_negativo = ttl_negativo
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS geocodificacoes (
+                chave TEXT PRIMARY KEY,
+                resultado TEXT NOT NULL,
+                negativo INTEGER NOT NULL,
+                criado_em REAL NOT NULL
+            )"""
+        )
+
+    def get(self, chave: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT resultado, negativo, criado_em FROM geocodificacoes WHERE chave = ?", (chave,)).fetchone()
+            if row is not None:
+                resultado, negativo, criado_em = row
+                ttl = self.ttl_negativo if negativo else self.ttl_positivo
+                if time.time() - criado_em <= ttl:
+                    self.hits += 1
+                    return json.loads(resultado)
+                self._conn.execute("DELETE FROM geocodificacoes WHERE chave = ?", (chave,))
+            self.misses += 1
+            return None
+
+    def set(self, chave: str, resultado: Dict[str, Any], negativo: bool = False) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocodificacoes (chave, resultado, negativo, criado_em) VALUES (?, ?, ?, ?)",
+                (chave, json.dumps(resultado, ensure_ascii=False), int(negativo), time.time())
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            positivos, negativos = self._conn.execute(
+                "SELECT COALESCE(SUM(negativo = 0), 0), COALESCE(SUM(negativo = 1), 0) FROM geocodificacoes").fetchone()
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                    "entradas_positivas": positivos, "entradas_negativas": negativos}
+
+
+_cache_instance: Optional[GeocodeCache] = None
+_cache_instance_lock = threading.Lock()
+
+
+def get_geocode_cache() -> GeocodeCache:
+    """Instância única (por processo) do cache de geocodificação."""
+    global _cache_instance
+    with _cache_instance_lock:
+        if _cache_instance is None:
+            _cache_instance = GeocodeCache(
+                db_path=os.environ.get("KRATERAS_GEOCODE_CACHE_PATH", data_path("geocode_cache.sqlite3")),
+                ttl_positivo=int(os.environ.get("KRATERAS_GEOCODE_TTL_POSITIVO", DEFAULT_TTL_POSITIVO)),
+                ttl_negativo=int(os.environ.get("KRATERAS_GEOCODE_TTL_NEGATIVO", DEFAULT_TTL_NEGATIVO)),
+            )
+        return _cache_instance
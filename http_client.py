@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente HTTP compartilhado do Krateras (ViaCEP, Google Geocoding e futuras APIs externas).
+
+Uma única `requests.Session` por processo, com pool de conexões keep-alive por host e
+limite de conexões simultâneas por host. O transporte só repete falhas de conexão; timeouts
+de leitura e respostas 5xx/429 ficam com a camada de resiliência (`resilience.chamar`), que
+respeita o prazo da denúncia e o disjuntor de cada serviço. Os timeouts são encurtados até o prazo.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from resilience import limitar_timeout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (3.05, 10)           # (conexão, leitura) em segundos
+DEFAULT_POOL_CONNECTIONS = 8           # quantidade de hosts com pool mantido
+DEFAULT_POOL_MAXSIZE = 16              # conexões keep-alive por host
+DEFAULT_MAX_RETRIES = 2                # só falhas de conexão (ver resilience para o resto)
+DEFAULT_BACKOFF = 0.3
+
+
+class _RetryComJitter(Retry):
+    """Retry do urllib3 com jitter aleatório somado ao backoff (compatível com urllib3 1.x e 2.x)."""
+
+    def __init__(self, *args, jitter: float = DEFAULT_BACKOFF, on_retry=None, **kwargs):
+        self.jitter = jitter
+        self.on_retry = on_retry
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kw):
+        novo = super().new(**kw)
+        novo.jitter, novo.on_retry = self.jitter, self.on_retry
+        return novo
+
+    def get_backoff_time(self) -> float:
+        base = super().get_backoff_time()
+        return base + random.uniform(0, self.jitter) if base > 0 else base
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if self.on_retry:
+            self.on_retry(_pool.host if _pool is not None else (urlsplit(url).hostname if url else None))
+        return super().increment(method=method, url=url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace)
+
+
+class HttpClient:
+    """
+    Sessão HTTP com pool por host e métricas simples (requisições, erros, retentativas, latência).
+    """
+
+    def __init__(self, pool_connections: int = DEFAULT_POOL_CONNECTIONS, pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 max_retries: int = DEFAULT_MAX_RETRIES, backoff_factor: float = DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self._metricas: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        retry = _RetryComJitter(
+            total=max_retries, connect=max_retries, read=0, status=0,
+            backoff_factor=backoff_factor, allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False, jitter=backoff_factor,
+            on_retry=lambda host: self._registrar(host, "retries"),
+        )
+        # pool_block=True: ao atingir pool_maxsize, novas requisições esperam uma conexão livre
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                              max_retries=retry, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"User-Agent": "Krateras/10.1 (+https://github.com/icanello01/krateras)"})
+        self._adapter = adapter
+
+    def _registrar(self, host: Optional[str], campo: str, valor: float = 1) -> None:
+        with self._lock:
+            m = self._metricas.setdefault(host or "desconhecido", {"requisicoes": 0, "erros": 0, "retries": 0, "latencia_total_s": 0.0})
+            m[campo] += valor
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None, timeout=None, **kwargs) -> requests.Response:
+        """GET pelo pool compartilhado. Exceções de `requests` são propagadas como antes."""
+        host = urlsplit(url).hostname
+        inicio = time.monotonic()
+        try:
+            return self.session.get(url, params=params, timeout=limitar_timeout(timeout or self.timeout), **kwargs)
+        except requests.exceptions.RequestException:
+            self._registrar(host, "erros")
+            raise
+        finally:
+            self._registrar(host, "requisicoes")
+            self._registrar(host, "latencia_total_s", time.monotonic() - inicio)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Métricas por host, incluindo conexões ociosas no pool (keep-alive) e limite configurado."""
+        with self._lock:
+            metricas = {h: dict(m) for h, m in self._metricas.items()}
+        try:
+            pools = list(self._adapter.poolmanager.pools._container.values())
+        except AttributeError:  # estrutura interna do urllib3 mudou; seguimos só com os contadores
+            pools = []
+        for pool in pools:
+            m = metricas.setdefault(pool.host, {"requisicoes": 0, "erros": 0, "retries": 0, "latencia_total_s": 0.0})
+            m["conexoes_ociosas"] = pool.pool.qsize() if getattr(pool, "pool", None) is not None else 0
+            m["conexoes_abertas"] = getattr(pool, "num_connections", 0)
+            m["pool_maxsize"] = self.pool_maxsize
+        for m in metricas.values():
+            m["latencia_media_s"] = round(m["latencia_total_s"] / m["requisicoes"], 4) if m["requisicoes"] else 0.0
+        return metricas
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """Cliente HTTP único por processo (compartilhado entre sessões Streamlit e threads)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
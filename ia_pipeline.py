@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Execução das etapas de IA do Krateras como um pequeno grafo de dependências.
+
+Etapas independentes (análise visual, insights) rodam em paralelo num pool de threads
+limitado; urgência e causa/ação aguardam apenas os insights, e o resumo aguarda as três.
+Cada etapa tem seu próprio timeout, e todas consomem o mesmo prazo da denúncia (ver resilience);
+se uma etapa falhar ou estourar o tempo, o valor de fallback é usado e as etapas dependentes
+continuam, devolvendo um resultado parcial.
+No modo de chamada única, uma etapa "texto_unico" pede tudo ao Gemini de uma vez e as
+etapas de texto apenas distribuem o JSON (voltando às chamadas separadas se ele falhar).
+"""
+
+import contextvars
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from gemini_text import (
+    analisar_caracteristicas_e_observacoes_gemini,
+    categorizar_urgencia_gemini,
+    sugerir_causa_e_acao_gemini,
+    gerar_resumo_completo_gemini,
+    analise_completa_unica_gemini,
+)
+from image_analyzer import analisar_imagem_sem_interface
+from metrics import observar_etapa
+from prompt_compiler import ContextoPrompt
+from report_store import tem_imagem
+from resilience import PRAZO_DENUNCIA_PADRAO_S, Prazo, com_prazo, prazo_atual
+from spatial_index import get_spatial_index
+from urgency_rules import urgencia_por_regras
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_TIMEOUTS = {
+    "analise_visual": 90.0,
+    "insights": 45.0,
+    "urgencia": 45.0,
+    "sugestao_acao": 45.0,
+    "resumo": 60.0,
+    "texto_unico": 90.0,
+}
+
+# "etapas": quatro prompts encadeados; "unico": um prompt só, com resposta JSON validada por esquema
+MODOS_TEXTO = ("etapas", "unico")
+MODO_TEXTO_PADRAO = os.environ.get("KRATERAS_MODO_TEXTO", "etapas")
+
+# Etapas de texto que descrevem o buraco (e não o denunciante) e podem ser compartilhadas num cluster
+ETAPAS_REAPROVEITAVEIS = ("insights", "urgencia", "sugestao_acao")
+
+FALLBACKS = {
+    "insights": {"insights": "Análise IA Texto não realizada/erro."},
+    "urgencia": {"urgencia_ia": "Sugestão urgência IA Texto não gerada/erro."},
+    "sugestao_acao": {"sugestao_acao_ia": "Sugestões causa/ação IA Texto não geradas/erro."},
+    "resumo": {"resumo_ia": "Resumo IA Texto não gerado/erro."},
+}
+
+
+class Etapa:
+    """
+    Uma etapa do grafo: `funcao` recebe o dicionário com os resultados das dependências.
+    """
+
+    def __init__(self, nome: str, funcao: Callable[[Dict[str, Any]], Any], depende_de: Iterable[str] = (),
+                 timeout: Optional[float] = None, fallback: Any = None):
+        self.nome = nome
+        self.funcao = funcao
+        self.depende_de = tuple(depende_de)
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+def executar_grafo(etapas: Iterable[Etapa], max_workers: int = DEFAULT_MAX_WORKERS,
+                   ao_concluir: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                   prazo: Optional[Prazo] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Executa as etapas respeitando as dependências e retorna, por etapa,
+    {"resultado", "status" ('ok' | 'erro' | 'timeout'), "duracao_s", "erro"}.
+    `ao_concluir(nome, registro)` é chamado assim que cada etapa termina. Nenhuma etapa passa do `prazo`
+    (padrão: o prazo ativo), que também vale para as chamadas feitas dentro delas.
+    """
+    prazo = prazo or prazo_atual()
+    etapas = {e.nome: e for e in etapas}
+    for e in etapas.values():
+        faltando = [d for d in e.depende_de if d not in etapas]
+        if faltando:
+            raise ValueError(f"Etapa '{e.nome}' depende de etapas inexistentes: {faltando}")
+
+    relatorio: Dict[str, Dict[str, Any]] = {}
+    pendentes = dict(etapas)
+    em_execucao = {}  # future -> (nome, inicio)
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="krateras-ia")
+
+    def _concluir(nome: str, status: str, resultado: Any, inicio: float, erro: Optional[str] = None) -> None:
+        relatorio[nome] = {
+            "resultado": resultado,
+            "status": status,
+            "duracao_s": round(time.monotonic() - inicio, 3),
+            "erro": erro,
+        }
+        if status != "ok":
+            logger.warning(f"Etapa IA '{nome}' terminou com status '{status}': {erro}")
+        if ao_concluir:
+            try:
+                ao_concluir(nome, relatorio[nome])
+            except Exception as e:
+                logger.warning(f"Callback de conclusão da etapa '{nome}' falhou: {e}")
+
+    try:
+        while pendentes or em_execucao:
+            # Submete tudo que já tem as dependências resolvidas; com o prazo esgotado, nem começa
+            prontas = [n for n, e in pendentes.items() if all(d in relatorio for d in e.depende_de)]
+            for nome in prontas:
+                etapa = pendentes.pop(nome)
+                if prazo is not None and prazo.esgotado():
+                    _concluir(nome, "timeout", etapa.fallback, time.monotonic(), f"Prazo da denúncia ({prazo.segundos:g}s) esgotado.")
+                    continue
+                entradas = {d: relatorio[d]["resultado"] for d in etapa.depende_de}
+                # Cópia do contexto: as chamadas externas da etapa enxergam o prazo da denúncia
+                em_execucao[executor.submit(contextvars.copy_context().run, etapa.funcao, entradas)] = (nome, time.monotonic())
+
+            if not em_execucao:
+                if prontas: continue  # etapas encerradas pelo prazo liberaram as dependentes
+                # Não deveria acontecer: sobraram etapas com dependências cíclicas
+                raise ValueError(f"Dependências cíclicas entre as etapas: {list(pendentes)}")
+
+            def _limite(nome: str, inicio: float) -> Optional[float]:
+                limites = ([inicio + etapas[nome].timeout] if etapas[nome].timeout else []) + ([prazo.fim] if prazo is not None else [])
+                return min(limites) if limites else None
+
+            agora = time.monotonic()
+            prazos = [l for nome, inicio in em_execucao.values() if (l := _limite(nome, inicio)) is not None]
+            espera = max(0.0, min(prazos) - agora) if prazos else None
+            concluidos, _ = wait(list(em_execucao), timeout=espera, return_when=FIRST_COMPLETED)
+
+            for fut in concluidos:
+                nome, inicio = em_execucao.pop(fut)
+                try:
+                    _concluir(nome, "ok", fut.result(), inicio)
+                except Exception as e:
+                    logger.error(f"Erro na etapa IA '{nome}': {e}", exc_info=True)
+                    _concluir(nome, "erro", etapas[nome].fallback, inicio, str(e))
+
+            agora = time.monotonic()
+            for fut, (nome, inicio) in list(em_execucao.items()):
+                limite = _limite(nome, inicio)
+                if limite is not None and agora >= limite:
+                    # A thread não pode ser interrompida; apenas deixamos de esperar por ela.
+                    fut.cancel()
+                    em_execucao.pop(fut)
+                    timeout = etapas[nome].timeout
+                    motivo = (f"Tempo limite de {timeout:g}s excedido." if timeout and agora - inicio >= timeout
+                              else f"Prazo da denúncia ({prazo.segundos:g}s) esgotado.")
+                    _concluir(nome, "timeout", etapas[nome].fallback, inicio, motivo)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return relatorio
+
+
+def _texto_valido(resultado: Any) -> bool:
+    """Resposta real do modelo (não fallback, erro '❌' ou aviso de IA offline '🤖')."""
+    texto = next(iter(resultado.values()), '') if isinstance(resultado, dict) and resultado else ''
+    return bool(texto) and not texto.startswith(('❌', '🤖')) and resultado not in FALLBACKS.values()
+
+
+def agrupar_denuncia(denuncia: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Registra a denúncia no índice espacial (se tiver coordenadas) e devolve o cluster a que ela pertence.
+    """
+    loc = denuncia.get('localizacao_exata_processada', {})
+    lat, lon = loc.get('latitude'), loc.get('longitude')
+    if lat is None or lon is None:
+        return None
+    metadata = denuncia.setdefault('metadata', {})
+    id_den = metadata.setdefault('id_denuncia', uuid.uuid4().hex)
+    try:
+        ts = datetime.strptime(metadata.get('data_hora_utc', ''), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        ts = None
+    try:
+        return get_spatial_index().agrupar(id_den, float(lat), float(lon), ts)
+    except Exception as e:
+        logger.warning(f"Falha ao consultar o índice espacial: {e}")
+        return None
+
+
+def executar_pipeline_ia(denuncia: Dict[str, Any], model: Any, gemini_api_key: Optional[str],
+                         max_workers: int = DEFAULT_MAX_WORKERS,
+                         timeouts: Optional[Dict[str, float]] = None,
+                         agrupar_proximas: bool = True,
+                         modo_texto: Optional[str] = None,
+                         ao_receber: Optional[Callable[[str, str], None]] = None,
+                         ao_concluir_etapa: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                         prazo_s: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Roda análise visual + as quatro etapas de texto e devolve as chaves prontas para `denuncia_completa`
+    (resultado_analise_visual_krateras, insights_ia, urgencia_ia, sugestao_acao_ia, resumo_ia, pipeline_ia,
+    cluster_buracos). Se a denúncia cair num cluster que já tem análises, insights/urgência/causa-ação
+    são reaproveitados e só o resumo (que cita o denunciante) é gerado de novo.
+    `modo_texto` "unico" troca as quatro chamadas de texto por uma só com saída JSON (padrão: KRATERAS_MODO_TEXTO).
+    `ao_receber(etapa, texto_parcial)` é chamado (das threads do pool) enquanto as respostas chegam em streaming,
+    e `ao_concluir_etapa(etapa, registro)` quando cada etapa termina.
+    Todas as etapas dividem o prazo de `prazo_s` segundos (padrão KRATERAS_PRAZO_DENUNCIA_S), ou o prazo já ativo se for menor.
+    """
+    modo_texto = modo_texto or MODO_TEXTO_PADRAO
+    if modo_texto not in MODOS_TEXTO:
+        raise ValueError(f"modo_texto inválido: {modo_texto!r} (use {' ou '.join(MODOS_TEXTO)})")
+    timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+    bur_data = denuncia.get('buraco', {})
+    img_data = bur_data.get('imagem_denuncia')
+    carac, obs = bur_data.get('caracteristicas_estruturadas', {}), bur_data.get('observacoes_adicionais', '')
+
+    def _canal(nome: str) -> Optional[Callable[[str], None]]:
+        return (lambda texto: ao_receber(nome, texto)) if ao_receber else None
+
+    ts_agora = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    contexto = ContextoPrompt(denuncia)  # partes comuns dos prompts, renderizadas uma vez para todas as etapas
+    cluster = agrupar_denuncia(denuncia) if agrupar_proximas else None
+    reuso = (cluster or {}).get("resultado_ia") if cluster and not cluster["novo"] else None
+    if reuso:
+        logger.info(f"Denúncia anexada ao cluster {cluster['cluster_id']} ({cluster['n_denuncias']} denúncias); análises de texto reaproveitadas.")
+
+    if tem_imagem(img_data):
+        fn_visual = lambda _: analisar_imagem_sem_interface(img_data, gemini_api_key, ao_receber=_canal("analise_visual"))
+    else:
+        fn_visual = lambda _: {"status": "skipped", "analise_visual": "Nenhuma imagem.", "timestamp": ts_agora}
+
+    # Modo chamada única: as etapas de texto só extraem sua parte do JSON; se ele falhar, cada uma faz sua chamada
+    unico = modo_texto == "unico" and not reuso
+    extra = ["texto_unico"] if unico else []
+
+    def _parte(nome: str, fn: Callable[[Dict[str, Any]], Any]) -> Callable[[Dict[str, Any]], Any]:
+        return (lambda r: r["texto_unico"][nome] if r["texto_unico"] else fn(r)) if unico else fn
+
+    # Caminho rápido: urgência decidida pelas regras locais dispensa o Gemini (e a espera pelos insights)
+    urgencia_local = None if reuso else urgencia_por_regras(denuncia)
+
+    def _urgencia_local(_: Dict[str, Any]) -> Dict[str, Any]:
+        if (canal := _canal("urgencia")): canal(urgencia_local["urgencia_ia"])
+        return urgencia_local
+
+    if reuso: etapa_urgencia = Etapa("urgencia", lambda _: reuso["urgencia"], timeout=timeouts["urgencia"], fallback=FALLBACKS["urgencia"])
+    elif urgencia_local: etapa_urgencia = Etapa("urgencia", _urgencia_local, timeout=timeouts["urgencia"], fallback=FALLBACKS["urgencia"])
+    else:
+        etapa_urgencia = Etapa("urgencia", _parte("urgencia", lambda r: categorizar_urgencia_gemini(denuncia, r["insights"], model, _canal("urgencia"), contexto)),
+                               depende_de=["insights"] + extra, timeout=timeouts["urgencia"], fallback=FALLBACKS["urgencia"])
+
+    etapas = [
+        Etapa("analise_visual", fn_visual, timeout=timeouts["analise_visual"],
+              fallback={"status": "error", "analise_visual": "Análise visual não concluída (erro/tempo limite).", "timestamp": ts_agora}),
+        Etapa("insights", (lambda _: reuso["insights"]) if reuso else _parte("insights", lambda _: analisar_caracteristicas_e_observacoes_gemini(carac, obs, model, _canal("insights"), contexto)),
+              depende_de=extra, timeout=timeouts["insights"], fallback=FALLBACKS["insights"]),
+        etapa_urgencia,
+        Etapa("sugestao_acao", (lambda _: reuso["sugestao_acao"]) if reuso else _parte("sugestao_acao", lambda r: sugerir_causa_e_acao_gemini(denuncia, r["insights"], model, _canal("sugestao_acao"), contexto)),
+              depende_de=["insights"] + extra, timeout=timeouts["sugestao_acao"], fallback=FALLBACKS["sugestao_acao"]),
+        Etapa("resumo", _parte("resumo", lambda r: gerar_resumo_completo_gemini(denuncia, r["insights"], r["urgencia"], r["sugestao_acao"], model, _canal("resumo"), contexto)),
+              depende_de=["insights", "urgencia", "sugestao_acao"] + extra, timeout=timeouts["resumo"], fallback=FALLBACKS["resumo"]),
+    ]
+    if unico:
+        # Com a urgência das regras locais, a chamada única a recebe pronta: o resumo do JSON não contradiz urgencia_ia
+        categoria_fixa = urgencia_local["categoria"] if urgencia_local else None
+        etapas.append(Etapa("texto_unico", lambda _: analise_completa_unica_gemini(denuncia, model, contexto, categoria_fixa), timeout=timeouts["texto_unico"]))
+
+    inicio = time.monotonic()
+    with com_prazo(PRAZO_DENUNCIA_PADRAO_S if prazo_s is None else prazo_s) as prazo:
+        relatorio = executar_grafo(etapas, max_workers=max_workers, ao_concluir=ao_concluir_etapa, prazo=prazo)
+    duracao_total = round(time.monotonic() - inicio, 3)
+    observar_etapa("pipeline_ia", duracao_total, "ok" if all(r["status"] == "ok" for r in relatorio.values()) else "parcial")
+    logger.info(f"Pipeline IA concluído em {duracao_total}s: " + ", ".join(f"{n}={r['duracao_s']}s/{r['status']}" for n, r in relatorio.items()))
+
+    if cluster and not reuso and all(relatorio[n]["status"] == "ok" and _texto_valido(relatorio[n]["resultado"]) for n in ETAPAS_REAPROVEITAVEIS):
+        try:
+            get_spatial_index().salvar_resultado_cluster(cluster["cluster_id"], {n: relatorio[n]["resultado"] for n in ETAPAS_REAPROVEITAVEIS})
+        except Exception as e:
+            logger.warning(f"Não foi possível salvar o resultado do cluster {cluster['cluster_id']}: {e}")
+
+    return {
+        "cluster_buracos": {k: v for k, v in cluster.items() if k != "resultado_ia"} | {"analises_reaproveitadas": bool(reuso)} if cluster else None,
+        "resultado_analise_visual_krateras": relatorio["analise_visual"]["resultado"],
+        "insights_ia": relatorio["insights"]["resultado"],
+        "urgencia_ia": relatorio["urgencia"]["resultado"],
+        "sugestao_acao_ia": relatorio["sugestao_acao"]["resultado"],
+        "resumo_ia": relatorio["resumo"]["resultado"],
+        "pipeline_ia": {
+            "duracao_total_s": duracao_total,
+            "tokens_prompt": dict(contexto.tokens),
+            "etapas": {n: {k: v for k, v in r.items() if k != "resultado"} for n, r in relatorio.items()},
+        },
+    }
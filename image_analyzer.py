@@ -1,21 +1,65 @@
 import base64
-import time
 import logging
+import threading
 import google.generativeai as genai
-from PIL import Image
+from PIL import Image, ImageOps
 import io
-from typing import Dict, Any 
-import streamlit as st 
+from typing import Callable, Dict, Any, Optional, Tuple
 from datetime import datetime
-import textwrap # <--- IMPORTAÇÃO ADICIONADA
+from image_hash import dhash, get_image_hash_index
+from gemini_text import gerar_conteudo
+from model_registry import get_model_registry
+from metrics import cronometrado, get_metricas
+from prompt_compiler import TOKENS_POR_IMAGEM, ModeloPrompt, registrar_tokens
+from rate_limiter import erro_de_cota
+from report_store import bytes_imagem
+from resilience import ServicoIndisponivel
 
-# Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Pré-processamento da imagem enviada ao Gemini: o modelo não ganha nada acima de ~1.5k px
+MAX_LADO_IMAGEM_API = 1536
+ORCAMENTO_BYTES_IMAGEM_API = 400 * 1024
+QUALIDADE_JPEG_MIN = 40
+QUALIDADE_JPEG_PADRAO = 85
+
+MODELO_IMAGEM = 'gemini-1.5-flash-latest'
+
+# Prompt da análise visual, compilado uma vez (não depende da denúncia)
+PROMPT_ANALISE_VISUAL = ModeloPrompt("analise_visual", """
+    Você é um especialista em análise de problemas em vias públicas.
+    Analise a imagem fornecida e forneça uma análise técnica detalhada sobre o buraco ou defeito na via.
+    
+    Siga EXATAMENTE este formato na sua resposta:
+
+    DESCRIÇÃO FÍSICA:
+    - Tamanho aparente do buraco: [Descreva o tamanho, por exemplo, pequeno, médio, grande, ou dimensões aproximadas se visível]
+    - Forma e características: [Descreva a forma, por exemplo, circular, irregular, bordas afiadas, etc.]
+    - Profundidade estimada: [Descreva a profundidade, por exemplo, rasa, moderada, profunda, ou estimativa em cm/polegadas se possível]
+    - Condições do asfalto ao redor: [Descreva o asfalto, por exemplo, rachado, desgastado, intacto, etc.]
+
+    AVALIAÇÃO DE SEVERIDADE:
+    - Nível: [BAIXO/MÉDIO/ALTO/CRÍTICO]
+    - Justificativa: [Explique o porquê do nível de severidade escolhido]
+
+    RISCOS IDENTIFICADOS:
+    - Para veículos: [Descreva os riscos, por exemplo, danos a pneus/suspensão, perda de controle]
+    - Para pedestres/ciclistas: [Descreva os riscos, por exemplo, tropeços, quedas, desvio para tráfego]
+    - Outros riscos: [Se houver, por exemplo, acúmulo de água, etc.]
+
+    CONDIÇÕES AGRAVANTES:
+    - Problemas adicionais: [Se houver, por exemplo, múltiplos buracos, má iluminação na área, etc.]
+    - Fatores de risco: [Se houver, por exemplo, tráfego intenso, área escolar, curva perigosa]
+
+    RECOMENDAÇÕES:
+    - Tipo de intervenção: [Sugira o tipo de reparo, por exemplo, tapa-buraco, recapeamento parcial, etc.]
+    - Urgência do reparo: [Com base na severidade, por exemplo, imediato, em poucos dias, planejado]
+    - Medidas temporárias: [Se aplicável, por exemplo, sinalização, cones, placa metálica]
+""")
+
+def _contar_tentativa(resultado: str) -> None:
+    get_metricas().incrementar("krateras_gemini_imagem_tentativas_total", ajuda="Tentativas de análise de imagem no Gemini por resultado.", resultado=resultado)
+
 class ImageAnalyzer:
     """
     Classe principal para análise de imagens de buracos em vias públicas.
@@ -104,58 +148,76 @@ class ImageAnalyzer:
                 "width": 0, "height": 0, "size_kb": 0
             }
 
-    def analyze_image_with_gemini(self, image_bytes: bytes, api_key: str) -> Dict[str, Any]:
+    @cronometrado("codificacao_imagem")
+    def prepare_image_for_api(self, image_bytes: bytes, lado_maximo: int = MAX_LADO_IMAGEM_API,
+                              orcamento_bytes: int = ORCAMENTO_BYTES_IMAGEM_API) -> Tuple[bytes, Dict[str, Any]]:
+        """
+        Corrige a orientação EXIF, reduz o lado maior para `lado_maximo` e escolhe a qualidade JPEG
+        (busca binária) que cabe em `orcamento_bytes`. Retorna (bytes JPEG, informações do preparo).
+        """
+        image_pil = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+        if image_pil.mode != 'RGB':
+            image_pil = image_pil.convert('RGB')
+        tamanho_original = image_pil.size
+        if max(image_pil.size) > lado_maximo:
+            image_pil.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+
+        def _encode(img: Image.Image, qualidade: int) -> bytes:
+            buf = io.BytesIO()
+            img.save(buf, format='JPEG', quality=qualidade, optimize=True)
+            return buf.getvalue()
+
+        while True:
+            # Caso comum: a qualidade padrão já cabe no orçamento e evita a busca
+            dados = _encode(image_pil, QUALIDADE_JPEG_PADRAO)
+            if len(dados) <= orcamento_bytes:
+                melhor = (dados, QUALIDADE_JPEG_PADRAO)
+                break
+            melhor = None
+            lo, hi = QUALIDADE_JPEG_MIN, QUALIDADE_JPEG_PADRAO - 1
+            while lo <= hi:
+                qualidade = (lo + hi) // 2
+                dados = _encode(image_pil, qualidade)
+                if len(dados) <= orcamento_bytes:
+                    melhor, lo = (dados, qualidade), qualidade + 1
+                else:
+                    hi = qualidade - 1
+            if melhor or max(image_pil.size) <= 256:
+                break
+            # Nem a qualidade mínima coube: reduz mais a resolução e tenta de novo
+            image_pil = image_pil.resize((max(1, int(image_pil.width * 0.75)), max(1, int(image_pil.height * 0.75))), Image.LANCZOS)
+
+        if melhor is None:
+            logger.warning(f"Imagem não coube no orçamento de {orcamento_bytes} bytes; usando qualidade mínima.")
+            melhor = (_encode(image_pil, QUALIDADE_JPEG_MIN), QUALIDADE_JPEG_MIN)
+
+        dados, qualidade = melhor
+        return dados, {
+            "tamanho_original": tamanho_original,
+            "tamanho_final": image_pil.size,
+            "qualidade_jpeg": qualidade,
+            "bytes_originais": len(image_bytes),
+            "bytes_finais": len(dados),
+        }
+
+    @cronometrado("gemini_imagem", lambda r: 'ok' if r.get("status") == "success" else 'erro')
+    def analyze_image_with_gemini(self, image_bytes: bytes, api_key: str,
+                                  ao_receber: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
-        Analisa uma imagem usando o modelo Gemini.
+        Analisa uma imagem usando o modelo Gemini. Com `ao_receber`, a resposta é transmitida em
+        streaming e a função recebe o texto acumulado (recomeçando do zero a cada nova tentativa).
+        Falhas transitórias são repetidas por `gerar_conteudo`; bloqueios e respostas vazias não.
         """
         timestamp_agora = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
         try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash-latest') 
-            
-            image_pil = Image.open(io.BytesIO(image_bytes))
-            if image_pil.mode != 'RGB':
-                image_pil = image_pil.convert('RGB')
+            model = get_model_registry().get_model(api_key, MODELO_IMAGEM)
             
-            img_byte_arr_jpeg = io.BytesIO()
-            image_pil.save(img_byte_arr_jpeg, format='JPEG', quality=85, optimize=True)
-            img_byte_arr_val = img_byte_arr_jpeg.getvalue()
-
-            tamanho_processado_kb = len(img_byte_arr_val) / 1024.0
-            logger.info(f"Tamanho da imagem para API Gemini (após conversão JPEG): {tamanho_processado_kb:.2f} KB")
-            if tamanho_processado_kb > 3800: 
-                 logger.warning(f"Imagem para API ainda é grande ({tamanho_processado_kb:.2f} KB), pode causar problemas.")
-
-            prompt = textwrap.dedent("""
-            Você é um especialista em análise de problemas em vias públicas.
-            Analise a imagem fornecida e forneça uma análise técnica detalhada sobre o buraco ou defeito na via.
-            
-            Siga EXATAMENTE este formato na sua resposta:
-
-            DESCRIÇÃO FÍSICA:
-            - Tamanho aparente do buraco: [Descreva o tamanho, por exemplo, pequeno, médio, grande, ou dimensões aproximadas se visível]
-            - Forma e características: [Descreva a forma, por exemplo, circular, irregular, bordas afiadas, etc.]
-            - Profundidade estimada: [Descreva a profundidade, por exemplo, rasa, moderada, profunda, ou estimativa em cm/polegadas se possível]
-            - Condições do asfalto ao redor: [Descreva o asfalto, por exemplo, rachado, desgastado, intacto, etc.]
+            img_byte_arr_val, info_preparo = self.prepare_image_for_api(image_bytes)
+            logger.info(f"Imagem preparada para API Gemini: {info_preparo}")
 
-            AVALIAÇÃO DE SEVERIDADE:
-            - Nível: [BAIXO/MÉDIO/ALTO/CRÍTICO]
-            - Justificativa: [Explique o porquê do nível de severidade escolhido]
+            prompt = PROMPT_ANALISE_VISUAL.texto
+            registrar_tokens("analise_visual", PROMPT_ANALISE_VISUAL.tokens_base + TOKENS_POR_IMAGEM)
 
-            RISCOS IDENTIFICADOS:
-            - Para veículos: [Descreva os riscos, por exemplo, danos a pneus/suspensão, perda de controle]
-            - Para pedestres/ciclistas: [Descreva os riscos, por exemplo, tropeços, quedas, desvio para tráfego]
-            - Outros riscos: [Se houver, por exemplo, acúmulo de água, etc.]
-
-            CONDIÇÕES AGRAVANTES:
-            - Problemas adicionais: [Se houver, por exemplo, múltiplos buracos, má iluminação na área, etc.]
-            - Fatores de risco: [Se houver, por exemplo, tráfego intenso, área escolar, curva perigosa]
-
-            RECOMENDAÇÕES:
-            - Tipo de intervenção: [Sugira o tipo de reparo, por exemplo, tapa-buraco, recapeamento parcial, etc.]
-            - Urgência do reparo: [Com base na severidade, por exemplo, imediato, em poucos dias, planejado]
-            - Medidas temporárias: [Se aplicável, por exemplo, sinalização, cones, placa metálica]
-            """)
 
             generation_config = {
                 "temperature": 0.4, 
@@ -171,71 +233,71 @@ class ImageAnalyzer:
                 {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
             ]
             
-            max_retries = 3
-            for attempt in range(max_retries):
-                logger.info(f"Tentativa {attempt + 1} de {max_retries} para análise com Gemini.")
-                try:
-                    parts = [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg", 
-                                "data": base64.b64encode(img_byte_arr_val).decode('utf-8')
-                            }
-                        }
-                    ]
-                    
-                    response = model.generate_content(
-                        parts,
-                        generation_config=generation_config,
-                        safety_settings=safety_settings,
-                        stream=False
-                    )
-                    
-                    logger.info(f"Resposta recebida da API Gemini na tentativa {attempt + 1}.")
-
-                    if hasattr(response, 'prompt_feedback') and response.prompt_feedback and response.prompt_feedback.block_reason:
-                        block_reason_name = response.prompt_feedback.block_reason.name
-                        logger.error(f"Tentativa {attempt + 1}: Conteúdo bloqueado pela API Gemini. Razão: {block_reason_name}")
-                        if attempt == max_retries - 1:
-                            return {
-                                "status": "error", 
-                                "analise_visual": f"Conteúdo bloqueado pela API após {max_retries} tentativas. Razão: {block_reason_name}",
-                                "timestamp": timestamp_agora
-                            }
-                        time.sleep(2 + attempt) 
-                        continue
-
-                    text_content = None
-                    if hasattr(response, 'text') and response.text is not None:
-                        text_content = response.text.strip()
-
-                    if text_content:
-                        logger.info(f"Análise de texto obtida com sucesso na tentativa {attempt + 1}.")
-                        return {
-                            "status": "success",
-                            "analise_visual": text_content,
-                            "timestamp": timestamp_agora
-                        }
-                    else:
-                        logger.warning(f"Resposta de texto vazia ou inválida na tentativa {attempt + 1} da API Gemini.")
-                
-                except Exception as e:
-                    logger.error(f"Erro durante a chamada da API Gemini na tentativa {attempt + 1}: {str(e)}", exc_info=True)
-                
-                if attempt < max_retries - 1:
-                    logger.info(f"Aguardando para a próxima tentativa...")
-                    time.sleep(2 + attempt) 
-                else: 
-                    logger.error(f"Todas as {max_retries} tentativas de análise de imagem falharam em obter uma resposta válida da API Gemini.")
-                    return {
-                        "status": "error",
-                        "analise_visual": f"Falha ao obter análise da imagem da API Gemini após {max_retries} tentativas.",
-                        "timestamp": timestamp_agora
+            # Payload montado uma única vez e reutilizado em todas as tentativas
+            parts = [
+                {"text": prompt},
+                {
+                    "inline_data": {
+                        "mime_type": "image/jpeg", 
+                        "data": base64.b64encode(img_byte_arr_val).decode('utf-8')
                     }
-            return { # Fallback se o loop terminar sem return (não deveria acontecer)
-                "status": "error", 
-                "analise_visual": "Falha inesperada no loop de tentativas da API Gemini.",
+                }
+            ]
+
+            # Retentativas (só para erros transitórios), prazo e disjuntor ficam com gerar_conteudo/resilience
+            try:
+                response = gerar_conteudo(
+                    model,
+                    parts,
+                    ao_receber,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings
+                )
+            except ServicoIndisponivel as e:
+                logger.warning(f"Análise visual pulada: {e}")
+                _contar_tentativa('indisponivel')
+                return {
+                    "status": "error",
+                    "analise_visual": f"🤖 Análise visual indisponível no momento: {e}",
+                    "timestamp": timestamp_agora
+                }
+            except Exception as e:
+                logger.error(f"Erro durante a chamada da API Gemini: {str(e)}", exc_info=True)
+                _contar_tentativa('cota' if erro_de_cota(e) else 'erro')
+                return {
+                    "status": "error",
+                    "analise_visual": f"Falha ao obter análise da imagem da API Gemini: {str(e)}",
+                    "timestamp": timestamp_agora
+                }
+
+            # Bloqueio e resposta vazia são permanentes para esta imagem e este prompt: repetir não adianta
+            if hasattr(response, 'prompt_feedback') and response.prompt_feedback and response.prompt_feedback.block_reason:
+                block_reason_name = response.prompt_feedback.block_reason.name
+                logger.error(f"Conteúdo bloqueado pela API Gemini. Razão: {block_reason_name}")
+                _contar_tentativa('bloqueado')
+                return {
+                    "status": "error",
+                    "analise_visual": f"Conteúdo bloqueado pela API. Razão: {block_reason_name}",
+                    "timestamp": timestamp_agora
+                }
+
+            text_content = None
+            if hasattr(response, 'text') and response.text is not None:
+                text_content = response.text.strip()
+
+            if text_content:
+                logger.info("Análise de texto obtida com sucesso da API Gemini.")
+                _contar_tentativa('ok')
+                return {
+                    "status": "success",
+                    "analise_visual": text_content,
+                    "timestamp": timestamp_agora
+                }
+            logger.warning("Resposta de texto vazia ou inválida da API Gemini.")
+            _contar_tentativa('vazio')
+            return {
+                "status": "error",
+                "analise_visual": "A API Gemini não devolveu texto para a imagem.",
                 "timestamp": timestamp_agora
             }
 
@@ -279,114 +341,121 @@ class ImageAnalyzer:
     def get_severity_color(self, nivel: str) -> str:
         return self.SEVERITY_COLORS.get(nivel, self.SEVERITY_COLORS["INDEFINIDO"])
 
-    def analyze_image(self, imagem_data: Dict[str, Any]) -> Dict[str, Any]:
+    def run_analysis(self, imagem_data: Dict[str, Any], api_key: str, qualidade: Dict[str, Any] = None,
+                     ignorar_qualidade: bool = False, ao_receber: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
-        Processa e exibe a análise de imagem.
+        Executa a análise visual sem nenhuma chamada Streamlit (seguro para threads e lotes).
+        `ao_receber` recebe o texto parcial da análise enquanto ele é transmitido.
         """
         timestamp_geral_inicio = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-        if not imagem_data or 'bytes' not in imagem_data:
-            msg = "Nenhuma imagem fornecida para análise."
-            if hasattr(st, 'error'): st.error(f"❌ {msg}") # Só usa st se disponível
-            logger.warning("analyze_image chamada sem imagem_data ou sem 'bytes'.")
-            return {"status": "error", "analise_visual": msg, "timestamp_geral": timestamp_geral_inicio}
+        image_bytes = bytes_imagem(imagem_data)
+        if not image_bytes:
+            logger.warning("run_analysis chamada sem imagem_data ou com imagem indisponível.")
+            return {"status": "error", "analise_visual": "Nenhuma imagem fornecida para análise.", "timestamp_geral": timestamp_geral_inicio}
 
-        # Acessar st.secrets apenas se st estiver disponível (para portabilidade)
-        api_key_from_secrets = None
-        if hasattr(st, 'secrets'):
-            api_key_from_secrets = st.secrets.get("GOOGLE_API_KEY")
-
-        if not api_key_from_secrets:
-            msg = "Chave da API Google (GOOGLE_API_KEY) não configurada."
-            if hasattr(st, 'error'): st.error(f"❌ {msg}")
+        if not api_key:
             logger.error("GOOGLE_API_KEY não encontrada.")
-            return {"status": "error", "analise_visual": msg, "timestamp_geral": timestamp_geral_inicio}
-            
-        qualidade = self.check_image_quality(imagem_data['bytes'])
-        logger.info(f"Qualidade da imagem: Status={qualidade['status']}, Problemas={qualidade.get('problemas', [])}, Tamanho KB: {qualidade.get('size_kb')}")
+            return {"status": "error", "analise_visual": "Chave da API Google (GOOGLE_API_KEY) não configurada.", "timestamp_geral": timestamp_geral_inicio}
 
-        if not qualidade["status"]:
-            if hasattr(st, 'warning'): st.warning("⚠️ Aviso sobre a qualidade da imagem:")
-            for problema in qualidade["problemas"]:
-                if hasattr(st, 'write'): st.write(f"- {problema}")
-            
-            continuar_analise = True # Default para True se não estiver em contexto Streamlit
-            if hasattr(st, 'button'):
-                if not st.button("Continuar com a análise mesmo assim", key=f"continuar_qualidade_ruim_{int(time.time())}"):
-                    continuar_analise = False
-            
-            if not continuar_analise:
-                msg = "Usuário optou por não continuar devido à qualidade da imagem."
-                logger.info(msg)
+        if qualidade is None:
+            qualidade = self.check_image_quality(image_bytes)
+            logger.info(f"Qualidade da imagem: Status={qualidade['status']}, Problemas={qualidade.get('problemas', [])}, Tamanho KB: {qualidade.get('size_kb')}")
+
+        if not qualidade["status"] and not ignorar_qualidade:
+            msg = "Análise não realizada devido à qualidade da imagem."
+            logger.info(msg)
+            return {
+                "status": "skipped",
+                "analise_visual": msg,
+                "qualidade_imagem": qualidade,
+                "timestamp_geral": timestamp_geral_inicio
+            }
+
+        try:
+            # Quase-duplicatas (mesma foto recomprimida/redimensionada) reaproveitam a análise já feita
+            hash_imagem = None
+            try:
+                hash_imagem = dhash(image_bytes)
+                anterior = get_image_hash_index().buscar(hash_imagem)
+            except Exception as e:
+                logger.warning(f"Não foi possível consultar o índice de hash perceptual: {str(e)}")
+                anterior = None
+            if anterior:
+                logger.info(f"Imagem quase idêntica já analisada (hash {anterior['hash_origem']}, distância {anterior['distancia_hamming']}); análise reaproveitada.")
                 return {
-                    "status": "skipped", 
-                    "analise_visual": msg, 
+                    "status": "success",
+                    "analise_visual_ia": anterior["analise_visual_ia"],
+                    "nivel_severidade": anterior["nivel_severidade"],
+                    "cor_severidade": self.get_severity_color(anterior["nivel_severidade"]),
                     "qualidade_imagem": qualidade,
-                    "timestamp_geral": timestamp_geral_inicio
-                } 
-            if hasattr(st, 'warning'): st.warning("Prosseguindo com a análise, mas os resultados podem não ser ideais.")
+                    "timestamp_geral": timestamp_geral_inicio,
+                    "hash_perceptual": f"{hash_imagem:016x}",
+                    "reaproveitada_de": {"hash": anterior["hash_origem"], "distancia_hamming": anterior["distancia_hamming"]}
+                }
 
-        spinner_active = False
-        try:
-            if hasattr(st, 'spinner'):
-                spinner_context = st.spinner("🔍 Analisando imagem com IA (Krateras Image Analyzer)...")
-                spinner_context.__enter__()
-                spinner_active = True
-            
             logger.info(f"Iniciando análise da imagem de {qualidade.get('size_kb', 0):.2f} KB com Gemini.")
             resultado_analise_gemini = self.analyze_image_with_gemini(
-                image_bytes=imagem_data['bytes'],
-                api_key=api_key_from_secrets # Passa a chave lida
+                image_bytes=image_bytes,
+                api_key=api_key,
+                ao_receber=ao_receber
             )
 
             if resultado_analise_gemini and resultado_analise_gemini.get("status") == "success":
-                analise_texto_visual = resultado_analise_gemini["analise_visual"]
-                nivel = self.extract_severity_level(analise_texto_visual)
-                cor = self.get_severity_color(nivel)
+                nivel = self.extract_severity_level(resultado_analise_gemini["analise_visual"])
                 logger.info(f"Análise visual bem-sucedida. Nível de severidade extraído: {nivel}")
-
-                if hasattr(st, 'success'):
-                    st.success("✅ Análise de imagem concluída pelo Krateras Image Analyzer!")
-                    st.markdown(
-                        f"""<div style='padding: 10px; border-radius: 5px; background-color: {cor}; color: white; text-align: center;'>
-                            <h3 style='margin: 0;'>Nível de Severidade (Análise Visual): {nivel}</h3>
-                        </div><br>""", unsafe_allow_html=True)
-                    st.markdown("### Análise Técnica Visual Detalhada (IA)")
-                    st.markdown(analise_texto_visual)
-
-                resultado_final = {
-                    "status": "success", 
-                    "analise_visual_ia": resultado_analise_gemini, 
-                    "nivel_severidade": nivel,
-                    "cor_severidade": cor,
-                    "qualidade_imagem": qualidade,
-                    "timestamp_geral": timestamp_geral_inicio 
-                }
-                return resultado_final
-            else:
-                erro_msg = resultado_analise_gemini.get("analise_visual", "Erro desconhecido na análise com IA Gemini.")
-                if hasattr(st, 'error'): st.error(f"Falha na análise com IA Gemini: {erro_msg}")
-                logger.error(f"Falha reportada por analyze_image_with_gemini: {erro_msg}")
+                if hash_imagem is not None:
+                    try:
+                        get_image_hash_index().adicionar(hash_imagem, {"analise_visual_ia": resultado_analise_gemini, "nivel_severidade": nivel})
+                    except Exception as e:
+                        logger.warning(f"Não foi possível gravar no índice de hash perceptual: {str(e)}")
                 return {
-                    "status": "error", 
-                    "analise_visual": erro_msg, 
+                    "status": "success",
+                    "analise_visual_ia": resultado_analise_gemini,
+                    "nivel_severidade": nivel,
+                    "cor_severidade": self.get_severity_color(nivel),
                     "qualidade_imagem": qualidade,
-                    "timestamp_geral": timestamp_geral_inicio
+                    "timestamp_geral": timestamp_geral_inicio,
+                    "hash_perceptual": f"{hash_imagem:016x}" if hash_imagem is not None else None
                 }
-        except Exception as e: 
-            error_msg = f"❌ Erro inesperado durante o processo de análise da imagem: {str(e)}"
-            if hasattr(st, 'error'): st.error(error_msg)
-            logger.error(f"Erro no método analyze_image: {str(e)}", exc_info=True)
+            erro_msg = resultado_analise_gemini.get("analise_visual", "Erro desconhecido na análise com IA Gemini.")
+            logger.error(f"Falha reportada por analyze_image_with_gemini: {erro_msg}")
+            return {
+                "status": "error",
+                "analise_visual": erro_msg,
+                "qualidade_imagem": qualidade,
+                "timestamp_geral": timestamp_geral_inicio
+            }
+        except Exception as e:
+            logger.error(f"Erro no método run_analysis: {str(e)}", exc_info=True)
             return {
-                "status": "error", 
-                "analise_visual": error_msg,
-                "qualidade_imagem": qualidade, 
+                "status": "error",
+                "analise_visual": f"❌ Erro inesperado durante o processo de análise da imagem: {str(e)}",
+                "qualidade_imagem": qualidade,
                 "timestamp_geral": timestamp_geral_inicio
             }
-        finally:
-            if spinner_active:
-                spinner_context.__exit__(None, None, None)
 
+    def show_analysis_result(self, resultado: Dict[str, Any]) -> None:
+        """
+        Exibe no Streamlit o resultado produzido por run_analysis (só o app chama; o motor não importa o Streamlit).
+        """
+        import streamlit as st
+        if not resultado:
+            return
+        if resultado.get("status") == "success":
+            st.success("✅ Análise de imagem concluída pelo Krateras Image Analyzer!")
+            st.markdown(
+                f"""<div style='padding: 10px; border-radius: 5px; background-color: {resultado['cor_severidade']}; color: white; text-align: center;'>
+                    <h3 style='margin: 0;'>Nível de Severidade (Análise Visual): {resultado['nivel_severidade']}</h3>
+                </div><br>""", unsafe_allow_html=True)
+            st.markdown("### Análise Técnica Visual Detalhada (IA)")
+            st.markdown(resultado["analise_visual_ia"]["analise_visual"])
+        elif resultado.get("status") == "skipped":
+            st.warning("⚠️ Aviso sobre a qualidade da imagem:")
+            for problema in resultado.get("qualidade_imagem", {}).get("problemas", []):
+                st.write(f"- {problema}")
+        else:
+            st.error(f"Falha na análise com IA Gemini: {resultado.get('analise_visual')}")
 
     def show_analysis_feedback(self, nivel: str) -> None:
         """
@@ -397,15 +466,28 @@ class ImageAnalyzer:
             "mensagem": "Nível de severidade não determinado ou feedback não disponível.",
             "prazo": "Prazo não definido."
         }))
-        if hasattr(st, 'info'): # Só mostra se estiver em contexto Streamlit
-            st.info(f"{info['icon']} **{info['mensagem']}**\n\n*Prazo recomendado para resolução: {info['prazo']}*")
+        import streamlit as st
+        st.info(f"{info['icon']} **{info['mensagem']}**\n\n*Prazo recomendado para resolução: {info['prazo']}*")
+
 
+_analyzer: Optional[ImageAnalyzer] = None
+_analyzer_lock = threading.Lock()
+
+def get_image_analyzer() -> ImageAnalyzer:
+    """ImageAnalyzer único por processo (não guarda estado por análise, então é seguro compartilhar entre threads)."""
+    global _analyzer
+    with _analyzer_lock:
+        if _analyzer is None:
+            _analyzer = ImageAnalyzer()
+        return _analyzer
 
 # Funções wrapper para uso externo
-def processar_analise_imagem(imagem_data: Dict[str, Any]) -> Dict[str, Any]:
-    analyzer = ImageAnalyzer()
-    return analyzer.analyze_image(imagem_data)
+def analisar_imagem_sem_interface(imagem_data: Dict[str, Any], api_key: str, ignorar_qualidade: bool = False,
+                                  ao_receber: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    return get_image_analyzer().run_analysis(imagem_data, api_key, ignorar_qualidade=ignorar_qualidade, ao_receber=ao_receber)
+
+def exibir_resultado_analise(resultado: Dict[str, Any]) -> None:
+    get_image_analyzer().show_analysis_result(resultado)
 
 def mostrar_feedback_analise(nivel: str) -> None:
-    analyzer = ImageAnalyzer()
-    analyzer.show_analysis_feedback(nivel)
+    get_image_analyzer().show_analysis_feedback(nivel)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de hash perceptual (dHash de 64 bits) para reaproveitar análises de fotos repetidas.
+
+A mesma foto do buraco costuma chegar várias vezes, recomprimida ou redimensionada por
+aplicativos de mensagem; o dHash quase não muda nesses casos. Os hashes ficam numa BK-tree
+em memória (busca por distância de Hamming) e são persistidos em SQLite junto com a
+análise visual e o nível de severidade correspondentes.
+"""
+
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from settings import data_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DISTANCIA_MAXIMA = 6  # bits diferentes (de 64) para considerar a foto uma quase-duplicata
+
+
+def dhash(image_bytes: bytes, tamanho: int = 8) -> int:
+    """Difference hash: compara pixels vizinhos de uma miniatura (tamanho+1 x tamanho) em tons de cinza."""
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft('L', (tamanho * 4, tamanho * 4))  # decodificação JPEG reduzida, bem mais rápida (só vale antes de carregar)
+    img = ImageOps.exif_transpose(img)
+    pixels = list(img.convert('L').resize((tamanho + 1, tamanho), Image.LANCZOS).getdata())
+    valor = 0
+    for linha in range(tamanho):
+        base = linha * (tamanho + 1)
+        for col in range(tamanho):
+            valor = (valor << 1) | (pixels[base + col] > pixels[base + col + 1])
+    return valor
+
+
+def distancia_hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    BK-tree sobre distância de Hamming: cada nó guarda filhos indexados pela distância até ele.
+    """
+
+    def __init__(self):
+        self._raiz: Optional[Tuple[int, Dict[int, Any]]] = None
+        self._tamanho = 0
+
+    def __len__(self) -> int:
+        return self._tamanho
+
+    def adicionar(self, valor: int) -> None:
+        if self._raiz is None:
+            self._raiz = (valor, {})
+            self._tamanho = 1
+            return
+        no = self._raiz
+        while True:
+            d = distancia_hamming(valor, no[0])
+            if d == 0:
+                return
+            filho = no[1].get(d)
+            if filho is None:
+                no[1][d] = (valor, {})
+                self._tamanho += 1
+                return
+            no = filho
+
+    def buscar(self, valor: int, distancia_maxima: int) -> List[Tuple[int, int]]:
+        """Retorna [(distância, hash)] a até `distancia_maxima`, do mais próximo ao mais distante."""
+        if self._raiz is None:
+            return []
+        achados, pilha = [], [self._raiz]
+        while pilha:
+            no_valor, filhos = pilha.pop()
+            d = distancia_hamming(valor, no_valor)
+            if d <= distancia_maxima:
+                achados.append((d, no_valor))
+            for dist_filho, filho in filhos.items():
+                if d - distancia_maxima <= dist_filho <= d + distancia_maxima:
+                    pilha.append(filho)
+        return sorted(achados)
+
+
+class ImageHashIndex:
+    """
+    Hashes perceptuais persistidos + BK-tree para achar análises de imagens quase idênticas.
+    """
+
+    def __init__(self, db_path: str, distancia_maxima: int = DEFAULT_DISTANCIA_MAXIMA):
+        self.distancia_maxima = distancia_maxima
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS analises_por_hash (
+                hash INTEGER PRIMARY KEY,
+                resultado TEXT NOT NULL,
+                criado_em REAL NOT NULL
+            )"""
+        )
+        for (h,) in self._conn.execute("SELECT hash FROM analises_por_hash"):
+            self._tree.adicionar(h & 0xFFFFFFFFFFFFFFFF)
+
+    @staticmethod
+    def _para_sqlite(h: int) -> int:
+        # SQLite só guarda inteiros com sinal de 64 bits
+        return h - (1 << 64) if h >= (1 << 63) else h
+
+    def buscar(self, h: int) -> Optional[Dict[str, Any]]:
+        """Análise armazenada da imagem mais parecida (ou None), com 'hash_origem' e 'distancia_hamming'."""
+        with self._lock:
+            achados = self._tree.buscar(h, self.distancia_maxima)
+            if not achados:
+                return None
+            distancia, h_achado = achados[0]
+            row = self._conn.execute("SELECT resultado FROM analises_por_hash WHERE hash = ?", (self._para_sqlite(h_achado),)).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[0]), "hash_origem": f"{h_achado:016x}", "distancia_hamming": distancia}
+
+    def adicionar(self, h: int, resultado: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analises_por_hash (hash, resultado, criado_em) VALUES (?, ?, ?)",
+                (self._para_sqlite(h), json.dumps(resultado, ensure_ascii=False), time.time())
+            )
+            self._tree.adicionar(h)
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+
+_index: Optional[ImageHashIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_image_hash_index() -> ImageHashIndex:
+    """Índice de hashes perceptuais único por processo."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ImageHashIndex(
+                os.environ.get("KRATERAS_IMAGE_HASH_PATH", data_path("image_hash.sqlite3")),
+                distancia_maxima=int(os.environ.get("KRATERAS_IMAGE_HASH_DISTANCIA", DEFAULT_DISTANCIA_MAXIMA)),
+            )
+        return _index
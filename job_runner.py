@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Execução das análises de IA em segundo plano, fora da execução do script Streamlit.
+
+`processing_ia` submete um job e recebe um ID; o pipeline roda num pool de threads do
+processo e vai publicando o texto parcial e o status de cada etapa, que a interface consulta.
+Resubmeter a mesma denúncia (rerun, refresh do navegador) devolve o job já existente, então
+as chamadas às APIs nunca são duplicadas. Ao terminar, o relatório é gravado no histórico.
+"""
+
+import copy
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from ia_pipeline import executar_pipeline_ia
+from report_store import get_report_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_JOBS = 4               # denúncias processadas ao mesmo tempo
+DEFAULT_RETENCAO_S = 2 * 3600      # jobs concluídos ficam consultáveis por 2 horas
+
+
+class Job:
+    """
+    Estado de um job: status ('pendente' | 'executando' | 'concluido' | 'erro'), texto parcial e status
+    por etapa, e a denúncia completa quando terminar. Atualizado pela thread do job; lido via `snapshot()`.
+    """
+
+    def __init__(self, id_job: str, chave: str, denuncia: Dict[str, Any]):
+        self.id = id_job
+        self.chave = chave
+        self.denuncia = denuncia
+        self.status = "pendente"
+        self.parciais: Dict[str, str] = {}
+        self.etapas: Dict[str, Dict[str, Any]] = {}
+        self.erro: Optional[str] = None
+        self.criado_em = time.time()
+        self.concluido_em: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _parcial(self, etapa: str, texto: str) -> None:
+        with self._lock:
+            self.parciais[etapa] = texto
+
+    def _etapa_concluida(self, etapa: str, registro: Dict[str, Any]) -> None:
+        with self._lock:
+            self.etapas[etapa] = {k: v for k, v in registro.items() if k != "resultado"}
+
+    @property
+    def terminado(self) -> bool:
+        return self.status in ("concluido", "erro")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cópia consistente do progresso (a denúncia só vem quando o job terminou)."""
+        with self._lock:
+            return {"id": self.id, "status": self.status, "parciais": dict(self.parciais), "etapas": dict(self.etapas),
+                    "erro": self.erro, "criado_em": self.criado_em, "concluido_em": self.concluido_em,
+                    "denuncia": self.denuncia if self.terminado else None}
+
+
+class JobRunner:
+    """
+    Pool de threads do processo para os jobs de IA, com deduplicação por chave (id da denúncia).
+    """
+
+    def __init__(self, max_jobs: int = DEFAULT_MAX_JOBS, retencao_s: float = DEFAULT_RETENCAO_S):
+        self.retencao_s = retencao_s
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="krateras-job")
+        self._jobs: Dict[str, Job] = {}
+        self._por_chave: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _limpar_antigos(self) -> None:
+        limite = time.time() - self.retencao_s
+        for id_job, job in list(self._jobs.items()):
+            if job.terminado and job.concluido_em and job.concluido_em < limite:
+                del self._jobs[id_job]
+                self._por_chave.pop(job.chave, None)
+
+    def submeter(self, denuncia: Dict[str, Any], model: Any, gemini_api_key: Optional[str], **kwargs) -> str:
+        """
+        Agenda o pipeline de IA para a denúncia e retorna o ID do job. Se já existe um job para a mesma
+        denúncia (metadata.id_denuncia) que não falhou, retorna o ID dele em vez de criar outro.
+        """
+        chave = denuncia.get('metadata', {}).get('id_denuncia') or uuid.uuid4().hex
+        with self._lock:
+            self._limpar_antigos()
+            existente = self._jobs.get(self._por_chave.get(chave, ''))
+            if existente and existente.status != "erro":
+                return existente.id
+            # O job trabalha numa cópia: a sessão só recebe o resultado quando ele termina
+            job = Job(uuid.uuid4().hex, chave, copy.deepcopy(denuncia))
+            self._jobs[job.id] = job
+            self._por_chave[chave] = job.id
+        self._executor.submit(self._executar, job, model, gemini_api_key, kwargs)
+        logger.info(f"Job IA {job.id} submetido para a denúncia {chave}.")
+        return job.id
+
+    def _executar(self, job: Job, model: Any, gemini_api_key: Optional[str], kwargs: Dict[str, Any]) -> None:
+        job.status = "executando"
+        try:
+            resultado = executar_pipeline_ia(job.denuncia, model, gemini_api_key, ao_receber=job._parcial,
+                                             ao_concluir_etapa=job._etapa_concluida, **kwargs)
+            job.denuncia.update(resultado)
+            try:
+                get_report_store().salvar(job.denuncia)
+            except Exception as e:
+                logger.warning(f"Job IA {job.id}: denúncia não foi salva no histórico: {e}")
+            with job._lock:
+                job.status, job.concluido_em = "concluido", time.time()
+        except Exception as e:
+            logger.error(f"Job IA {job.id} falhou: {e}", exc_info=True)
+            with job._lock:
+                job.status, job.erro, job.concluido_em = "erro", str(e), time.time()
+
+    def obter(self, id_job: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(id_job)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            contagem: Dict[str, int] = {}
+            for job in self._jobs.values():
+                contagem[job.status] = contagem.get(job.status, 0) + 1
+            return contagem
+
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    """Executor de jobs único por processo (compartilhado por todas as sessões)."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(max_jobs=int(os.environ.get("KRATERAS_MAX_JOBS", DEFAULT_MAX_JOBS)))
+        return _runner
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Linha de comando do Krateras.
+
+Uso:
+    python krateras.py batch denuncias.jsonl -o relatorios.jsonl --concorrencia 8
+
+Chaves lidas do ambiente: GOOGLE_API_KEY (Gemini) e GEOCODING_API_KEY (Google Geocoding).
+A interface web continua em `streamlit run app.py`.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+logger = logging.getLogger("krateras")
+
+
+def _cmd_batch(args: argparse.Namespace) -> int:
+    from krateras_engine import EngineConfig, processar_lote
+
+    config = EngineConfig.from_env(usar_ia=not args.sem_ia)
+    config.max_workers_ia = args.workers_ia
+    config.modo_texto = args.modo_texto
+    contagem = processar_lote(
+        entrada=args.entrada,
+        saida=args.saida,
+        config=config,
+        concorrencia=args.concorrencia,
+        checkpoint=args.checkpoint,
+        formato=args.formato,
+        limite=args.limite,
+    )
+    print(f"Processados: {contagem['processados']} | Erros: {contagem['erros']} | Pulados (checkpoint): {contagem['pulados']}")
+    return 0 if contagem["erros"] == 0 else 1
+
+
+def _cmd_cep_index(args: argparse.Namespace) -> int:
+    from cep_index import construir_indice, get_cep_index, ler_dump_csv
+
+    if args.acao == "construir":
+        if not args.dump:
+            print("Informe o dump CSV: python krateras.py cep-index construir dump.csv")
+            return 2
+        from settings import data_path
+        destino = args.saida or os.environ.get("KRATERAS_CEP_INDEX_PATH", data_path("cep_index.bin"))
+        total = construir_indice(ler_dump_csv(args.dump), destino)
+        print(f"Índice de CEP gravado em {destino}: {total} registros.")
+    elif args.acao == "compactar":
+        total = get_cep_index().compactar()
+        print(f"Delta incorporado ao índice: {total} registros.")
+    return 0
+
+
+def _cmd_ruas_index(args: argparse.Namespace) -> int:
+    from reverse_geocoder import construir_indice, ler_extrato_osm
+    from settings import data_path
+
+    destino = args.saida or os.environ.get("KRATERAS_RUAS_INDEX_PATH", data_path("ruas_index.bin"))
+    try:
+        total = construir_indice(ler_extrato_osm(args.extrato), destino, args.celula_m)
+    except ValueError as e:
+        print(e)
+        return 2
+    print(f"Índice de ruas gravado em {destino}: {total} segmentos.")
+    return 0
+
+
+def _cmd_exportar(args: argparse.Namespace) -> int:
+    from report_export import exportar
+
+    try:
+        total = exportar(args.saida, args.formato, tamanho_lote=args.lote, url_imagens=args.url_imagens,
+                         cidade=args.cidade, estado=args.estado, desde=args.desde, ate=args.ate)
+    except (RuntimeError, ValueError) as e:
+        print(e)
+        return 2
+    print(f"{total} denúncias exportadas para {args.saida}.")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="krateras", description="Krateras 🚧 - O Especialista Robótico de Denúncia de Buracos")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_batch = sub.add_parser("batch", help="Processa um arquivo de denúncias (JSONL/CSV) em lote.")
+    p_batch.add_argument("entrada", help="Arquivo de entrada (.jsonl ou .csv). Caminhos de imagem são relativos a ele.")
+    p_batch.add_argument("-o", "--saida", required=True, help="Arquivo JSONL de saída (acrescentado, nunca sobrescrito).")
+    p_batch.add_argument("--formato", choices=["jsonl", "csv"], help="Formato da entrada (padrão: pela extensão).")
+    p_batch.add_argument("--checkpoint", help="Arquivo de checkpoint (padrão: <saida>.checkpoint).")
+    p_batch.add_argument("--concorrencia", type=int, default=4, help="Denúncias processadas simultaneamente (padrão: 4).")
+    p_batch.add_argument("--workers-ia", type=int, default=4, help="Threads de IA por denúncia (padrão: 4).")
+    p_batch.add_argument("--limite", type=int, help="Processa no máximo N registros novos.")
+    p_batch.add_argument("--modo-texto", choices=["etapas", "unico"],
+                         help="'etapas' (quatro prompts) ou 'unico' (uma chamada com saída JSON). Padrão: KRATERAS_MODO_TEXTO ou 'etapas'.")
+    p_batch.add_argument("--sem-ia", action="store_true", help="Só endereço/localização, sem chamadas Gemini.")
+    p_batch.set_defaults(func=_cmd_batch)
+
+    p_cep = sub.add_parser("cep-index", help="Gerencia a base local de CEPs (índice mmap).")
+    p_cep.add_argument("acao", choices=["construir", "compactar"], help="'construir' a partir de um dump CSV ou 'compactar' o delta de write-back.")
+    p_cep.add_argument("dump", nargs="?", help="Dump CSV com colunas cep, logradouro, bairro, localidade/cidade, uf.")
+    p_cep.add_argument("-o", "--saida", help="Arquivo do índice (padrão: base local do Krateras).")
+    p_cep.set_defaults(func=_cmd_cep_index)
+
+    p_ruas = sub.add_parser("ruas-index", help="Gera o índice local de ruas (geocodificação reversa) de um extrato OSM.")
+    p_ruas.add_argument("acao", choices=["construir"], help="'construir' a partir de um extrato .osm, .osm.bz2 ou .osm.gz.")
+    p_ruas.add_argument("extrato", help="Extrato regional do OpenStreetMap em XML (converta .pbf com `osmium cat`).")
+    p_ruas.add_argument("-o", "--saida", help="Arquivo do índice (padrão: base local do Krateras).")
+    p_ruas.add_argument("--celula-m", type=float, default=100.0, help="Lado da célula da grade em metros (padrão: 100).")
+    p_ruas.set_defaults(func=_cmd_ruas_index)
+
+    p_exp = sub.add_parser("exportar", help="Exporta o histórico de denúncias em Parquet, GeoJSON ou NDJSON (streaming).")
+    p_exp.add_argument("saida", help="Arquivo de saída (.parquet, .geojson ou .ndjson).")
+    p_exp.add_argument("--formato", choices=["parquet", "geojson", "ndjson"], help="Formato (padrão: pela extensão).")
+    p_exp.add_argument("--cidade", help="Só denúncias desta cidade.")
+    p_exp.add_argument("--estado", help="Só denúncias deste estado (UF).")
+    p_exp.add_argument("--desde", help="Data/hora UTC inicial, inclusiva (ex.: 2024-05-01).")
+    p_exp.add_argument("--ate", help="Data/hora UTC final, exclusiva (ex.: 2024-05-02).")
+    p_exp.add_argument("--lote", type=int, default=1000, help="Denúncias lidas e gravadas por vez (padrão: 1000).")
+    p_exp.add_argument("--url-imagens", help="URL base das imagens; a referência vira <url>/<sha256> (padrão: caminho no blob store).")
+    p_exp.set_defaults(func=_cmd_exportar)
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Motor headless do Krateras: processa denúncias fora do Streamlit.
+
+Cada registro de entrada (JSONL ou CSV) passa pelo mesmo fluxo do app — CEP, geocodificação,
+localização exata, análise visual, etapas de texto Gemini — e vira um `denuncia_completa`.
+O processamento em lote lê a entrada em streaming, roda os registros com concorrência
+limitada e grava a saída em JSONL, com checkpoint para retomar execuções interrompidas.
+"""
+
+import csv
+import json
+import logging
+import mimetypes
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from geo_services import buscar_cep, processar_localizacao_exata
+from ia_pipeline import executar_pipeline_ia
+from report_store import get_report_store
+from resilience import PRAZO_DENUNCIA_PADRAO_S, com_prazo
+
+logger = logging.getLogger(__name__)
+
+# Campos aceitos na entrada -> chave em `caracteristicas_estruturadas`
+CAMPOS_CARACTERISTICAS = {
+    'tamanho': 'Tamanho Estimado',
+    'perigo': 'Perigo Estimado',
+    'profundidade': 'Profundidade Estimada',
+    'agua': 'Presença de Água/Alagamento',
+    'trafego': 'Tráfego Estimado na Via',
+    'contexto': 'Contexto da Via',
+}
+
+
+class EngineConfig:
+    """
+    Configuração do motor: chaves de API, modelo de texto e limites de concorrência.
+    """
+
+    def __init__(self, gemini_api_key: Optional[str] = None, geocoding_api_key: Optional[str] = None,
+                 gemini_model: Any = None, usar_ia: bool = True, max_workers_ia: int = 4,
+                 timeouts_ia: Optional[Dict[str, float]] = None, modo_texto: Optional[str] = None):
+        self.gemini_api_key = gemini_api_key
+        self.geocoding_api_key = geocoding_api_key
+        self.gemini_model = gemini_model
+        self.usar_ia = usar_ia
+        self.max_workers_ia = max_workers_ia
+        self.timeouts_ia = timeouts_ia
+        self.modo_texto = modo_texto
+
+    @classmethod
+    def from_env(cls, usar_ia: bool = True) -> "EngineConfig":
+        """Lê as chaves de GOOGLE_API_KEY / GEOCODING_API_KEY e inicializa o modelo de texto."""
+        gemini_key = os.environ.get('GOOGLE_API_KEY')
+        geocoding_key = os.environ.get('GEOCODING_API_KEY') or os.environ.get('geocoding_api_key')
+        model = None
+        if usar_ia and gemini_key:
+            from gemini_text import selecionar_modelo_texto
+            from model_registry import aquecer
+            aquecer(gemini_key)
+            model, fallback = selecionar_modelo_texto(gemini_key)
+            if model is None: logger.error("Nenhum modelo texto Gemini compatível; etapas de texto ficarão offline.")
+            elif fallback: logger.warning(f"Usando modelo texto fallback: {model.model_name}")
+        return cls(gemini_api_key=gemini_key, geocoding_api_key=geocoding_key, gemini_model=model, usar_ia=usar_ia)
+
+
+def _lista(valor: Any) -> list:
+    if isinstance(valor, list): return [v for v in valor if v]
+    if not valor: return []
+    return [v.strip() for v in str(valor).split(';') if v.strip()]
+
+
+def _carregar_imagem(caminho: str, base_dir: str) -> Optional[Dict[str, Any]]:
+    if not caminho: return None
+    caminho_abs = caminho if os.path.isabs(caminho) else os.path.join(base_dir, caminho)
+    try:
+        with open(caminho_abs, 'rb') as f:
+            dados = f.read()
+        handle = get_report_store().guardar_imagem(os.path.basename(caminho_abs), mimetypes.guess_type(caminho_abs)[0] or "application/octet-stream", dados)
+        return {**handle, "caminho": caminho_abs}
+    except OSError as e:
+        return {"erro": f"Erro: {e}", "caminho": caminho_abs}
+
+
+def _data_hora_utc(valor: Any) -> str:
+    """'AAAA-MM-DD HH:MM:SS' em UTC, como o app grava; aceita ISO 8601 com fuso ("...Z", "-03:00"). Vazio: agora."""
+    if not valor: return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    try: instante = datetime.fromisoformat(str(valor).strip().replace('Z', '+00:00'))
+    except ValueError:
+        logger.warning(f"data_hora_utc não reconhecida, gravada como veio: {valor!r}")
+        return str(valor)
+    if instante.tzinfo is not None: instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+    return instante.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def montar_denuncia(registro: Dict[str, Any], config: EngineConfig, base_dir: str = '.') -> Dict[str, Any]:
+    """
+    Converte um registro plano de entrada no `denuncia_completa` (sem as análises de IA).
+    """
+    denuncia = {"metadata": {"data_hora_utc": _data_hora_utc(registro.get('data_hora_utc')),
+                             "origem": registro.get('origem', 'lote'), "id_externo": registro.get('id'), "id_denuncia": uuid.uuid4().hex}}
+    idade = registro.get('idade')
+    try: idade = int(idade) if idade not in (None, '') else None
+    except (TypeError, ValueError): idade = None
+    denuncia['denunciante'] = {"nome": (registro.get('nome') or '').strip(), "idade": idade if idade and idade > 0 else None,
+                               "cidade_residencia": (registro.get('cidade_residencia') or '').strip()}
+
+    endereco = {'rua': (registro.get('rua') or '').strip(), 'bairro': (registro.get('bairro') or '').strip(),
+                'cidade_buraco': (registro.get('cidade') or '').strip(), 'estado_buraco': (registro.get('estado') or '').strip().upper()}
+    buraco = {'endereco': endereco}
+    cep = (registro.get('cep') or '').strip()
+    if cep:
+        buraco['cep_informado'] = cep
+        if not all(endereco.get(k) for k in ['rua', 'cidade_buraco', 'estado_buraco']):
+            data_cep = buscar_cep(cep)
+            if 'erro' in data_cep:
+                buraco['erro_cep'] = data_cep['erro']
+            else:
+                endereco.update({k: endereco.get(k) or data_cep.get(v, '') for k, v in {'rua': 'logradouro', 'bairro': 'bairro', 'cidade_buraco': 'localidade', 'estado_buraco': 'uf'}.items()})
+
+    carac = {}
+    for campo, chave in CAMPOS_CARACTERISTICAS.items():
+        carac[chave] = _lista(registro.get(campo)) if campo == 'contexto' else (registro.get(campo) or 'Selecione')
+    buraco.update({
+        'numero_proximo': (registro.get('numero_proximo') or '').strip(),
+        'lado_rua': (registro.get('lado_rua') or '').strip(),
+        'caracteristicas_estruturadas': carac,
+        'observacoes_adicionais': (registro.get('observacoes') or '').strip(),
+        'imagem_denuncia': _carregar_imagem(registro.get('imagem'), base_dir),
+    })
+    denuncia['buraco'] = buraco
+    denuncia['localizacao_exata_processada'] = processar_localizacao_exata(
+        endereco, buraco['numero_proximo'], registro.get('localizacao_manual') or '', config.geocoding_api_key)
+    return denuncia
+
+
+def processar_registro(registro: Dict[str, Any], config: EngineConfig, base_dir: str = '.') -> Dict[str, Any]:
+    """
+    Processa um registro completo (endereço, localização e IA), grava no histórico de denúncias e devolve o `denuncia_completa`.
+    CEP, geocodificação e etapas de IA dividem o mesmo prazo da denúncia (KRATERAS_PRAZO_DENUNCIA_S).
+    """
+    with com_prazo(PRAZO_DENUNCIA_PADRAO_S):
+        denuncia = montar_denuncia(registro, config, base_dir)
+        if config.usar_ia:
+            denuncia.update(executar_pipeline_ia(denuncia, config.gemini_model, config.gemini_api_key,
+                                                 max_workers=config.max_workers_ia, timeouts=config.timeouts_ia,
+                                                 modo_texto=config.modo_texto))
+    try: get_report_store().salvar(denuncia)
+    except Exception as e: logger.warning(f"Denúncia {denuncia['metadata'].get('id_externo')} não foi salva no histórico: {e}")
+    return denuncia
+
+
+def serializar_denuncia(denuncia: Dict[str, Any]) -> Dict[str, Any]:
+    """Cópia JSON-friendly do relatório: os bytes da imagem são trocados por uma referência externa."""
+    saida = dict(denuncia)
+    bur = saida.get('buraco')
+    if isinstance(bur, dict) and isinstance(bur.get('imagem_denuncia'), dict):
+        img = {k: v for k, v in bur['imagem_denuncia'].items() if k != 'bytes'}
+        if 'bytes' in bur['imagem_denuncia']: img['tamanho_bytes'] = len(bur['imagem_denuncia']['bytes'])
+        saida['buraco'] = {**bur, 'imagem_denuncia': img}
+    return saida
+
+
+def ler_registros(caminho: str, formato: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Lê a entrada em streaming (JSONL ou CSV) e gera (id, registro). Sem campo `id`, usa o número da linha.
+    """
+    formato = formato or ('csv' if caminho.lower().endswith('.csv') else 'jsonl')
+    with open(caminho, 'r', encoding='utf-8', newline='') as f:
+        if formato == 'csv':
+            for n, linha in enumerate(csv.DictReader(f), start=1):
+                yield str(linha.get('id') or f"linha-{n}"), linha
+        else:
+            for n, linha in enumerate(f, start=1):
+                if not linha.strip(): continue
+                try:
+                    registro = json.loads(linha)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Linha {n} ignorada (JSON inválido): {e}")
+                    continue
+                yield str(registro.get('id') or f"linha-{n}"), registro
+
+
+def _carregar_checkpoint(caminho: str) -> Set[str]:
+    if not os.path.exists(caminho): return set()
+    with open(caminho, 'r', encoding='utf-8') as f:
+        return {linha.strip() for linha in f if linha.strip()}
+
+
+def _truncar_linha_parcial(caminho: str) -> None:
+    """Remove uma última linha incompleta (execução interrompida no meio de uma escrita)."""
+    if not os.path.exists(caminho) or os.path.getsize(caminho) == 0: return
+    with open(caminho, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b'\n': return
+        f.seek(0)
+        dados = f.read()
+        f.truncate(dados.rfind(b'\n') + 1)
+
+
+def processar_lote(entrada: str, saida: str, config: EngineConfig, concorrencia: int = 4,
+                   checkpoint: Optional[str] = None, formato: Optional[str] = None,
+                   limite: Optional[int] = None) -> Dict[str, int]:
+    """
+    Processa um arquivo de denúncias e grava um JSONL com {"id", "status", "denuncia" | "erro"} por linha.
+    Registros já processados com sucesso (listados no checkpoint) são pulados, então rodar de novo retoma de onde
+    parou e tenta outra vez os que deram erro.
+    """
+    checkpoint = checkpoint or saida + '.checkpoint'
+    feitos = _carregar_checkpoint(checkpoint)
+    _truncar_linha_parcial(saida)
+    base_dir = os.path.dirname(os.path.abspath(entrada))
+    contagem = {"processados": 0, "erros": 0, "pulados": 0}
+    lock = threading.Lock()
+
+    def _tarefa(reg_id: str, registro: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return {"id": reg_id, "status": "ok", "denuncia": serializar_denuncia(processar_registro(registro, config, base_dir))}
+        except Exception as e:
+            logger.error(f"Erro ao processar registro '{reg_id}': {e}", exc_info=True)
+            return {"id": reg_id, "status": "erro", "erro": str(e)}
+
+    with open(saida, 'a', encoding='utf-8') as f_out, open(checkpoint, 'a', encoding='utf-8') as f_ck, \
+            ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix="krateras-lote") as executor:
+
+        def _gravar(resultado: Dict[str, Any]) -> None:
+            with lock:
+                f_out.write(json.dumps(resultado, ensure_ascii=False, default=str) + '\n'); f_out.flush()
+                # Só sucessos entram no checkpoint: registros com erro são tentados de novo na próxima execução
+                if resultado["status"] == "ok":
+                    f_ck.write(resultado['id'] + '\n'); f_ck.flush()
+                contagem["processados" if resultado["status"] == "ok" else "erros"] += 1
+
+        em_execucao = set()
+        enviados = 0
+        for reg_id, registro in ler_registros(entrada, formato):
+            if reg_id in feitos:
+                contagem["pulados"] += 1
+                continue
+            if limite is not None and enviados >= limite: break
+            # Mantém no máximo 2x a concorrência em memória, independentemente do tamanho da entrada
+            if len(em_execucao) >= concorrencia * 2:
+                concluidos, em_execucao = wait(em_execucao, return_when=FIRST_COMPLETED)
+                for fut in concluidos: _gravar(fut.result())
+            em_execucao.add(executor.submit(_tarefa, reg_id, registro))
+            feitos.add(reg_id)
+            enviados += 1
+        for fut in wait(em_execucao).done:
+            _gravar(fut.result())
+
+    logger.info(f"Lote concluído: {contagem}")
+    return contagem
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Cache persistente (SQLite) para respostas dos modelos Gemini.
+
+A chave é um hash SHA-256 do prompt renderizado, do nome do modelo e da configuração
+de geração. Entradas expiram por TTL e, quando o tamanho total passa do limite,
+as menos usadas recentemente (LRU) são removidas.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from settings import data_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SEGUNDOS = 7 * 24 * 3600   # 7 dias
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024   # 64 MB
+
+
+class LLMCache:
+    """
+    Cache chave/valor em disco para respostas de LLM, seguro para uso entre threads.
+    """
+
+    def __init__(self, db_path: str, ttl_segundos: int = DEFAULT_TTL_SEGUNDOS, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl_segundos = ttl_segundos
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS respostas (
+                chave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                tamanho INTEGER NOT NULL,
+                criado_em REAL NOT NULL,
+                acessado_em REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_respostas_acesso ON respostas(acessado_em)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+
+    @staticmethod
+    def make_key(prompt: Any, model_name: str, generation_config: Optional[Dict[str, Any]] = None) -> str:
+        """Gera a chave de conteúdo (hash) para um prompt + modelo + configuração."""
+        payload = json.dumps(
+            {"prompt": prompt, "model": model_name, "config": generation_config or {}},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, chave: str) -> Optional[str]:
+        agora = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT valor, tamanho, criado_em FROM respostas WHERE chave = ?", (chave,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            valor, tamanho, criado_em = row
+            if self.ttl_segundos and agora - criado_em > self.ttl_segundos:
+                self._conn.execute("DELETE FROM respostas WHERE chave = ?", (chave,))
+                self._total_bytes -= tamanho
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE respostas SET acessado_em = ? WHERE chave = ?", (agora, chave))
+            self.hits += 1
+            return valor
+
+    def set(self, chave: str, valor: str) -> None:
+        agora = time.time()
+        tamanho = len(valor.encode("utf-8"))
+        if tamanho > self.max_bytes:
+            logger.warning(f"Resposta de {tamanho} bytes excede o limite do cache LLM; não armazenada.")
+            return
+        with self._lock:
+            antigo = self._conn.execute("SELECT tamanho FROM respostas WHERE chave = ?", (chave,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respostas (chave, valor, tamanho, criado_em, acessado_em) VALUES (?, ?, ?, ?, ?)",
+                (chave, valor, tamanho, agora, agora)
+            )
+            self._total_bytes += tamanho - (antigo[0] if antigo else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Remove entradas expiradas e, depois, as menos acessadas até caber no limite (chamar com lock)."""
+        if self.ttl_segundos:
+            self._conn.execute("DELETE FROM respostas WHERE criado_em < ?", (time.time() - self.ttl_segundos,))
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+        removidas = 0
+        cursor = self._conn.execute("SELECT chave, tamanho FROM respostas ORDER BY acessado_em ASC")
+        para_remover = []
+        for chave, tamanho in cursor:
+            if self._total_bytes <= self.max_bytes:
+                break
+            para_remover.append((chave,))
+            self._total_bytes -= tamanho
+        if para_remover:
+            self._conn.executemany("DELETE FROM respostas WHERE chave = ?", para_remover)
+            removidas = len(para_remover)
+        logger.info(f"Cache LLM: {removidas} entradas removidas por LRU (total agora {self._total_bytes} bytes).")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM respostas")
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entradas": entradas,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache_instance: Optional[LLMCache] = None
+_cache_instance_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """Instância única (por processo) do cache de respostas LLM."""
+    global _cache_instance
+    with _cache_instance_lock:
+        if _cache_instance is None:
+            _cache_instance = LLMCache(
+                db_path=os.environ.get("KRATERAS_LLM_CACHE_PATH", data_path("llm_cache.sqlite3")),
+                ttl_segundos=int(os.environ.get("KRATERAS_LLM_CACHE_TTL", DEFAULT_TTL_SEGUNDOS)),
+                max_bytes=int(os.environ.get("KRATERAS_LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            )
+        return _cache_instance
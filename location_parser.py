@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Leitura offline de coordenadas no campo de localização manual do Krateras.
+
+Reconhece, sem nenhuma chamada de rede:
+- decimais ("-23.5505, -46.6333") e graus/minutos/segundos ou graus/minutos decimais com hemisfério
+  ("23°33'01.8\"S 46°38'00\"W", "S 23° 33.030' O 46° 38.000'"), com N/S e E/W/L/O (só o hemisfério,
+  sem símbolo de grau nem minutos, exige graus com parte decimal: "23.55 S 46.63 O");
+- URIs `geo:` (inclusive `geo:0,0?q=lat,lng` do Android);
+- Open Location Codes (plus codes) completos ("588MC9X8+RC") e curtos, estes só com uma referência;
+- links do Google Maps (pino `!3d…!4d…`, `/@lat,lng`, `query=`/`q=`/`ll=`/`destination=`),
+  do OpenStreetMap (`mlat`/`mlon` e `#map=z/lat/lon`) e do Waze (`ll=` e `to=ll.`).
+
+As expressões são compiladas uma vez, na importação; uma leitura leva microssegundos, então pode
+rodar a cada tecla. Coordenadas fora de [-90, 90] x [-180, 180] são descartadas.
+"""
+
+import re
+import urllib.parse
+from typing import Any, Dict, Optional, Tuple
+
+TIPO_COORDENADAS_MANUAIS = "Coordenadas Fornecidas/Extraídas Manualmente"
+TIPO_COORDENADAS_LINK = "Coordenadas Extraídas de Link (Manual)"
+
+_NUM = r"[-+]?\d{1,3}(?:\.\d+)?"
+
+# Links e URIs, na ordem de preferência: o pino do lugar vem antes do centro do mapa
+_PADROES_LINK = (
+    ("google_pino", re.compile(rf"!3d({_NUM})!4d({_NUM})")),
+    ("osm_marcador", re.compile(rf"[?&;]mlat=({_NUM})&(?:amp;)?mlon=({_NUM})")),
+    ("geo_uri_q", re.compile(rf"^geo:0+(?:\.0+)?,0+(?:\.0+)?\?(?:.*&)?q=({_NUM})\s*,\s*({_NUM})", re.IGNORECASE)),
+    ("geo_uri", re.compile(rf"^geo:({_NUM}),({_NUM})(?:,{_NUM})?(?:[;?].*)?$", re.IGNORECASE)),
+    ("osm_mapa", re.compile(rf"#map=\d{{1,2}}/({_NUM})/({_NUM})")),
+    ("waze", re.compile(rf"waze\.com/.*?(?:[?&]ll=|[?&](?:to|from)=ll\.)({_NUM})\s*,\s*({_NUM})", re.IGNORECASE)),
+    ("google_consulta", re.compile(rf"[?&](?:query|q|ll|destination|daddr|center)=(?:loc:)?({_NUM})\s*,\s*({_NUM})")),
+    ("google_centro", re.compile(rf"/@({_NUM}),({_NUM})")),
+)
+
+_DECIMAL = re.compile(r"(?<![\d.])([-+]?\d{1,3}\.\d+)\s*[,;\s]\s*(?i:(?:lon|lng|long|longitude)\s*[:=]?\s*)?([-+]?\d{1,3}\.\d+)")
+_LINK = re.compile(r"^(?:https?://|geo:|www\.)|google\.[a-z.]+/maps|goo\.gl/|waze\.com/|openstreetmap\.org/|osm\.org/", re.IGNORECASE)
+
+
+def _componente(p: str) -> str:
+    """Um eixo em graus[/minutos[/segundos]] com hemisfério antes ou depois (grupos prefixados por `p`)."""
+    return rf"""
+        (?P<{p}h1>[NSEWLO])?\s*
+        (?P<{p}sinal>[-+])?
+        (?P<{p}g>\d{{1,3}}(?:[.,]\d+)?)\s*(?P<{p}grau>[°º˚]|deg\b|graus?\b)?\s*
+        (?:(?P<{p}m>\d{{1,2}}(?:[.,]\d+)?)\s*(?:['′’´]|min\b)\s*
+           (?:(?P<{p}s>\d{{1,2}}(?:[.,]\d+)?)\s*(?:"|″|”|''|′′|seg\b)\s*)?
+        )?
+        (?({p}h1)|(?P<{p}h2>[NSEWLO](?![A-Za-z]))?)
+    """
+
+
+_DMS = re.compile(rf"(?<![\w.]){_componente('a_')}\s*[,;/]?\s*{_componente('b_')}", re.VERBOSE)
+
+# Open Location Code: alfabeto de 20 símbolos, pares lat/lng de 20° até 1/8000°, depois grade 5x4
+_OLC_ALFABETO = "23456789CFGHJMPQRVWX"
+_OLC_VALOR = {c: i for i, c in enumerate(_OLC_ALFABETO)}
+_OLC_COMPLETO = re.compile(r"(?<![\w+])([2-9C][2-9CFGHJMPQRV][2-9CFGHJMPQRVWX]{6}\+[2-9CFGHJMPQRVWX]{2,7})(?![\w+])", re.IGNORECASE)
+_OLC_CURTO = re.compile(r"(?<![\w+])([2-9CFGHJMPQRVWX]{2,6}\+[2-9CFGHJMPQRVWX]{2,7})(?![\w+])", re.IGNORECASE)
+_OLC_RESOLUCOES = (20.0, 1.0, 0.05, 0.0025, 0.000125)
+
+
+def coordenadas_validas(lat: float, lon: float) -> bool:
+    return -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0
+
+
+def _resultado(lat: float, lon: float, tipo: str, formato: str) -> Optional[Dict[str, Any]]:
+    if not coordenadas_validas(lat, lon):
+        return None
+    return {"latitude": round(lat, 7), "longitude": round(lon, 7), "tipo": tipo, "formato": formato}
+
+
+def decodificar_plus_code(codigo: str) -> Optional[Tuple[float, float]]:
+    """Centro da área de um plus code completo (8 dígitos + '+' + 2 ou mais), ou None se inválido."""
+    codigo = codigo.upper().replace('+', '')
+    if len(codigo) < 10 or any(c not in _OLC_VALOR for c in codigo):
+        return None
+    lat, lon = -90.0, -180.0
+    for i, res in enumerate(_OLC_RESOLUCOES):
+        lat += _OLC_VALOR[codigo[2 * i]] * res
+        lon += _OLC_VALOR[codigo[2 * i + 1]] * res
+    res_lat, res_lon = _OLC_RESOLUCOES[-1], _OLC_RESOLUCOES[-1]
+    for c in codigo[10:15]:
+        res_lat, res_lon = res_lat / 5, res_lon / 4
+        linha, coluna = divmod(_OLC_VALOR[c], 4)
+        lat += linha * res_lat
+        lon += coluna * res_lon
+    lat, lon = lat + res_lat / 2, lon + res_lon / 2
+    return (lat, lon) if coordenadas_validas(lat, lon) else None
+
+
+def _prefixo_plus_code(lat: float, lon: float, digitos: int) -> str:
+    lat, lon = min(max(lat, -90.0), 90.0 - 1e-9) + 90.0, ((lon + 180.0) % 360.0)
+    prefixo = ''
+    for res in _OLC_RESOLUCOES[:(digitos + 1) // 2]:
+        d_lat, d_lon = int(lat // res), int(lon // res)
+        prefixo += _OLC_ALFABETO[d_lat] + _OLC_ALFABETO[d_lon]
+        lat, lon = lat - d_lat * res, lon - d_lon * res
+    return prefixo[:digitos]
+
+
+def recuperar_plus_code_curto(codigo: str, referencia: Tuple[float, float]) -> Optional[Tuple[float, float]]:
+    """Completa um plus code curto ("C9X8+RC") com o prefixo da referência, escolhendo a área mais próxima dela."""
+    codigo = codigo.upper()
+    faltando = 8 - codigo.index('+')
+    if faltando <= 0 or faltando % 2:
+        return None
+    ref_lat, ref_lon = referencia
+    resolucao = 20.0 ** (2 - faltando // 2)
+    centro = decodificar_plus_code(_prefixo_plus_code(ref_lat, ref_lon, faltando) + codigo)
+    if centro is None:
+        return None
+    lat, lon = centro
+    metade = resolucao / 2
+    if ref_lat + metade < lat and lat - resolucao >= -90: lat -= resolucao
+    elif ref_lat - metade > lat and lat + resolucao <= 90: lat += resolucao
+    if ref_lon + metade < lon: lon -= resolucao
+    elif ref_lon - metade > lon: lon += resolucao
+    lon = (lon + 180.0) % 360.0 - 180.0
+    return (lat, lon) if coordenadas_validas(lat, lon) else None
+
+
+def _numero(texto: Optional[str]) -> float:
+    return float(texto.replace(',', '.')) if texto else 0.0
+
+
+def _eixo(m: re.Match, p: str) -> Optional[Tuple[float, Optional[str]]]:
+    """(valor com sinal, 'lat' | 'lon' | None) de um eixo DMS, ou None se minutos/segundos forem inválidos."""
+    graus, minutos, segundos = _numero(m.group(p + 'g')), _numero(m.group(p + 'm')), _numero(m.group(p + 's'))
+    if minutos >= 60 or segundos >= 60 or (m.group(p + 'm') and not graus.is_integer()):
+        return None
+    valor = graus + minutos / 60 + segundos / 3600
+    hemisferio = m.group(p + 'h1') or m.group(p + 'h2')
+    negativo = m.group(p + 'sinal') == '-' or hemisferio in ('S', 'W', 'O')
+    eixo = 'lat' if hemisferio in ('N', 'S') else 'lon' if hemisferio else None
+    return (-valor if negativo else valor), eixo
+
+
+def _ler_dms(texto: str) -> Optional[Dict[str, Any]]:
+    for m in _DMS.finditer(texto):
+        # Cada eixo precisa de símbolo de grau, minutos ou hemisfério com parte decimal: inteiros com uma letra
+        # solta ("poste 12 N 5 L", "nº 23 S 46 O") são referências do texto, não coordenadas
+        if not all(m.group(p + 'grau') or m.group(p + 'm') or ((m.group(p + 'h1') or m.group(p + 'h2')) and not m.group(p + 'g').isdigit())
+                   for p in ('a_', 'b_')):
+            continue
+        a, b = _eixo(m, 'a_'), _eixo(m, 'b_')
+        if a is None or b is None or (a[1] and a[1] == b[1]):
+            continue
+        lat, lon = (b[0], a[0]) if a[1] == 'lon' or b[1] == 'lat' else (a[0], b[0])
+        formato = 'dms' if m.group('a_s') or m.group('b_s') else 'graus_minutos' if m.group('a_m') or m.group('b_m') else 'graus_hemisferio'
+        if (res := _resultado(lat, lon, TIPO_COORDENADAS_MANUAIS, formato)):
+            return res
+    return None
+
+
+def extrair_localizacao(texto: str, referencia: Optional[Tuple[float, float]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Coordenadas recuperáveis de `texto` sem rede: {"latitude", "longitude", "tipo", "formato"} ou None.
+    `referencia` (lat, lon) permite resolver plus codes curtos; sem ela eles são ignorados.
+    """
+    texto = (texto or '').strip()
+    if not texto:
+        return None
+    link = _LINK.search(texto) is not None
+    if link:
+        texto = urllib.parse.unquote(texto)
+        for formato, padrao in _PADROES_LINK:
+            if (m := padrao.search(texto)) and (res := _resultado(float(m.group(1)), float(m.group(2)), TIPO_COORDENADAS_LINK, formato)):
+                return res
+        # Sem padrão de link reconhecido, ainda vale um plus code (plus.codes/...) ou um par decimal no texto
+    if (m := _OLC_COMPLETO.search(texto)) and (coords := decodificar_plus_code(m.group(1))):
+        return _resultado(*coords, TIPO_COORDENADAS_MANUAIS, 'plus_code')
+    if referencia is not None and (m := _OLC_CURTO.search(texto)) and (coords := recuperar_plus_code_curto(m.group(1), referencia)):
+        return _resultado(*coords, TIPO_COORDENADAS_MANUAIS, 'plus_code_curto')
+    if (m := _DECIMAL.search(texto)) and (res := _resultado(float(m.group(1)), float(m.group(2)), TIPO_COORDENADAS_MANUAIS, 'decimal')):
+        return res
+    return None if link else _ler_dms(texto)  # link sem coordenadas (ex.: encurtado): não dá para resolver offline
+
+
+def tem_plus_code_curto(texto: str) -> bool:
+    """Há um plus code curto que poderia ser resolvido com uma referência (ex.: o endereço geocodificado)?"""
+    return bool(texto) and _OLC_CURTO.search(texto) is not None and _OLC_COMPLETO.search(texto) is None
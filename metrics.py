@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentação do Krateras: histogramas de latência e contadores, exportados em formato Prometheus.
+
+Cada trecho medido vira uma observação em `krateras_etapa_duracao_segundos{etapa, resultado}`
+(buckets fixos, memória constante). Os quantis p50/p95/p99 da página de administração são
+estimados a partir dos buckets, como o `histogram_quantile` do Prometheus. O endpoint /metrics
+sobe num servidor HTTP mínimo em segundo plano (porta KRATERAS_METRICS_PORT, 0 desliga; interface
+KRATERAS_METRICS_HOST, por padrão só 127.0.0.1).
+"""
+
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+HISTOGRAMA_ETAPAS = "krateras_etapa_duracao_segundos"
+DEFAULT_PORTA_METRICAS = 9464
+DEFAULT_HOST_METRICAS = '127.0.0.1'  # só local; para o Prometheus de outra máquina, KRATERAS_METRICS_HOST=0.0.0.0
+
+Rotulos = Tuple[Tuple[str, str], ...]
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Histograma:
+    __slots__ = ("contagens", "soma", "total")
+
+    def __init__(self, n_buckets: int):
+        self.contagens = [0] * (n_buckets + 1)  # último = +Inf
+        self.soma = 0.0
+        self.total = 0
+
+
+class Metricas:
+    """
+    Registro de contadores e histogramas com rótulos, seguro para threads.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS_PADRAO):
+        self.buckets = tuple(sorted(buckets))
+        self._contadores: Dict[str, Dict[Rotulos, float]] = {}
+        self._histogramas: Dict[str, Dict[Rotulos, _Histograma]] = {}
+        self._ajuda: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rotulos(rotulos: Dict[str, Any]) -> Rotulos:
+        return tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+
+    def incrementar(self, nome: str, valor: float = 1.0, ajuda: str = '', **rotulos) -> None:
+        chave = self._rotulos(rotulos)
+        with self._lock:
+            serie = self._contadores.setdefault(nome, {})
+            serie[chave] = serie.get(chave, 0.0) + valor
+            if ajuda: self._ajuda.setdefault(nome, ajuda)
+
+    def observar(self, nome: str, valor: float, ajuda: str = '', **rotulos) -> None:
+        chave = self._rotulos(rotulos)
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            h = self._histogramas.setdefault(nome, {}).get(chave)
+            if h is None:
+                h = self._histogramas[nome][chave] = _Histograma(len(self.buckets))
+            h.contagens[i] += 1
+            h.soma += valor
+            h.total += 1
+            if ajuda: self._ajuda.setdefault(nome, ajuda)
+
+    def _quantil(self, h: _Histograma, q: float) -> Optional[float]:
+        """Estimativa por interpolação linear dentro do bucket (mesma ideia do histogram_quantile)."""
+        if h.total == 0: return None
+        alvo, acumulado = q * h.total, 0
+        for i, c in enumerate(h.contagens):
+            if acumulado + c >= alvo and c > 0:
+                if i == len(self.buckets): return self.buckets[-1]  # caiu no +Inf: melhor limite conhecido
+                inferior = self.buckets[i - 1] if i > 0 else 0.0
+                return inferior + (self.buckets[i] - inferior) * (alvo - acumulado) / c
+            acumulado += c
+        return self.buckets[-1]
+
+    def resumo(self, nome: str = HISTOGRAMA_ETAPAS) -> List[Dict[str, Any]]:
+        """Uma linha por série do histograma: rótulos, contagem, média e p50/p95/p99 (segundos)."""
+        with self._lock:
+            series = list(self._histogramas.get(nome, {}).items())
+            linhas = []
+            for rotulos, h in series:
+                linha = dict(rotulos)
+                linha.update({"contagem": h.total, "media_s": round(h.soma / h.total, 4) if h.total else None,
+                              **{f"p{int(q * 100)}_s": round(v, 4) if (v := self._quantil(h, q)) is not None else None for q in (0.5, 0.95, 0.99)}})
+                linhas.append(linha)
+        return sorted(linhas, key=lambda l: tuple(str(v) for v in l.values()))
+
+    def contadores(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"metrica": nome, **dict(rot), "valor": v} for nome, serie in self._contadores.items() for rot, v in serie.items()]
+
+    def exportar_prometheus(self) -> str:
+        """Texto no formato de exposição do Prometheus (0.0.4)."""
+        def fmt(rotulos: Rotulos, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            todos = rotulos + extra
+            if not todos: return ''
+            return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in todos) + '}'
+
+        linhas = []
+        with self._lock:
+            for nome, serie in sorted(self._contadores.items()):
+                if nome in self._ajuda: linhas.append(f"# HELP {nome} {self._ajuda[nome]}")
+                linhas.append(f"# TYPE {nome} counter")
+                linhas.extend(f"{nome}{fmt(r)} {v:g}" for r, v in sorted(serie.items()))
+            for nome, serie in sorted(self._histogramas.items()):
+                if nome in self._ajuda: linhas.append(f"# HELP {nome} {self._ajuda[nome]}")
+                linhas.append(f"# TYPE {nome} histogram")
+                for r, h in sorted(serie.items()):
+                    acumulado = 0
+                    for limite, c in zip(self.buckets + (float('inf'),), h.contagens):
+                        acumulado += c
+                        le = '+Inf' if limite == float('inf') else f"{limite:g}"
+                        linhas.append(f"{nome}_bucket{fmt(r, (('le', le),))} {acumulado}")
+                    linhas.append(f"{nome}_sum{fmt(r)} {h.soma:.6f}")
+                    linhas.append(f"{nome}_count{fmt(r)} {h.total}")
+        return '\n'.join(linhas) + '\n'
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+
+_metricas = Metricas()
+
+
+def get_metricas() -> Metricas:
+    """Registro de métricas único por processo."""
+    return _metricas
+
+
+class Span:
+    """Trecho cronometrado; `resultado` pode ser trocado dentro do bloco (ex.: 'bloqueado', 'cache')."""
+
+    def __init__(self, etapa: str):
+        self.etapa = etapa
+        self.resultado = 'ok'
+        self.duracao_s: Optional[float] = None
+        self._inicio = 0.0
+
+    def __enter__(self) -> "Span":
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, exc, tb) -> bool:
+        self.duracao_s = time.perf_counter() - self._inicio
+        if tipo is not None and self.resultado == 'ok':
+            self.resultado = 'excecao'
+        observar_etapa(self.etapa, self.duracao_s, self.resultado)
+        return False
+
+
+def medir(etapa: str) -> Span:
+    """`with medir("geocoding") as span: ...` registra a duração com o resultado do span."""
+    return Span(etapa)
+
+
+def observar_etapa(etapa: str, segundos: float, resultado: str = 'ok') -> None:
+    _metricas.observar(HISTOGRAMA_ETAPAS, segundos, ajuda="Duração das etapas do Krateras por resultado.", etapa=etapa, resultado=resultado)
+
+
+def cronometrado(etapa: str, classificar: Optional[Callable[[Any], str]] = None) -> Callable:
+    """Decorador: mede cada chamada; `classificar(retorno)` define o rótulo `resultado` (padrão 'ok')."""
+    def decorador(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with medir(etapa) as span:
+                retorno = fn(*args, **kwargs)
+                if classificar:
+                    try: span.resultado = classificar(retorno)
+                    except Exception: span.resultado = 'desconhecido'
+                return retorno
+        return wrapper
+    return decorador
+
+
+def resultado_por_erro(retorno: Any) -> str:
+    """Classificador para funções que devolvem {"erro": ...} em caso de falha."""
+    return 'erro' if isinstance(retorno, dict) and 'erro' in retorno else 'ok'
+
+
+_servidor = None  # ThreadingHTTPServer, criado sob demanda
+_servidor_lock = threading.Lock()
+
+
+def iniciar_servidor_metricas(porta: Optional[int] = None, host: Optional[str] = None) -> Optional[int]:
+    """
+    Sobe (uma vez por processo) o endpoint /metrics em segundo plano. Retorna a porta em uso ou None
+    se desligado (porta 0) ou se a porta já estiver ocupada (ex.: outro processo do Krateras).
+    """
+    global _servidor
+    porta = int(os.environ.get("KRATERAS_METRICS_PORT", DEFAULT_PORTA_METRICAS)) if porta is None else porta
+    host = os.environ.get("KRATERAS_METRICS_HOST", DEFAULT_HOST_METRICAS) if host is None else host
+    if not porta:
+        return None
+    with _servidor_lock:
+        if _servidor is None:
+            # http.server só é importado aqui: quem só registra métricas não paga por ele na partida
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            class _MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    corpo = _metricas.exportar_prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(corpo)))
+                    self.end_headers()
+                    self.wfile.write(corpo)
+
+                def log_message(self, *args):
+                    pass
+
+            try:
+                _servidor = ThreadingHTTPServer((host, porta), _MetricsHandler)
+            except OSError as e:
+                logger.warning(f"Endpoint de métricas não iniciado na porta {porta}: {e}")
+                return None
+            threading.Thread(target=_servidor.serve_forever, name="krateras-metricas", daemon=True).start()
+            logger.info(f"Métricas Prometheus em http://{host}:{porta}/metrics")
+        return _servidor.server_address[1]
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de modelos Gemini: descoberta persistida em disco e instâncias compartilhadas.
+
+`genai.list_models()` percorre o catálogo inteiro a cada início de processo; o resultado
+(só os nomes que suportam generateContent) fica em SQLite com TTL, indexado por um hash da
+chave de API — a chave em si nunca é gravada. Os objetos `GenerativeModel` são criados uma
+vez por (chave, modelo) e reaproveitados por todas as análises do processo.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+
+from settings import data_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_DESCOBERTA = 24 * 3600  # 1 dia
+
+
+def _hash_chave(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class ModelRegistry:
+    """
+    Cache de descoberta de modelos + instâncias de `GenerativeModel` por chave de API, seguro para threads.
+    """
+
+    def __init__(self, db_path: str, ttl_segundos: int = DEFAULT_TTL_DESCOBERTA):
+        self.ttl_segundos = ttl_segundos
+        self._lock = threading.Lock()
+        self._modelos: Dict[Tuple[str, str], genai.GenerativeModel] = {}
+        self._chave_configurada: Optional[str] = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS descobertas (
+                chave_hash TEXT PRIMARY KEY,
+                modelos TEXT NOT NULL,
+                atualizado_em REAL NOT NULL
+            )"""
+        )
+
+    def _configurar(self, api_key: str) -> None:
+        # genai.configure é global: só reconfigura quando a chave muda (chamar sob self._lock)
+        if self._chave_configurada != api_key:
+            # KRATERAS_GEMINI_ENDPOINT aponta o SDK (via REST) para outro host, p.ex. o Gemini falso do benchmark
+            endpoint = os.environ.get("KRATERAS_GEMINI_ENDPOINT")
+            if endpoint: genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+            else: genai.configure(api_key=api_key)
+            self._chave_configurada = api_key
+
+    def listar_modelos(self, api_key: str, forcar: bool = False) -> List[str]:
+        """Nomes dos modelos com generateContent, da base em disco se ainda dentro do TTL."""
+        chave_hash = _hash_chave(api_key)
+        with self._lock:
+            if not forcar:
+                row = self._conn.execute("SELECT modelos, atualizado_em FROM descobertas WHERE chave_hash = ?", (chave_hash,)).fetchone()
+                if row is not None and time.time() - row[1] <= self.ttl_segundos:
+                    return json.loads(row[0])
+            self._configurar(api_key)
+            inicio = time.monotonic()
+            nomes = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+            logger.info(f"Descoberta de modelos Gemini: {len(nomes)} modelos em {time.monotonic() - inicio:.2f}s.")
+            if nomes:
+                self._conn.execute("INSERT OR REPLACE INTO descobertas (chave_hash, modelos, atualizado_em) VALUES (?, ?, ?)",
+                                   (chave_hash, json.dumps(nomes), time.time()))
+            return nomes
+
+    def get_model(self, api_key: str, nome: str) -> genai.GenerativeModel:
+        """`GenerativeModel` compartilhado para (chave, nome)."""
+        chave = (_hash_chave(api_key), nome)
+        with self._lock:
+            modelo = self._modelos.get(chave)
+            if modelo is None:
+                self._configurar(api_key)
+                modelo = self._modelos[chave] = genai.GenerativeModel(nome)
+            return modelo
+
+    def invalidar(self, api_key: Optional[str] = None) -> None:
+        """Descarta a descoberta gravada (de uma chave ou de todas), p.ex. quando um modelo some do catálogo."""
+        with self._lock:
+            if api_key is None: self._conn.execute("DELETE FROM descobertas")
+            else: self._conn.execute("DELETE FROM descobertas WHERE chave_hash = ?", (_hash_chave(api_key),))
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """Registro de modelos único por processo."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(
+                os.environ.get("KRATERAS_MODEL_REGISTRY_PATH", data_path("model_registry.sqlite3")),
+                ttl_segundos=int(os.environ.get("KRATERAS_MODEL_REGISTRY_TTL", DEFAULT_TTL_DESCOBERTA)),
+            )
+        return _registry
+
+
+def aquecer(api_key: Optional[str]) -> Dict[str, Any]:
+    """
+    Hook de aquecimento para o início do processo: descobre os modelos, cria o modelo de texto e o de
+    imagem e abre os caches/índices locais, para que a primeira denúncia não pague esses custos.
+    Retorna o tempo gasto em cada parte; falhas são registradas e não interrompem o aquecimento.
+    """
+    from cep_index import get_cep_index
+    from geocode_cache import get_geocode_cache
+    from image_analyzer import MODELO_IMAGEM, get_image_analyzer
+    from image_hash import get_image_hash_index
+    from llm_cache import get_llm_cache
+    from report_store import get_report_store
+    from spatial_index import get_spatial_index
+    from gemini_text import selecionar_modelo_texto
+
+    partes = {
+        "cache_llm": get_llm_cache, "cache_geocodificacao": get_geocode_cache, "indice_cep": get_cep_index,
+        "indice_hash_imagem": get_image_hash_index, "indice_espacial": get_spatial_index, "analisador_imagem": get_image_analyzer,
+        "historico_denuncias": get_report_store,
+    }
+    if api_key:
+        partes["modelo_texto"] = lambda: selecionar_modelo_texto(api_key)
+        partes["modelo_imagem"] = lambda: get_model_registry().get_model(api_key, MODELO_IMAGEM)
+    tempos = {}
+    for nome, fn in partes.items():
+        inicio = time.monotonic()
+        try:
+            fn()
+        except Exception as e:
+            logger.warning(f"Aquecimento de '{nome}' falhou: {e}")
+        tempos[nome] = round(time.monotonic() - inicio, 3)
+    logger.info(f"Aquecimento concluído: {tempos}")
+    return tempos
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Página de administração: latência por etapa (p50/p95/p99), contadores, limitadores de taxa,
+disjuntores das APIs externas, jobs de IA e caches. Protegida por ADMIN_PASSWORD em `.streamlit/secrets.toml`, se definido.
+"""
+
+import pandas as pd
+import streamlit as st
+
+from geocode_cache import get_geocode_cache
+from job_runner import get_job_runner
+from llm_cache import get_llm_cache
+from metrics import get_metricas, iniciar_servidor_metricas
+from rate_limiter import LIMITES_PADRAO, get_rate_limiter
+from resilience import POLITICAS_PADRAO, get_disjuntor
+
+st.set_page_config(page_title="Krateras - Métricas", page_icon="📈", layout="wide")
+st.title("📈 Métricas do Krateras")
+
+senha = st.secrets.get('ADMIN_PASSWORD')
+if senha and st.text_input("Senha de administração", type="password") != senha:
+    st.info("Informe a senha de administração para ver as métricas.")
+    st.stop()
+
+porta = iniciar_servidor_metricas()
+st.caption(f"Endpoint Prometheus: `http://<host>:{porta}/metrics`" if porta else "Endpoint Prometheus desligado (KRATERAS_METRICS_PORT=0 ou porta ocupada).")
+metricas = get_metricas()
+if st.button("🔄 Atualizar"): st.rerun()
+
+st.subheader("⏱️ Latência por Etapa")
+resumo = metricas.resumo()
+if resumo:
+    st.dataframe(pd.DataFrame(resumo).set_index(["etapa", "resultado"]), use_container_width=True)
+else:
+    st.info("Nenhuma etapa medida ainda neste processo.")
+
+st.subheader("🔢 Contadores")
+contadores = metricas.contadores()
+if contadores: st.dataframe(pd.DataFrame(contadores), use_container_width=True, hide_index=True)
+else: st.info("Nenhum contador registrado ainda.")
+
+col1, col2 = st.columns(2)
+with col1:
+    st.subheader("🚦 Limitadores de Taxa")
+    st.dataframe(pd.DataFrame([get_rate_limiter(nome).stats() for nome in LIMITES_PADRAO]), use_container_width=True, hide_index=True)
+    st.subheader("🔌 Disjuntores")
+    st.dataframe(pd.DataFrame([get_disjuntor(nome).stats() for nome in POLITICAS_PADRAO]), use_container_width=True, hide_index=True)
+    st.subheader("🧵 Jobs de IA")
+    st.json(get_job_runner().stats())
+with col2:
+    st.subheader("💾 Caches")
+    st.json({"llm": get_llm_cache().stats(), "geocodificacao": get_geocode_cache().stats()})
+
+with st.expander("📄 Exposição Prometheus"):
+    texto = metricas.exportar_prometheus()
+    st.code(texto, language="text")
+    st.download_button("Baixar métricas", texto, file_name="krateras_metrics.txt", mime="text/plain")
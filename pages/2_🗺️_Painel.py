@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Painel analítico do histórico de denúncias: contagens e severidade por bairro, cidade e célula da grade,
+tendência no tempo e trechos de rua mais críticos. As agregações são vetorizadas e memorizadas em
+report_analytics; um rerun sem denúncias novas não relê a base. Protegido por ADMIN_PASSWORD, se definido.
+"""
+
+from datetime import date, timedelta
+
+import streamlit as st
+
+from report_analytics import filtrar, get_painel
+
+st.set_page_config(page_title="Krateras - Painel", page_icon="🗺️", layout="wide")
+st.title("🗺️ Painel de Denúncias")
+
+senha = st.secrets.get('ADMIN_PASSWORD')
+if senha and st.text_input("Senha de administração", type="password") != senha:
+    st.info("Informe a senha de administração para ver o painel.")
+    st.stop()
+
+painel = get_painel()
+with st.spinner("⏳ Carregando histórico..."):
+    df = painel.atualizar()
+if df.empty:
+    st.info("Nenhuma denúncia no histórico ainda.")
+    st.stop()
+if st.button("🔄 Atualizar"): st.rerun()
+
+with st.sidebar:
+    st.header("Filtros")
+    estado = st.selectbox("Estado", ["Todos"] + sorted(df['estado'].cat.categories))
+    cidades = df.loc[df['estado'] == estado, 'cidade'].dropna().unique() if estado != "Todos" else df['cidade'].cat.categories
+    cidade = st.selectbox("Cidade", ["Todas"] + sorted(cidades))
+    periodo = st.date_input("Período (UTC)", (date.today() - timedelta(days=90), date.today()))
+    frequencia = st.radio("Tendência por", ["D", "W", "M"], format_func={"D": "dia", "W": "semana", "M": "mês"}.get, horizontal=True)
+
+desde, ate = (periodo[0].isoformat(), (periodo[1] + timedelta(days=1)).isoformat()) if len(periodo) == 2 else (None, None)
+filtros = {"estado": None if estado == "Todos" else estado, "cidade": None if cidade == "Todas" else cidade, "desde": desde, "ate": ate}
+
+por_cidade = painel.contagem_por('cidade', **filtros)
+total = int(por_cidade['total'].sum()) if len(por_cidade) else 0
+c1, c2, c3, c4 = st.columns(4)
+c1.metric("Denúncias no filtro", f"{total:,}".replace(',', '.'))
+c2.metric("Críticas", int(por_cidade['CRÍTICO'].sum()) if 'CRÍTICO' in por_cidade else 0)
+c3.metric("Altas", int(por_cidade['ALTO'].sum()) if 'ALTO' in por_cidade else 0)
+c4.metric("Histórico completo", f"{len(df):,}".replace(',', '.'))
+
+aba_bairro, aba_cidade, aba_grade, aba_tendencia, aba_ruas = st.tabs(["🏘️ Bairros", "🏙️ Cidades", "🔲 Grade", "📅 Tendência", "🛣️ Ruas Críticas"])
+with aba_bairro:
+    st.dataframe(painel.contagem_por('bairro', **filtros), use_container_width=True)
+with aba_cidade:
+    st.dataframe(por_cidade, use_container_width=True)
+with aba_grade:
+    grade = painel.celulas(desde, ate)
+    if filtros["cidade"] or filtros["estado"]:
+        # Os agregados da grade não guardam a cidade: recorta pela área das denúncias do filtro
+        pontos = filtrar(df, **filtros)[['latitude', 'longitude']].dropna()
+        if len(pontos):
+            lat_min, lon_min = pontos.min()
+            lat_max, lon_max = pontos.max()
+            grade = grade[grade['latitude'].between(lat_min, lat_max) & grade['longitude'].between(lon_min, lon_max)]
+    if len(grade):
+        st.caption(f"{len(grade)} células com denúncias (agregados pré-calculados, atualizados a cada denúncia salva).")
+        st.map(grade.head(5000).assign(tamanho=lambda g: 20 + 80 * g['total'] / g['total'].max()), latitude='latitude', longitude='longitude', size='tamanho')
+        st.dataframe(grade.head(200), use_container_width=True, hide_index=True)
+    else:
+        st.info("Nenhuma denúncia com coordenadas no período.")
+with aba_tendencia:
+    st.bar_chart(painel.tendencia(frequencia, **filtros))
+with aba_ruas:
+    st.dataframe(painel.ruas_criticas(20, **filtros), use_container_width=True, hide_index=True)
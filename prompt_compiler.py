@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Compilador de prompts do Krateras, compartilhado pelas etapas Gemini.
+
+Os modelos de prompt (`ModeloPrompt`) são compilados uma vez, na importação: o texto já sai sem a
+indentação do código e com os campos conhecidos. O contexto comum da denúncia (denunciante, endereço,
+localização, características, observações) é renderizado uma vez por denúncia (`ContextoPrompt`) e
+reaproveitado por todas as etapas. Cada etapa tem um orçamento de tokens de entrada; se o prompt
+passar dele, os campos de texto livre (observações do cidadão, respostas de etapas anteriores)
+são resumidos de forma extrativa, localmente, até caber. Os tokens de cada etapa vão para as métricas.
+"""
+
+import logging
+import math
+import os
+import re
+import string
+import textwrap
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from metrics import get_metricas
+
+logger = logging.getLogger(__name__)
+
+CARACTERES_POR_TOKEN = 4.0   # aproximação do tokenizador do Gemini para português
+TOKENS_POR_IMAGEM = 258      # custo fixo de uma imagem no Gemini 1.5
+MIN_TOKENS_CAMPO = 40        # um campo elástico nunca é encurtado abaixo disso
+
+# Tokens de entrada por etapa (sobrescrevíveis com KRATERAS_ORCAMENTO_<ETAPA>, p.ex. KRATERAS_ORCAMENTO_RESUMO=3000)
+ORCAMENTOS_PADRAO = {
+    "insights": 900,
+    "urgencia": 1200,
+    "sugestao_acao": 1200,
+    "resumo": 2200,
+    "texto_unico": 1600,
+    "analise_visual": 1200,
+}
+
+# Frases com estes radicais têm prioridade no resumo extrativo das observações
+PALAVRAS_CHAVE = ('buraco', 'cratera', 'risco', 'perigo', 'acident', 'criança', 'escola', 'hospital', 'água', 'alag',
+                  'profund', 'moto', 'ciclist', 'bicicleta', 'pedestre', 'pneu', 'noite', 'ilumina', 'chuva', 'urgent',
+                  'queda', 'caiu', 'ferid', 'semana', 'meses', 'anos', 'tamanho', 'largura', 'metro', 'cm')
+
+_FRASES = re.compile(r'(?<=[.!?;])\s+|\n+')
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa local de tokens (sem chamada à API de contagem)."""
+    return math.ceil(len(texto) / CARACTERES_POR_TOKEN) if texto else 0
+
+
+def orcamento(etapa: str) -> Optional[int]:
+    """Orçamento de tokens de entrada da etapa (None = sem limite)."""
+    valor = os.environ.get(f"KRATERAS_ORCAMENTO_{etapa.upper()}")
+    return int(valor) if valor else ORCAMENTOS_PADRAO.get(etapa)
+
+
+def _cortar(texto: str, max_chars: int) -> str:
+    """Corte em limite de palavra, mantendo começo (2/3) e fim (1/3)."""
+    if len(texto) <= max_chars: return texto
+    inicio, fim = texto[:max_chars * 2 // 3], texto[len(texto) - max_chars // 3:]
+    return inicio.rsplit(' ', 1)[0] + ' […] ' + fim.split(' ', 1)[-1]
+
+
+def resumir_texto(texto: str, max_tokens: int) -> str:
+    """
+    Encurta `texto` para caber em `max_tokens`: escolhe as frases mais informativas (palavras-chave, início e fim)
+    na ordem original, marcando os trechos omitidos com […]. Textos de uma ou duas frases são cortados.
+    """
+    if estimar_tokens(texto) <= max_tokens: return texto
+    n_palavras = len(texto.split())
+    marca = f" [resumido de {n_palavras} palavras]"
+    max_chars = max(int(max_tokens * CARACTERES_POR_TOKEN) - len(marca), 40)
+    frases = [f.strip() for f in _FRASES.split(texto.strip()) if f.strip()]
+    if len(frases) <= 2:
+        return _cortar(' '.join(frases), max_chars) + marca
+
+    def _pontos(i: int, frase: str) -> float:
+        baixa = frase.lower()
+        return sum(2 for p in PALAVRAS_CHAVE if p in baixa) + (3 if i == 0 else 1 if i == len(frases) - 1 else 0) - len(frase) / 1000
+
+    escolhidas, usados = set(), 0
+    for i in sorted(range(len(frases)), key=lambda i: -_pontos(i, frases[i])):
+        if usados + len(frases[i]) + 5 <= max_chars:  # +5: espaço e um possível ' […]' antes da frase
+            escolhidas.add(i)
+            usados += len(frases[i]) + 5
+    if not escolhidas:
+        return _cortar(frases[0], max_chars) + marca
+    partes, anterior = [], -1
+    for i in sorted(escolhidas):
+        if i != anterior + 1: partes.append('[…]')
+        partes.append(frases[i])
+        anterior = i
+    if anterior != len(frases) - 1: partes.append('[…]')
+    return ' '.join(partes) + marca
+
+
+def registrar_tokens(etapa: str, tokens: int, encurtado: bool = False) -> None:
+    metricas = get_metricas()
+    metricas.incrementar("krateras_prompt_tokens_total", tokens, ajuda="Tokens estimados de entrada enviados ao Gemini, por etapa.", etapa=etapa)
+    metricas.incrementar("krateras_prompts_total", ajuda="Prompts compilados por etapa e se foram encurtados para caber no orçamento.",
+                         etapa=etapa, encurtado='sim' if encurtado else 'nao')
+
+
+class PromptCompilado:
+    __slots__ = ("etapa", "texto", "tokens", "encurtados")
+
+    def __init__(self, etapa: str, texto: str, tokens: int, encurtados: List[str]):
+        self.etapa, self.texto, self.tokens, self.encurtados = etapa, texto, tokens, encurtados
+
+
+class ModeloPrompt:
+    """
+    Modelo de prompt compilado uma vez. Campos em `{chave}` (chaves literais como `{{`); os `elasticos`
+    são os campos de texto livre que podem ser resumidos para caber no orçamento da etapa, maiores primeiro.
+    """
+
+    def __init__(self, etapa: str, texto: str, elasticos: Iterable[str] = ()):
+        self.etapa = etapa
+        self.texto = textwrap.dedent(texto).strip('\n')
+        self.campos = {nome for _, nome, _, _ in string.Formatter().parse(self.texto) if nome}
+        self.elasticos = tuple(elasticos)
+        self.tokens_base = estimar_tokens(self.texto.format_map({c: '' for c in self.campos}))
+        if faltando := set(self.elasticos) - self.campos:
+            raise ValueError(f"Campos elásticos fora do modelo '{etapa}': {sorted(faltando)}")
+
+    def renderizar(self, valores: Dict[str, Any], limite: Optional[int] = None) -> PromptCompilado:
+        valores = {c: str(valores.get(c, 'N/I')) for c in self.campos}
+        texto = self.texto.format_map(valores)
+        tokens, encurtados = estimar_tokens(texto), []
+        if limite:
+            for campo in sorted(self.elasticos, key=lambda c: -len(valores[c])):
+                excesso = tokens - limite
+                if excesso <= 0: break
+                atual = estimar_tokens(valores[campo])
+                alvo = max(MIN_TOKENS_CAMPO, atual - excesso)
+                if alvo >= atual: continue
+                valores[campo] = resumir_texto(valores[campo], alvo)
+                encurtados.append(campo)
+                texto = self.texto.format_map(valores)
+                tokens = estimar_tokens(texto)
+        return PromptCompilado(self.etapa, texto, tokens, encurtados)
+
+
+def formatar_caracteristicas(caracteristicas: Dict[str, Any], vazio: str = 'N/I') -> str:
+    """Lista '- chave: valor' das características, ignorando 'Selecione' e itens vazios."""
+    linhas = []
+    for k, v in caracteristicas.items():
+        if isinstance(v, list) and any(i for i in v if i and i != 'Selecione'): valor = ', '.join(i for i in v if i and i != 'Selecione')
+        elif isinstance(v, str) and v and v != 'Selecione': valor = v
+        else: valor = vazio
+        linhas.append(f"- {k}: {valor}")
+    return "\n".join(linhas)
+
+
+def descrever_localizacao(loc_ex: Dict[str, Any]) -> str:
+    tipo_loc_proc, in_orig_loc = loc_ex.get('tipo','N/I'), loc_ex.get('input_original','N/I.')
+    mot_falha_geo = loc_ex.get('motivo_falha_geocodificacao_anterior')
+    loc_info_res = f"Localização: Tipo: {tipo_loc_proc}."
+    if tipo_loc_proc in ['Coordenadas Fornecidas/Extraídas Manualmente','Geocodificada (API)','Coordenadas Extraídas de Link (Manual)']:
+         tipo_disp = tipo_loc_proc.replace('(API)','').replace('(Manual)','').replace('Fornecidas/Extraídas','Manual')
+         loc_info_res = f"Loc. Exata: Coords {loc_ex.get('latitude')},{loc_ex.get('longitude')} (Via: {tipo_disp}). Link: {loc_ex.get('google_maps_link_gerado','N/A')}."
+    elif tipo_loc_proc == 'Descrição Manual Detalhada': loc_info_res = f"Loc. via descrição: '{loc_ex.get('descricao_manual','N/I')}'."
+    if in_orig_loc!='N/I.': loc_info_res += f" (Input: '{in_orig_loc}')"
+    if mot_falha_geo: loc_info_res += f" (Nota: {mot_falha_geo})"
+    return loc_info_res
+
+
+class ContextoPrompt:
+    """
+    Partes comuns dos prompts de uma denúncia, renderizadas uma vez e compartilhadas pelas etapas
+    (seguro entre as threads do pipeline). `tokens` guarda os tokens de entrada de cada etapa compilada.
+    """
+
+    def __init__(self, denuncia: Dict[str, Any]):
+        den, bur = denuncia.get('denunciante', {}) or {}, denuncia.get('buraco', {}) or {}
+        end, carac = bur.get('endereco', {}) or {}, bur.get('caracteristicas_estruturadas', {}) or {}
+        obs = (bur.get('observacoes_adicionais') or '').strip()
+        self.valores = {
+            "denunciante": f"{den.get('nome','N/I')}, de {den.get('cidade_residencia','N/I')}",
+            "endereco": f"Rua {end.get('rua','N/I')}, Nº Prox: {bur.get('numero_proximo','N/I')}. Bairro: {end.get('bairro','N/I')}. "
+                        f"Cidade: {end.get('cidade_buraco','N/I')}, Est: {end.get('estado_buraco','N/I')}. CEP: {bur.get('cep_informado','N/I')}",
+            "local": f"Rua {end.get('rua','N/I')}, Nº Prox: {bur.get('numero_proximo','N/I')}. Cidade: {end.get('cidade_buraco','N/I')}, "
+                     f"Estado: {end.get('estado_buraco','N/I')}",
+            "lado_rua": bur.get('lado_rua') or 'N/I',
+            "localizacao": descrever_localizacao(denuncia.get('localizacao_exata_processada', {}) or {}),
+            "caracteristicas": formatar_caracteristicas(carac),
+            "caracteristicas_ni": formatar_caracteristicas(carac, vazio='Não informado'),
+            "observacoes": obs or 'N/A.',
+            "data_hora": (denuncia.get('metadata', {}) or {}).get('data_hora_utc', 'N/R'),
+        }
+        self.tokens: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def compilar(self, modelo: ModeloPrompt, **extras: Any) -> str:
+        """Renderiza `modelo` com o contexto + `extras` dentro do orçamento da etapa e registra os tokens."""
+        prompt = modelo.renderizar({**self.valores, **extras}, orcamento(modelo.etapa))
+        with self._lock:
+            self.tokens[modelo.etapa] = prompt.tokens
+        registrar_tokens(modelo.etapa, prompt.tokens, bool(prompt.encurtados))
+        if prompt.encurtados:
+            logger.info(f"Prompt '{modelo.etapa}' encurtado para {prompt.tokens} tokens (orçamento {orcamento(modelo.etapa)}): {', '.join(prompt.encurtados)}.")
+        return prompt.texto
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Limitadores de taxa (token bucket) por API externa, compartilhados por todas as sessões do processo.
+
+Cada API (Gemini, Geocoding) tem um balde com taxa e rajada próprias. As chamadas esperam
+a vez em ordem de chegada (nenhuma é descartada, a não ser que a espera passe do prazo da denúncia) e a taxa se adapta ao que a API devolve:
+cai multiplicativamente a cada resposta de cota estourada (429 / OVER_QUERY_LIMIT) e volta a
+subir aos poucos com as respostas bem-sucedidas (AIMD), ficando logo abaixo da cota real.
+Com KRATERAS_RATE_LIMIT_COMPARTILHADO=1 o estado do balde fica num SQLite local e vale
+também entre processos (vários workers do Streamlit, lotes da CLI).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from settings import data_path
+
+logger = logging.getLogger(__name__)
+
+FATOR_REDUCAO = 0.7          # multiplicador da taxa a cada estouro de cota
+FRACAO_AUMENTO = 0.02        # fração da taxa máxima somada a cada sucesso
+INTERVALO_MIN_REDUCAO = 1.0  # segundos: 429 da mesma rajada só reduzem a taxa uma vez
+
+LIMITES_PADRAO = {
+    # nome: (variável de ambiente, valor padrão, divisor para chamadas/segundo)
+    "gemini": ("KRATERAS_GEMINI_RPM", 60, 60.0),
+    "geocoding": ("KRATERAS_GEOCODING_QPS", 40, 1.0),
+}
+
+
+def erro_de_cota(e: BaseException) -> bool:
+    """Reconhece exceções de cota estourada do SDK Gemini / HTTP (429, ResourceExhausted)."""
+    # Só pelo código/tipo: '429' na mensagem pode ser um id, um número de endereço ou um token qualquer
+    return (getattr(e, 'code', None) == 429 or getattr(e, 'status_code', None) == 429
+            or getattr(getattr(e, 'response', None), 'status_code', None) == 429
+            or type(e).__name__ in ('ResourceExhausted', 'TooManyRequests'))
+
+
+class RateLimiter:
+    """
+    Token bucket com fila justa (FIFO) e taxa adaptativa. `adquirir()` bloqueia até haver uma ficha (ou até o limite);
+    `registrar(limitado)` informa o resultado da chamada para ajustar a taxa.
+    """
+
+    def __init__(self, nome: str, taxa_por_s: float, capacidade: Optional[float] = None,
+                 taxa_minima: Optional[float] = None, db_path: Optional[str] = None):
+        self.nome = nome
+        self.taxa_maxima = float(taxa_por_s)
+        self.taxa_minima = float(taxa_minima) if taxa_minima else self.taxa_maxima * 0.05
+        self.capacidade = float(capacidade) if capacidade else max(1.0, self.taxa_maxima)
+        self.admitidos = 0
+        self.limitados = 0
+        self.espera_total_s = 0.0
+        self.esgotados = 0
+        self._taxa = self.taxa_maxima
+        self._fichas = self.capacidade
+        self._atualizado = time.time()
+        self._ultima_reducao = 0.0
+        self._lock = threading.Lock()
+        # Fila justa: cada chamada pega uma senha e só disputa fichas quando chega a vez dela
+        self._vez = threading.Condition()
+        self._proxima_senha = 0
+        self._senha_atendida = 0
+        self._desistentes = set()
+        self._conn = None
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS baldes (
+                    nome TEXT PRIMARY KEY,
+                    fichas REAL NOT NULL,
+                    taxa REAL NOT NULL,
+                    atualizado_em REAL NOT NULL,
+                    ultima_reducao REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("INSERT OR IGNORE INTO baldes (nome, fichas, taxa, atualizado_em, ultima_reducao) VALUES (?, ?, ?, ?, 0)",
+                               (nome, self.capacidade, self.taxa_maxima, time.time()))
+
+    @property
+    def taxa(self) -> float:
+        return self._taxa
+
+    def _transacao(self, alterar) -> Any:
+        """
+        Aplica `alterar()` ao estado do balde sob lock. No modo compartilhado o estado é lido e gravado
+        no SQLite dentro de BEGIN IMMEDIATE, que serializa os processos.
+        """
+        with self._lock:
+            if self._conn is None:
+                return alterar()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._fichas, self._taxa, self._atualizado, self._ultima_reducao = self._conn.execute(
+                    "SELECT fichas, taxa, atualizado_em, ultima_reducao FROM baldes WHERE nome = ?", (self.nome,)).fetchone()
+                resultado = alterar()
+                self._conn.execute("UPDATE baldes SET fichas = ?, taxa = ?, atualizado_em = ?, ultima_reducao = ? WHERE nome = ?",
+                                   (self._fichas, self._taxa, self._atualizado, self._ultima_reducao, self.nome))
+                self._conn.execute("COMMIT")
+                return resultado
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _tentar_consumir(self) -> float:
+        """Consome uma ficha se houver; senão retorna quantos segundos faltam para a próxima."""
+        agora = time.time()
+        self._fichas = min(self.capacidade, self._fichas + (agora - self._atualizado) * self._taxa)
+        self._atualizado = agora
+        if self._fichas >= 1.0:
+            self._fichas -= 1.0
+            return 0.0
+        return (1.0 - self._fichas) / self._taxa
+
+    def adquirir(self, limite_s: Optional[float] = None) -> float:
+        """
+        Espera (em ordem de chegada) até poder chamar a API. Retorna o tempo esperado em segundos.
+        Com `limite_s` (ex.: o que resta do prazo da denúncia), levanta `PrazoEsgotado` em vez de esperar além dele.
+        """
+        inicio = time.monotonic()
+        fim = inicio + limite_s if limite_s is not None else None
+        with self._vez:
+            senha = self._proxima_senha
+            self._proxima_senha += 1
+            while senha != self._senha_atendida:
+                if fim is not None and (restante := fim - time.monotonic()) <= 0:
+                    # Desiste da fila: quem for atendido antes pula esta senha
+                    self._desistentes.add(senha)
+                    self._esgotar(limite_s)
+                self._vez.wait(restante if fim is not None else None)
+        try:
+            while (falta := self._transacao(self._tentar_consumir)) > 0:
+                if fim is not None and time.monotonic() + falta > fim:
+                    self._esgotar(limite_s)
+                time.sleep(falta)
+        finally:
+            with self._vez:
+                self._senha_atendida += 1
+                while self._senha_atendida in self._desistentes:
+                    self._desistentes.discard(self._senha_atendida)
+                    self._senha_atendida += 1
+                self._vez.notify_all()
+        espera = time.monotonic() - inicio
+        with self._lock:
+            self.admitidos += 1
+            self.espera_total_s += espera
+        return espera
+
+    def _esgotar(self, limite_s: float) -> None:
+        from resilience import PrazoEsgotado  # resilience importa este módulo
+        with self._lock:
+            self.esgotados += 1
+        raise PrazoEsgotado(f"Limitador '{self.nome}' não teria vez em {limite_s:.2f}s (prazo da denúncia).")
+
+    def registrar(self, limitado: bool) -> None:
+        """Ajusta a taxa com o resultado da chamada: redução multiplicativa no estouro de cota, aumento aditivo no sucesso."""
+        def _ajustar():
+            agora = time.time()
+            if limitado:
+                if agora - self._ultima_reducao >= INTERVALO_MIN_REDUCAO:
+                    self._taxa = max(self.taxa_minima, self._taxa * FATOR_REDUCAO)
+                    self._ultima_reducao = agora
+                    self._fichas = min(self._fichas, 0.0)
+                    return True
+            else:
+                self._taxa = min(self.taxa_maxima, self._taxa + self.taxa_maxima * FRACAO_AUMENTO)
+            return False
+        reduziu = self._transacao(_ajustar)
+        if limitado:
+            with self._lock:
+                self.limitados += 1
+            if reduziu:
+                logger.warning(f"Cota estourada em '{self.nome}': taxa reduzida para {self._taxa:.3f} chamadas/s.")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"nome": self.nome, "taxa_atual": round(self._taxa, 4), "taxa_maxima": self.taxa_maxima,
+                    "admitidos": self.admitidos, "limitados": self.limitados, "esgotados": self.esgotados,
+                    "espera_media_s": round(self.espera_total_s / self.admitidos, 4) if self.admitidos else 0.0,
+                    "compartilhado": self._conn is not None}
+
+
+_limitadores: Dict[str, RateLimiter] = {}
+_limitadores_lock = threading.Lock()
+
+
+def get_rate_limiter(nome: str) -> RateLimiter:
+    """Limitador único por processo para a API `nome` ('gemini', 'geocoding')."""
+    with _limitadores_lock:
+        if nome not in _limitadores:
+            var, padrao, divisor = LIMITES_PADRAO[nome]
+            compartilhado = os.environ.get("KRATERAS_RATE_LIMIT_COMPARTILHADO", "").lower() in ("1", "true", "sim")
+            _limitadores[nome] = RateLimiter(
+                nome, float(os.environ.get(var, padrao)) / divisor,
+                db_path=os.environ.get("KRATERAS_RATE_LIMIT_PATH", data_path("rate_limits.sqlite3")) if compartilhado else None,
+            )
+        return _limitadores[nome]
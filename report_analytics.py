@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Agregações do painel analítico sobre o histórico de denúncias, vetorizadas com pandas/NumPy.
+
+O painel mantém em memória um DataFrame compacto só com as colunas indexadas do histórico (sem o relatório
+JSON): textos repetidos como `category`, datas como datetime64. Na primeira consulta ele é lido em blocos;
+depois, cada `atualizar()` busca só as linhas com rowid acima do último lido, então um rerun do Streamlit
+sem denúncias novas não toca na base. Os resultados das agregações ficam memorizados por versão dos dados
+e filtros. As contagens por célula da grade vêm prontas da tabela `agregados_celulas`, mantida a cada
+denúncia salva (ver report_store).
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from report_store import PASSO_AGREGADOS, ReportStore, get_report_store
+
+logger = logging.getLogger(__name__)
+
+SEVERIDADES = ['BAIXO', 'MÉDIO', 'ALTO', 'CRÍTICO', 'INDEFINIDO']
+PESOS_SEVERIDADE = {'BAIXO': 1.0, 'MÉDIO': 2.0, 'ALTO': 3.0, 'CRÍTICO': 4.0}  # sem análise visual conta 1
+COLUNAS = ['rowid', 'id_denuncia', 'data', 'cidade', 'estado', 'bairro', 'rua', 'latitude', 'longitude', 'nivel_severidade', 'categoria_urgencia']
+COLUNAS_CATEGORICAS = ['cidade', 'estado', 'bairro', 'rua', 'nivel_severidade', 'categoria_urgencia']
+DEFAULT_BLOCO = 100_000
+MAX_MEMO = 64
+
+
+def _quadro(linhas: list) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(linhas, columns=COLUNAS)
+    df['rowid'] = df['rowid'].astype('int64')
+    # Com ou sem fuso ("...Z" de lotes, "AAAA-MM-DD HH:MM:SS" do app): tudo em UTC e sem fuso, como datetime64
+    df['data'] = pd.to_datetime(df['data'], errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None)
+    for coluna in ('latitude', 'longitude'):
+        df[coluna] = pd.to_numeric(df[coluna], errors='coerce')
+    for coluna in COLUNAS_CATEGORICAS:
+        df[coluna] = df[coluna].replace('', None).astype('category')
+    return df
+
+
+def _unir(antigo: pd.DataFrame, novos: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatena mantendo as colunas categóricas (categorias unidas) e descarta versões antigas de denúncias regravadas."""
+    if len(antigo):
+        ids_novos = pd.concat([n['id_denuncia'] for n in novos])
+        antigo = antigo[~antigo['id_denuncia'].isin(ids_novos)]
+    quadros = [antigo, *novos]
+    for coluna in COLUNAS_CATEGORICAS:
+        categorias = quadros[0][coluna].cat.categories
+        for q in quadros[1:]: categorias = categorias.union(q[coluna].cat.categories)
+        for q in quadros: q[coluna] = q[coluna].cat.set_categories(categorias)
+    return pd.concat(quadros, ignore_index=True)
+
+
+class PainelAnalitico:
+    """
+    DataFrame incremental do histórico + agregações memorizadas por versão, seguro entre sessões do Streamlit.
+    """
+
+    def __init__(self, store: ReportStore, bloco: int = DEFAULT_BLOCO):
+        self.store, self.bloco = store, bloco
+        self.versao = 0
+        self._df = _quadro([])
+        self._ultimo_rowid = 0
+        self._memo: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    def atualizar(self) -> pd.DataFrame:
+        """Lê só as denúncias gravadas desde a última chamada e devolve o DataFrame completo."""
+        with self._lock:
+            novos = []
+            while linhas := self.store.colunas_analiticas(self._ultimo_rowid, self.bloco):
+                novos.append(_quadro(linhas))
+                self._ultimo_rowid = linhas[-1][0]
+                if len(linhas) < self.bloco: break
+            if novos:
+                df = _unir(self._df, novos)
+                self._df, self.versao = df, self.versao + 1
+                self._memo.clear()
+                logger.info(f"Painel analítico: {sum(map(len, novos))} denúncias novas, {len(df)} no total.")
+            return self._df
+
+    def _memorizado(self, chave: Tuple, calcular: Callable[[pd.DataFrame], Any]) -> Any:
+        """Resultado de `calcular(df)` memorizado até chegarem denúncias novas (a versão muda em atualizar())."""
+        with self._lock:
+            chave, df = (self.versao, *chave), self._df
+            if chave in self._memo: return self._memo[chave]
+        resultado = calcular(df)
+        with self._lock:
+            if len(self._memo) >= MAX_MEMO: self._memo.clear()
+            self._memo[chave] = resultado
+        return resultado
+
+    def contagem_por(self, coluna: str, **filtros: Any) -> pd.DataFrame:
+        return self._memorizado(("contagem", coluna, *sorted(filtros.items())), lambda df: contagem_por(filtrar(df, **filtros), coluna))
+
+    def tendencia(self, frequencia: str = 'D', **filtros: Any) -> pd.DataFrame:
+        return self._memorizado(("tendencia", frequencia, *sorted(filtros.items())), lambda df: tendencia(filtrar(df, **filtros), frequencia))
+
+    def ruas_criticas(self, n: int = 20, **filtros: Any) -> pd.DataFrame:
+        return self._memorizado(("ruas", n, *sorted(filtros.items())), lambda df: ruas_criticas(filtrar(df, **filtros), n))
+
+    def celulas(self, desde: Optional[str] = None, ate: Optional[str] = None) -> pd.DataFrame:
+        return self._memorizado(("celulas", desde, ate), lambda _: celulas(self.store, desde, ate))
+
+
+def filtrar(df: pd.DataFrame, cidade: Optional[str] = None, estado: Optional[str] = None,
+            desde: Optional[str] = None, ate: Optional[str] = None) -> pd.DataFrame:
+    """Recorte por máscaras booleanas (sem cópia quando não há filtro). `ate` é exclusivo."""
+    mascara = np.ones(len(df), dtype=bool)
+    if cidade: mascara &= (df['cidade'] == cidade).to_numpy()
+    if estado: mascara &= (df['estado'] == estado).to_numpy()
+    if desde: mascara &= (df['data'] >= pd.Timestamp(desde)).to_numpy()
+    if ate: mascara &= (df['data'] < pd.Timestamp(ate)).to_numpy()
+    return df if mascara.all() else df[mascara]
+
+
+def _com_sem_analise(df: pd.DataFrame) -> pd.DataFrame:
+    """Denúncias sem análise visual entram como severidade 'sem_analise' (em vez de sumirem do groupby)."""
+    return df.assign(nivel_severidade=df['nivel_severidade'].cat.add_categories(['sem_analise']).fillna('sem_analise'))
+
+
+def contagem_por(df: pd.DataFrame, coluna: str) -> pd.DataFrame:
+    """Denúncias por valor de `coluna` (bairro, cidade…), com uma coluna por severidade e o total, maiores primeiro."""
+    tabela = _com_sem_analise(df).groupby([coluna, 'nivel_severidade'], observed=True).size().unstack(fill_value=0)
+    tabela = tabela[[s for s in SEVERIDADES + ['sem_analise'] if s in tabela.columns]]
+    tabela.columns = list(tabela.columns)
+    tabela['total'] = tabela.sum(axis=1)
+    return tabela.sort_values('total', ascending=False)
+
+
+def tendencia(df: pd.DataFrame, frequencia: str = 'D') -> pd.DataFrame:
+    """Denúncias por período ('D', 'W' ou 'M', indexado pelo início do período) e severidade."""
+    periodo = df['data'].dt.to_period(frequencia).rename('periodo')
+    tabela = _com_sem_analise(df).groupby([periodo, 'nivel_severidade'], observed=True).size().unstack(fill_value=0)
+    tabela = tabela[[s for s in SEVERIDADES + ['sem_analise'] if s in tabela.columns]]
+    tabela.columns = list(tabela.columns)
+    tabela.index = tabela.index.to_timestamp()
+    return tabela
+
+
+def ruas_criticas(df: pd.DataFrame, n: int = 20) -> pd.DataFrame:
+    """Trechos de rua (rua + bairro + cidade) com maior pontuação: soma dos pesos de severidade das denúncias."""
+    peso = df['nivel_severidade'].map(PESOS_SEVERIDADE).astype(float).fillna(1.0)
+    return (df.assign(peso=peso).dropna(subset=['rua'])
+              .groupby(['cidade', 'bairro', 'rua'], observed=True, dropna=False)
+              .agg(denuncias=('id_denuncia', 'size'), pontuacao=('peso', 'sum'), latitude=('latitude', 'mean'), longitude=('longitude', 'mean'))
+              .nlargest(n, 'pontuacao').reset_index())
+
+
+def celulas(store: ReportStore, desde: Optional[str] = None, ate: Optional[str] = None) -> pd.DataFrame:
+    """Contagens pré-agregadas por célula da grade (centro em lat/lon), com uma coluna por severidade e o total."""
+    linhas = store.agregados_celulas(desde, ate)
+    if not linhas:
+        return pd.DataFrame(columns=['latitude', 'longitude', 'total'])
+    bruto = pd.DataFrame.from_records(linhas, columns=['linha', 'coluna', 'nivel_severidade', 'n'])
+    bruto['nivel_severidade'] = bruto['nivel_severidade'].replace('', 'sem_analise')
+    tabela = bruto.pivot_table(index=['linha', 'coluna'], columns='nivel_severidade', values='n', aggfunc='sum', fill_value=0)
+    tabela.columns.name = None
+    tabela['total'] = tabela.sum(axis=1)
+    linha, coluna = (tabela.index.get_level_values(i).to_numpy() for i in (0, 1))
+    tabela.insert(0, 'latitude', (linha + 0.5) * PASSO_AGREGADOS - 90.0)
+    tabela.insert(1, 'longitude', (coluna + 0.5) * PASSO_AGREGADOS - 180.0)
+    return tabela.reset_index(drop=True).sort_values('total', ascending=False, ignore_index=True)
+
+
+_painel: Optional[PainelAnalitico] = None
+_painel_lock = threading.Lock()
+
+
+def get_painel() -> PainelAnalitico:
+    """Painel analítico único por processo (compartilhado pelas sessões do Streamlit)."""
+    global _painel
+    with _painel_lock:
+        if _painel is None:
+            _painel = PainelAnalitico(get_report_store())
+        return _painel
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Exportação em massa das denúncias gravadas, para parceiros (prefeituras) e ferramentas de GIS.
+
+As denúncias saem do histórico (report_store) em lotes e são gravadas em streaming, com memória limitada
+a um lote, qualquer que seja o tamanho da base:
+- Parquet (`pyarrow`, dependência opcional) com esquema fixo (`ESQUEMA`), um row group por lote;
+- GeoJSON (FeatureCollection) e NDJSON (GeoJSONSeq, uma Feature por linha) para QGIS/ArcGIS/ogr2ogr.
+
+As imagens não são embutidas: cada linha leva o sha256 e uma referência externa (URL base + hash, ou o
+caminho no blob store). O arquivo final só aparece completo (gravação num temporário + os.replace).
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import cronometrado, get_metricas
+from report_store import ReportStore, get_report_store
+from urgency_rules import categoria_urgencia
+
+logger = logging.getLogger(__name__)
+
+FORMATOS = ("parquet", "geojson", "ndjson")
+DEFAULT_TAMANHO_LOTE = 1000
+
+# Coluna exportada -> chave em `caracteristicas_estruturadas`
+COLUNAS_CARACTERISTICAS = {
+    'tamanho': 'Tamanho Estimado',
+    'perigo': 'Perigo Estimado',
+    'profundidade': 'Profundidade Estimada',
+    'agua': 'Presença de Água/Alagamento',
+    'trafego': 'Tráfego Estimado na Via',
+    'contexto_via': 'Contexto da Via',
+}
+
+# Esquema fixo das linhas exportadas: (coluna, tipo). Tipos: texto, real, instante (UTC), lista (de textos).
+ESQUEMA: Tuple[Tuple[str, str], ...] = (
+    ('id_denuncia', 'texto'), ('data_hora_utc', 'instante'), ('salvo_em', 'instante'), ('origem', 'texto'),
+    ('rua', 'texto'), ('numero_proximo', 'texto'), ('bairro', 'texto'), ('cidade', 'texto'), ('estado', 'texto'), ('cep', 'texto'),
+    ('latitude', 'real'), ('longitude', 'real'), ('tipo_localizacao', 'texto'),
+    ('nivel_severidade', 'texto'), ('categoria_urgencia', 'texto'),
+    ('tamanho', 'texto'), ('perigo', 'texto'), ('profundidade', 'texto'), ('agua', 'texto'), ('trafego', 'texto'), ('contexto_via', 'lista'),
+    ('cluster_id', 'texto'), ('imagem_hash', 'texto'), ('imagem_tipo', 'texto'), ('imagem_ref', 'texto'),
+)
+
+
+def _texto(valor: Any) -> Optional[str]:
+    if valor is None: return None
+    valor = str(valor).strip()
+    return valor if valor and valor != 'Selecione' else None
+
+
+def _real(valor: Any) -> Optional[float]:
+    try: return float(valor) if valor is not None else None
+    except (TypeError, ValueError): return None
+
+
+def _instante(valor: Any) -> Optional[datetime]:
+    """'AAAA-MM-DD HH:MM:SS' (UTC, como gravado pelo app e pelo lote) ou epoch -> datetime com fuso UTC."""
+    if isinstance(valor, (int, float)): return datetime.fromtimestamp(valor, timezone.utc)
+    try: instante = datetime.fromisoformat(str(valor).strip())
+    except (TypeError, ValueError): return None
+    return instante.replace(tzinfo=timezone.utc) if instante.tzinfo is None else instante.astimezone(timezone.utc)
+
+
+def linha_exportacao(denuncia: Dict[str, Any], salvo_em: Optional[float] = None, blobs_dir: Optional[str] = None,
+                     url_imagens: Optional[str] = None) -> Dict[str, Any]:
+    """Uma denúncia achatada no esquema fixo (`ESQUEMA`); campos ausentes viram None."""
+    meta, bur = denuncia.get('metadata') or {}, denuncia.get('buraco') or {}
+    end, carac = bur.get('endereco') or {}, bur.get('caracteristicas_estruturadas') or {}
+    loc, vis = denuncia.get('localizacao_exata_processada') or {}, denuncia.get('resultado_analise_visual_krateras') or {}
+    img = bur.get('imagem_denuncia') if isinstance(bur.get('imagem_denuncia'), dict) else {}
+    h = img.get('hash')
+    if h and url_imagens: ref = f"{url_imagens.rstrip('/')}/{h}"
+    elif h and blobs_dir: ref = os.path.join(blobs_dir, h[:2], h[2:])
+    else: ref = None
+    linha = {
+        'id_denuncia': _texto(meta.get('id_denuncia')), 'data_hora_utc': _instante(meta.get('data_hora_utc')),
+        'salvo_em': _instante(salvo_em) if salvo_em is not None else None, 'origem': _texto(meta.get('origem', 'app')),
+        'rua': _texto(end.get('rua')), 'numero_proximo': _texto(bur.get('numero_proximo')), 'bairro': _texto(end.get('bairro')),
+        'cidade': _texto(end.get('cidade_buraco')), 'estado': _texto(end.get('estado_buraco')), 'cep': _texto(bur.get('cep_informado')),
+        'latitude': _real(loc.get('latitude')), 'longitude': _real(loc.get('longitude')), 'tipo_localizacao': _texto(loc.get('tipo')),
+        'nivel_severidade': _texto(vis.get('nivel_severidade')), 'categoria_urgencia': categoria_urgencia(denuncia.get('urgencia_ia')),
+        'cluster_id': _texto((denuncia.get('cluster_buracos') or {}).get('cluster_id')),
+        'imagem_hash': h, 'imagem_tipo': _texto(img.get('type')), 'imagem_ref': ref,
+    }
+    for coluna, chave in COLUNAS_CARACTERISTICAS.items():
+        valor = carac.get(chave)
+        if coluna == 'contexto_via': linha[coluna] = [str(v) for v in valor if _texto(v)] if isinstance(valor, list) else []
+        else: linha[coluna] = _texto(valor)
+    return linha
+
+
+def _esquema_arrow():
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise RuntimeError("Exportação Parquet requer o pyarrow (pip install pyarrow).") from e
+    tipos = {'texto': pa.string(), 'real': pa.float64(), 'instante': pa.timestamp('us', tz='UTC'), 'lista': pa.list_(pa.string())}
+    return pa, pa.schema([(nome, tipos[tipo]) for nome, tipo in ESQUEMA])
+
+
+def _gravar_parquet(caminho: str, lotes: Iterable[List[Dict[str, Any]]]) -> int:
+    pa, esquema = _esquema_arrow()
+    import pyarrow.parquet as pq
+    total = 0
+    with pq.ParquetWriter(caminho, esquema, compression='zstd') as writer:
+        for linhas in lotes:
+            writer.write_table(pa.Table.from_pydict({nome: [l[nome] for l in linhas] for nome, _ in ESQUEMA}, schema=esquema))
+            total += len(linhas)
+    return total
+
+
+def feature_geojson(linha: Dict[str, Any]) -> Dict[str, Any]:
+    """Feature GeoJSON (Point [lon, lat], ou geometria nula sem coordenadas) com as demais colunas como propriedades."""
+    lat, lon = linha['latitude'], linha['longitude']
+    propriedades = {k: (v.isoformat().replace('+00:00', 'Z') if isinstance(v, datetime) else v)
+                    for k, v in linha.items() if k not in ('latitude', 'longitude')}
+    geometria = {"type": "Point", "coordinates": [lon, lat]} if lat is not None and lon is not None else None
+    return {"type": "Feature", "id": linha['id_denuncia'], "geometry": geometria, "properties": propriedades}
+
+
+def _gravar_geojson(caminho: str, lotes: Iterable[List[Dict[str, Any]]], sequencia: bool) -> int:
+    total = 0
+    with open(caminho, 'w', encoding='utf-8') as f:
+        if not sequencia: f.write('{"type": "FeatureCollection", "features": [\n')
+        for linhas in lotes:
+            for linha in linhas:
+                texto = json.dumps(feature_geojson(linha), ensure_ascii=False)
+                if sequencia: f.write(texto + '\n')
+                else: f.write((',\n' if total else '') + texto)
+                total += 1
+        if not sequencia: f.write('\n]}\n')
+    return total
+
+
+@cronometrado("exportacao")
+def exportar(caminho_saida: str, formato: Optional[str] = None, store: Optional[ReportStore] = None,
+             tamanho_lote: int = DEFAULT_TAMANHO_LOTE, url_imagens: Optional[str] = None, **filtros: Optional[str]) -> int:
+    """
+    Exporta as denúncias do histórico (filtros de ReportStore.iterar_lotes: cidade, estado, desde, ate) para
+    `caminho_saida` em Parquet, GeoJSON ou NDJSON (padrão: pela extensão). Retorna quantas foram exportadas.
+    """
+    formato = formato or {'.parquet': 'parquet', '.geojson': 'geojson', '.json': 'geojson'}.get(os.path.splitext(caminho_saida)[1].lower(), 'ndjson')
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportação desconhecido: {formato!r} (use {', '.join(FORMATOS)}).")
+    store = store or get_report_store()
+
+    def _lotes() -> Iterator[List[Dict[str, Any]]]:
+        for lote in store.iterar_lotes(tamanho_lote, **filtros):
+            yield [linha_exportacao(den, salvo_em, store.blobs.diretorio, url_imagens) for salvo_em, den in lote]
+
+    tmp = caminho_saida + '.tmp'
+    try:
+        total = _gravar_parquet(tmp, _lotes()) if formato == 'parquet' else _gravar_geojson(tmp, _lotes(), sequencia=formato == 'ndjson')
+        os.replace(tmp, caminho_saida)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    get_metricas().incrementar("krateras_denuncias_exportadas_total", total, ajuda="Denúncias exportadas em massa, por formato.", formato=formato)
+    logger.info(f"{total} denúncias exportadas para {caminho_saida} ({formato}).")
+    return total
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Armazenamento durável das denúncias concluídas.
+
+Os metadados e o relatório (JSON) ficam numa tabela SQLite; as imagens são gravadas uma
+única vez num diretório endereçado por conteúdo (sha256, em subpastas de 2 caracteres) e
+referenciadas pelo hash. A sessão do Streamlit e o pipeline carregam só o "handle" da imagem
+({filename, type, hash, tamanho_bytes}), nunca os bytes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from settings import data_path
+from urgency_rules import categoria_urgencia
+
+logger = logging.getLogger(__name__)
+
+METROS_POR_GRAU_LAT = 111_320.0
+# Células dos agregados espaciais (painel analítico). Trocar o tamanho exige ReportStore.reconstruir_agregados().
+TAMANHO_CELULA_AGREGADOS_M = 250.0
+PASSO_AGREGADOS = TAMANHO_CELULA_AGREGADOS_M / METROS_POR_GRAU_LAT
+# Colunas acrescentadas depois da primeira versão da tabela: (coluna, expressão SQL de preenchimento das linhas antigas)
+COLUNAS_MIGRADAS = (
+    ('bairro', "json_extract(relatorio, '$.buraco.endereco.bairro')"),
+    ('rua', "json_extract(relatorio, '$.buraco.endereco.rua')"),
+    ('categoria_urgencia', "categoria_urgencia(json_extract(relatorio, '$.urgencia_ia.urgencia_ia'))"),
+)
+_COLUNAS = ('id_denuncia', 'salvo_em', 'data_hora_utc', 'origem', 'cidade', 'estado', 'latitude', 'longitude',
+            'nivel_severidade', 'cluster_id', 'imagem_hash', 'relatorio', 'bairro', 'rua', 'categoria_urgencia')
+# Chave da célula, do dia e da severidade de uma linha de `denuncias` (latitude/longitude deslocadas para ficarem positivas)
+_SQL_CHAVE_AGREGADO = (f"CAST((latitude + 90) / {PASSO_AGREGADOS!r} AS INTEGER), CAST((longitude + 180) / {PASSO_AGREGADOS!r} AS INTEGER), "
+                       "COALESCE(substr(data_hora_utc, 1, 10), ''), COALESCE(nivel_severidade, '')")
+
+
+class BlobStore:
+    """
+    Blobs imutáveis endereçados por sha256. Gravar o mesmo conteúdo duas vezes não duplica nada.
+    """
+
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+        os.makedirs(diretorio, exist_ok=True)
+
+    def caminho(self, h: str) -> str:
+        return os.path.join(self.diretorio, h[:2], h[2:])
+
+    def gravar(self, dados: bytes) -> str:
+        h = hashlib.sha256(dados).hexdigest()
+        destino = self.caminho(h)
+        if not os.path.exists(destino):
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            # Grava num temporário e renomeia: leitores nunca veem um blob pela metade
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(destino), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(dados)
+                os.replace(tmp, destino)
+            except BaseException:
+                if os.path.exists(tmp): os.remove(tmp)
+                raise
+        return h
+
+    def ler(self, h: str) -> Optional[bytes]:
+        try:
+            with open(self.caminho(h), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class ReportStore:
+    """
+    Histórico de denúncias (SQLite) + blobs das imagens, seguro para uso entre threads.
+    """
+
+    def __init__(self, db_path: str, blobs: BlobStore):
+        self.blobs = blobs
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS denuncias (
+                id_denuncia TEXT PRIMARY KEY,
+                salvo_em REAL NOT NULL,
+                data_hora_utc TEXT,
+                origem TEXT,
+                cidade TEXT,
+                estado TEXT,
+                latitude REAL,
+                longitude REAL,
+                nivel_severidade TEXT,
+                cluster_id TEXT,
+                imagem_hash TEXT,
+                relatorio TEXT NOT NULL,
+                bairro TEXT,
+                rua TEXT,
+                categoria_urgencia TEXT
+            )"""
+        )
+        self._conn.create_function("categoria_urgencia", 1, categoria_urgencia, deterministic=True)
+        self._migrar()
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_denuncias_data ON denuncias (data_hora_utc)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_denuncias_cidade ON denuncias (estado, cidade)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_denuncias_imagem ON denuncias (imagem_hash)")
+        # Contagem de denúncias por célula da grade, dia e severidade, mantida a cada salvar() (o painel não varre a base)
+        existia = self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'agregados_celulas'").fetchone()
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS agregados_celulas (
+                linha INTEGER NOT NULL,
+                coluna INTEGER NOT NULL,
+                dia TEXT NOT NULL,
+                nivel_severidade TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (linha, coluna, dia, nivel_severidade)
+            ) WITHOUT ROWID"""
+        )
+        if not existia: self.reconstruir_agregados()
+
+    def _migrar(self) -> None:
+        """Acrescenta as colunas novas a bases antigas e as preenche a partir do relatório JSON."""
+        existentes = {r[1] for r in self._conn.execute("PRAGMA table_info(denuncias)")}
+        for coluna, preenchimento in COLUNAS_MIGRADAS:
+            if coluna not in existentes:
+                self._conn.execute(f"ALTER TABLE denuncias ADD COLUMN {coluna} TEXT")
+                self._conn.execute(f"UPDATE denuncias SET {coluna} = {preenchimento}")
+                logger.info(f"Coluna '{coluna}' acrescentada ao histórico de denúncias.")
+
+    def reconstruir_agregados(self) -> None:
+        """Recalcula `agregados_celulas` do zero (base antiga ou troca de TAMANHO_CELULA_AGREGADOS_M)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM agregados_celulas")
+                self._conn.execute(f"""INSERT INTO agregados_celulas SELECT {_SQL_CHAVE_AGREGADO}, COUNT(*) FROM denuncias
+                                       WHERE latitude IS NOT NULL AND longitude IS NOT NULL GROUP BY 1, 2, 3, 4""")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def guardar_imagem(self, filename: str, tipo: str, dados: bytes) -> Dict[str, Any]:
+        """Grava os bytes no blob store e devolve o handle que vai em `imagem_denuncia`."""
+        return {"filename": filename, "type": tipo, "hash": self.blobs.gravar(dados), "tamanho_bytes": len(dados)}
+
+    def salvar(self, denuncia: Dict[str, Any]) -> str:
+        """
+        Grava (ou atualiza) a denúncia. Imagens ainda inline são movidas para o blob store antes;
+        a denúncia recebida é alterada para carregar só o handle. Retorna o id_denuncia.
+        """
+        metadata = denuncia.setdefault('metadata', {})
+        id_den = metadata.setdefault('id_denuncia', uuid.uuid4().hex)
+        bur = denuncia.get('buraco') or {}
+        img = bur.get('imagem_denuncia')
+        if isinstance(img, dict) and 'bytes' in img:
+            bur['imagem_denuncia'] = {**{k: v for k, v in img.items() if k != 'bytes'},
+                                      **self.guardar_imagem(img.get('filename'), img.get('type'), img['bytes'])}
+            img = bur['imagem_denuncia']
+        end, loc = bur.get('endereco') or {}, denuncia.get('localizacao_exata_processada') or {}
+        vis = denuncia.get('resultado_analise_visual_krateras') or {}
+        linha = (id_den, time.time(), metadata.get('data_hora_utc'), metadata.get('origem', 'app'),
+                 end.get('cidade_buraco'), end.get('estado_buraco'), loc.get('latitude'), loc.get('longitude'),
+                 vis.get('nivel_severidade'), (denuncia.get('cluster_buracos') or {}).get('cluster_id'),
+                 img.get('hash') if isinstance(img, dict) else None, json.dumps(denuncia, ensure_ascii=False, default=str),
+                 end.get('bairro'), end.get('rua'), categoria_urgencia(denuncia.get('urgencia_ia')))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Regravar uma denúncia tira a contribuição antiga dos agregados antes de somar a nova
+                self._somar_agregado(id_den, -1)
+                self._conn.execute(f"INSERT OR REPLACE INTO denuncias ({', '.join(_COLUNAS)}) VALUES ({', '.join('?' * len(_COLUNAS))})", linha)
+                self._somar_agregado(id_den, +1)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return id_den
+
+    def _somar_agregado(self, id_denuncia: str, delta: int) -> None:
+        self._conn.execute(f"""INSERT INTO agregados_celulas SELECT {_SQL_CHAVE_AGREGADO}, ? FROM denuncias
+                               WHERE id_denuncia = ? AND latitude IS NOT NULL AND longitude IS NOT NULL
+                               ON CONFLICT (linha, coluna, dia, nivel_severidade) DO UPDATE SET n = n + excluded.n""", (delta, id_denuncia))
+        if delta < 0: self._conn.execute("DELETE FROM agregados_celulas WHERE n <= 0")
+
+    def carregar(self, id_denuncia: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT relatorio FROM denuncias WHERE id_denuncia = ?", (id_denuncia,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def listar(self, limite: int = 100, cidade: Optional[str] = None, estado: Optional[str] = None,
+               desde: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Metadados das denúncias mais recentes (sem o relatório completo), com filtros opcionais."""
+        filtros, params = [], []
+        if cidade: filtros.append("cidade = ?"); params.append(cidade)
+        if estado: filtros.append("estado = ?"); params.append(estado)
+        if desde: filtros.append("data_hora_utc >= ?"); params.append(desde)
+        where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+        with self._lock:
+            cur = self._conn.execute(
+                f"""SELECT id_denuncia, data_hora_utc, origem, cidade, estado, latitude, longitude, nivel_severidade, cluster_id, imagem_hash
+                    FROM denuncias {where} ORDER BY data_hora_utc DESC LIMIT ?""", (*params, limite))
+            colunas = [c[0] for c in cur.description]
+            return [dict(zip(colunas, row)) for row in cur.fetchall()]
+
+    def iterar_lotes(self, tamanho_lote: int = 1000, cidade: Optional[str] = None, estado: Optional[str] = None,
+                     desde: Optional[str] = None, ate: Optional[str] = None) -> Iterator[List[Tuple[float, Dict[str, Any]]]]:
+        """
+        Percorre as denúncias em lotes de até `tamanho_lote` pares (salvo_em, relatório), na ordem de gravação.
+        Paginação por rowid: cada lote é uma consulta curta (o lock não fica preso durante a exportação)
+        e só um lote fica em memória por vez. `ate` é exclusivo.
+        """
+        filtros, params = ["rowid > ?"], []
+        if cidade: filtros.append("cidade = ?"); params.append(cidade)
+        if estado: filtros.append("estado = ?"); params.append(estado)
+        if desde: filtros.append("data_hora_utc >= ?"); params.append(desde)
+        if ate: filtros.append("data_hora_utc < ?"); params.append(ate)
+        sql = f"SELECT rowid, salvo_em, relatorio FROM denuncias WHERE {' AND '.join(filtros)} ORDER BY rowid LIMIT ?"
+        ultimo = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(sql, (ultimo, *params, tamanho_lote)).fetchall()
+            if not rows:
+                return
+            ultimo = rows[-1][0]
+            yield [(salvo_em, json.loads(relatorio)) for _, salvo_em, relatorio in rows]
+            if len(rows) < tamanho_lote:
+                return
+
+    def colunas_analiticas(self, apos_rowid: int = 0, limite: int = 100_000) -> List[Tuple]:
+        """
+        Linhas (rowid, id_denuncia, data_hora_utc, cidade, estado, bairro, rua, latitude, longitude, nivel_severidade,
+        categoria_urgencia) com rowid > `apos_rowid`, em ordem de rowid: só colunas indexadas, sem abrir o relatório JSON.
+        """
+        with self._lock:
+            return self._conn.execute(
+                """SELECT rowid, id_denuncia, data_hora_utc, cidade, estado, bairro, rua, latitude, longitude, nivel_severidade, categoria_urgencia
+                   FROM denuncias WHERE rowid > ? ORDER BY rowid LIMIT ?""", (apos_rowid, limite)).fetchall()
+
+    def agregados_celulas(self, desde: Optional[str] = None, ate: Optional[str] = None) -> List[Tuple[int, int, str, int]]:
+        """(linha, coluna, nivel_severidade, n) pré-agregados por célula no intervalo de dias [desde, ate)."""
+        filtros, params = [], []
+        if desde: filtros.append("dia >= ?"); params.append(desde[:10])
+        if ate: filtros.append("dia < ?"); params.append(ate[:10])
+        where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+        with self._lock:
+            return self._conn.execute(f"""SELECT linha, coluna, nivel_severidade, SUM(n) FROM agregados_celulas {where}
+                                          GROUP BY linha, coluna, nivel_severidade""", params).fetchall()
+
+    def ids_com_imagem(self, h: str) -> List[str]:
+        """Denúncias que usaram exatamente a mesma imagem (mesmo sha256)."""
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT id_denuncia FROM denuncias WHERE imagem_hash = ?", (h,))]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM denuncias").fetchone()[0]
+
+
+def tem_imagem(imagem_data: Optional[Dict[str, Any]]) -> bool:
+    """True se `imagem_denuncia` tem conteúdo utilizável (bytes inline ou handle do blob store)."""
+    return isinstance(imagem_data, dict) and ('bytes' in imagem_data or 'hash' in imagem_data)
+
+
+def bytes_imagem(imagem_data: Optional[Dict[str, Any]]) -> Optional[bytes]:
+    """Bytes da imagem, inline (formato antigo) ou lidos do blob store pelo hash."""
+    if not isinstance(imagem_data, dict): return None
+    if 'bytes' in imagem_data: return imagem_data['bytes']
+    if 'hash' in imagem_data: return get_report_store().blobs.ler(imagem_data['hash'])
+    return None
+
+
+_store: Optional[ReportStore] = None
+_store_lock = threading.Lock()
+
+
+def get_report_store() -> ReportStore:
+    """Armazenamento de denúncias único por processo."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReportStore(
+                os.environ.get("KRATERAS_REPORT_STORE_PATH", data_path("denuncias.sqlite3")),
+                BlobStore(os.environ.get("KRATERAS_BLOB_DIR", data_path("blobs"))),
+            )
+        return _store
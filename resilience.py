@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Camada de resiliência das chamadas externas do Krateras (Gemini, Google Geocoding, ViaCEP).
+
+- Retentativas com backoff exponencial e jitter completo, só para erros transitórios (timeout,
+  falha de conexão, 5xx, cota estourada). Erros permanentes (conteúdo bloqueado, chave inválida,
+  requisição inválida) falham na primeira tentativa.
+- Prazo por denúncia (`com_prazo`): todas as etapas e chamadas de uma denúncia consomem o mesmo
+  orçamento de tempo. Nenhuma espera de backoff passa do que resta e os timeouts de rede são
+  encurtados até ele; esgotado o prazo, as chamadas seguintes falham na hora.
+- Disjuntor (circuit breaker) por serviço: depois de uma sequência de falhas transitórias o circuito
+  abre e as chamadas falham na hora, sem ocupar threads dormindo, até passar o tempo de espera.
+  Então uma única chamada de teste decide se ele fecha de novo ou continua aberto.
+"""
+
+import contextlib
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from metrics import get_metricas
+from rate_limiter import erro_de_cota
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+STATUS_TRANSITORIOS = frozenset({408, 429, 500, 502, 503, 504})
+# Exceções reconhecidas pelo nome (SDK Gemini / google.api_core, requests, urllib3) sem importar os pacotes
+NOMES_TRANSITORIOS = frozenset({
+    'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout', 'BadGateway', 'Aborted',
+    'Timeout', 'ConnectTimeout', 'ReadTimeout', 'ConnectionError', 'ChunkedEncodingError', 'ProtocolError',
+    'IncompleteRead', 'RemoteDisconnected',
+})
+
+PRAZO_DENUNCIA_PADRAO_S = float(os.environ.get("KRATERAS_PRAZO_DENUNCIA_S", 180))
+
+# Serviço: (tentativas, base do backoff em s, teto do backoff em s)
+POLITICAS_PADRAO = {
+    "gemini": (3, 1.0, 8.0),
+    "geocoding": (3, 0.3, 4.0),
+    "viacep": (3, 0.3, 4.0),
+}
+DISJUNTOR_FALHAS_PADRAO = int(os.environ.get("KRATERAS_DISJUNTOR_FALHAS", 5))
+DISJUNTOR_ABERTO_S_PADRAO = float(os.environ.get("KRATERAS_DISJUNTOR_ABERTO_S", 30))
+
+
+class ErroTransitorio(Exception):
+    """Levantada pelas chamadas para pedir nova tentativa (ex.: HTTP 503, OVER_QUERY_LIMIT)."""
+
+    def __init__(self, mensagem: str, cota: bool = False, espera_sugerida: float = 0.0):
+        super().__init__(mensagem)
+        self.cota = cota
+        self.espera_sugerida = espera_sugerida
+
+
+class ServicoIndisponivel(Exception):
+    """Circuito aberto: o serviço falhou seguidamente e as chamadas estão sendo recusadas sem tentar."""
+
+    def __init__(self, servico: str, reabre_em_s: float):
+        super().__init__(f"Serviço '{servico}' indisponível no momento (circuito aberto); nova tentativa em {reabre_em_s:.0f}s.")
+        self.servico = servico
+        self.reabre_em_s = reabre_em_s
+
+
+class PrazoEsgotado(TimeoutError):
+    """O prazo da denúncia acabou antes da chamada."""
+
+
+def classificar_erro(e: BaseException) -> str:
+    """'cota', 'transitorio' ou 'permanente'. Exceções desconhecidas são permanentes (não adianta repetir um bug)."""
+    if isinstance(e, ErroTransitorio):
+        return 'cota' if e.cota else 'transitorio'
+    if erro_de_cota(e):
+        return 'cota'
+    codigo = getattr(e, 'code', None)
+    if not isinstance(codigo, int):
+        codigo = getattr(getattr(e, 'response', None), 'status_code', None)
+    if isinstance(codigo, int) and codigo >= 400:
+        return 'transitorio' if codigo in STATUS_TRANSITORIOS else 'permanente'
+    if isinstance(e, (TimeoutError, ConnectionError)) or type(e).__name__ in NOMES_TRANSITORIOS:
+        return 'transitorio'
+    return 'permanente'
+
+
+def verificar_status(resposta: Any, servico: str) -> None:
+    """`raise_for_status` que transforma 429/5xx em `ErroTransitorio` (respeitando o Retry-After em segundos)."""
+    status = resposta.status_code
+    if status in STATUS_TRANSITORIOS:
+        try: espera = float(resposta.headers.get('Retry-After', 0))
+        except (TypeError, ValueError): espera = 0.0
+        raise ErroTransitorio(f"{servico} respondeu HTTP {status}.", cota=status == 429, espera_sugerida=espera)
+    resposta.raise_for_status()
+
+
+class Prazo:
+    """Orçamento de tempo de uma denúncia, compartilhado por todas as etapas e chamadas dela."""
+
+    def __init__(self, segundos: float):
+        self.segundos = float(segundos)
+        self.fim = time.monotonic() + self.segundos
+
+    def restante(self) -> float:
+        return max(0.0, self.fim - time.monotonic())
+
+    def esgotado(self) -> bool:
+        return time.monotonic() >= self.fim
+
+
+_prazo_atual: contextvars.ContextVar[Optional[Prazo]] = contextvars.ContextVar("krateras_prazo", default=None)
+
+
+def prazo_atual() -> Optional[Prazo]:
+    return _prazo_atual.get()
+
+
+@contextlib.contextmanager
+def com_prazo(segundos: Optional[float]) -> Iterator[Optional[Prazo]]:
+    """
+    Define o prazo da denúncia para o bloco (e para as threads iniciadas com uma cópia do contexto).
+    Um prazo já ativo que termina antes prevalece; `segundos` None mantém o atual.
+    """
+    atual = _prazo_atual.get()
+    if segundos is None or (atual is not None and atual.restante() <= segundos):
+        yield atual
+        return
+    token = _prazo_atual.set(Prazo(segundos))
+    try:
+        yield _prazo_atual.get()
+    finally:
+        _prazo_atual.reset(token)
+
+
+def limitar_timeout(timeout: Any) -> Any:
+    """Encurta um timeout (número ou tupla conexão/leitura do requests) para caber no prazo da denúncia."""
+    prazo = _prazo_atual.get()
+    if prazo is None:
+        return timeout
+    restante = max(prazo.restante(), 0.001)
+    if timeout is None:
+        return restante
+    if isinstance(timeout, tuple):
+        return tuple(min(t, restante) if t is not None else restante for t in timeout)
+    return min(timeout, restante)
+
+
+class Disjuntor:
+    """
+    Circuit breaker de um serviço. Fechado: tudo passa. Aberto (após `limite_falhas` falhas transitórias
+    seguidas): tudo é recusado com `ServicoIndisponivel`. Meio aberto (passado `tempo_aberto_s`): uma
+    chamada de teste passa; sucesso fecha o circuito, falha o reabre.
+    """
+
+    FECHADO, ABERTO, MEIO_ABERTO = 'fechado', 'aberto', 'meio_aberto'
+
+    def __init__(self, nome: str, limite_falhas: int = DISJUNTOR_FALHAS_PADRAO, tempo_aberto_s: float = DISJUNTOR_ABERTO_S_PADRAO):
+        self.nome = nome
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto_s = tempo_aberto_s
+        self.estado = self.FECHADO
+        self.falhas_seguidas = 0
+        self.recusadas = 0
+        self.aberturas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def _mudar(self, estado: str) -> None:
+        self.estado = estado
+        get_metricas().incrementar("krateras_disjuntor_transicoes_total", ajuda="Mudanças de estado dos disjuntores por serviço.",
+                                   servico=self.nome, estado=estado)
+        log = logger.warning if estado == self.ABERTO else logger.info
+        log(f"Disjuntor '{self.nome}' agora {estado}.")
+
+    def permitir(self) -> None:
+        """Levanta `ServicoIndisponivel` se a chamada não deve ser feita agora."""
+        with self._lock:
+            if self.estado == self.ABERTO:
+                decorrido = time.monotonic() - self._aberto_em
+                if decorrido < self.tempo_aberto_s:
+                    self.recusadas += 1
+                    raise ServicoIndisponivel(self.nome, self.tempo_aberto_s - decorrido)
+                self._mudar(self.MEIO_ABERTO)
+                self._teste_em_andamento = False
+            if self.estado == self.MEIO_ABERTO:
+                if self._teste_em_andamento:
+                    self.recusadas += 1
+                    raise ServicoIndisponivel(self.nome, 0.0)
+                self._teste_em_andamento = True
+
+    def registrar(self, resultado: str) -> None:
+        """Resultado da chamada permitida: 'ok' e 'permanente' mostram o serviço de pé; 'transitorio' conta como falha; 'cota' é neutro."""
+        with self._lock:
+            self._teste_em_andamento = False
+            if resultado in ('ok', 'permanente'):
+                self.falhas_seguidas = 0
+                if self.estado != self.FECHADO: self._mudar(self.FECHADO)
+            elif resultado == 'transitorio':
+                self.falhas_seguidas += 1
+                if self.estado == self.MEIO_ABERTO or (self.estado == self.FECHADO and self.falhas_seguidas >= self.limite_falhas):
+                    self._aberto_em = time.monotonic()
+                    self.aberturas += 1
+                    self._mudar(self.ABERTO)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"servico": self.nome, "estado": self.estado, "falhas_seguidas": self.falhas_seguidas,
+                    "aberturas": self.aberturas, "recusadas": self.recusadas}
+
+
+class PoliticaRetentativa:
+    """Backoff exponencial com jitter completo: espera sorteada entre 0 e min(teto, base * 2^tentativa)."""
+
+    def __init__(self, max_tentativas: int = 3, base_s: float = 0.5, max_espera_s: float = 8.0):
+        self.max_tentativas = max(1, int(max_tentativas))
+        self.base_s = base_s
+        self.max_espera_s = max_espera_s
+
+    def espera(self, tentativa: int) -> float:
+        return random.uniform(0, min(self.max_espera_s, self.base_s * 2 ** tentativa))
+
+
+_disjuntores: Dict[str, Disjuntor] = {}
+_politicas: Dict[str, PoliticaRetentativa] = {}
+_registro_lock = threading.Lock()
+
+
+def get_disjuntor(servico: str) -> Disjuntor:
+    """Disjuntor único por processo para o serviço ('gemini', 'geocoding', 'viacep')."""
+    with _registro_lock:
+        if servico not in _disjuntores:
+            _disjuntores[servico] = Disjuntor(servico)
+        return _disjuntores[servico]
+
+
+def get_politica(servico: str) -> PoliticaRetentativa:
+    with _registro_lock:
+        if servico not in _politicas:
+            _politicas[servico] = PoliticaRetentativa(*POLITICAS_PADRAO.get(servico, (3, 0.5, 8.0)))
+        return _politicas[servico]
+
+
+def estatisticas_disjuntores() -> List[Dict[str, Any]]:
+    with _registro_lock:
+        disjuntores = list(_disjuntores.values())
+    return [d.stats() for d in disjuntores]
+
+
+def _contar(servico: str, resultado: str) -> None:
+    get_metricas().incrementar("krateras_chamadas_externas_total", ajuda="Tentativas de chamadas externas por serviço e resultado.",
+                               servico=servico, resultado=resultado)
+
+
+def chamar(servico: str, fn: Callable[[], T], politica: Optional[PoliticaRetentativa] = None,
+           classificar: Callable[[BaseException], str] = classificar_erro) -> T:
+    """
+    Executa `fn()` com o disjuntor do serviço, retentativas para erros transitórios e o prazo da denúncia.
+    Levanta `ServicoIndisponivel` (circuito aberto), `PrazoEsgotado` ou o último erro de `fn`.
+    """
+    politica = politica or get_politica(servico)
+    disjuntor = get_disjuntor(servico)
+    prazo = _prazo_atual.get()
+    for tentativa in range(politica.max_tentativas):
+        if prazo is not None and prazo.esgotado():
+            _contar(servico, 'prazo')
+            raise PrazoEsgotado(f"Prazo da denúncia ({prazo.segundos:g}s) esgotado antes da chamada a '{servico}'.")
+        try:
+            disjuntor.permitir()
+        except ServicoIndisponivel:
+            _contar(servico, 'recusada')
+            raise
+        try:
+            resultado = fn()
+        except PrazoEsgotado:
+            disjuntor.registrar('cota')  # neutro: o prazo acabou antes de chamar o serviço (ex.: na fila do limitador)
+            _contar(servico, 'prazo')
+            raise
+        except BaseException as e:
+            tipo = classificar(e) if isinstance(e, Exception) else 'cota'  # KeyboardInterrupt etc.: só libera o teste
+            disjuntor.registrar(tipo)
+            _contar(servico, tipo)
+            if tipo == 'permanente' or not isinstance(e, Exception) or tentativa == politica.max_tentativas - 1:
+                raise
+            espera = max(politica.espera(tentativa), getattr(e, 'espera_sugerida', 0.0) or 0.0)
+            if prazo is not None and espera >= prazo.restante():
+                logger.warning(f"'{servico}' falhou ({tipo}) e não há prazo para nova tentativa: {e}")
+                raise
+            logger.warning(f"'{servico}' falhou ({tipo}) na tentativa {tentativa + 1}/{politica.max_tentativas}; nova tentativa em {espera:.2f}s: {e}")
+            time.sleep(espera)
+            continue
+        disjuntor.registrar('ok')
+        _contar(servico, 'ok')
+        return resultado
+    raise AssertionError("inalcançável")  # o laço sempre retorna ou levanta
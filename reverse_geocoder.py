@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Geocodificação reversa local: rua, bairro, município e UF mais próximos de uma coordenada,
+a partir de um extrato regional do OpenStreetMap, sem nenhuma API externa.
+
+O extrato (.osm, .osm.bz2 ou .osm.gz) é convertido uma única vez num arquivo binário compacto
+de arrays, lido com mmap (ordem de bytes nativa; ver `MAGIC`):
+
+    cabeçalho : b"KRUASIX1" + n_segmentos, n_celulas, n_lista, n_textos (uint32) + passo_lat, passo_lon (float64)
+    chaves    : n_celulas x uint64   células não vazias da grade (linha << 32 | coluna), ordenadas
+    inicios   : (n_celulas + 1) x uint32   início de cada célula em `lista` (CSR)
+    lista     : n_lista x uint32   segmentos de cada célula
+    coords    : n_segmentos x 4 float32   lat1, lon1, lat2, lon2
+    rotulos   : n_segmentos x 4 uint32    textos de rua, bairro, município e UF
+    textos    : (n_textos + 1) x uint32 de offsets + UTF-8 (texto 0 é vazio)
+
+Cada segmento de rua (dois nós consecutivos de uma via nomeada) fica em todas as células da grade
+que o seu retângulo toca. Uma consulta faz uma busca binária por linha da grade ao redor do ponto e mede
+a distância até os segmentos delas: dezenas de microssegundos, sem carregar o arquivo em memória.
+Bairro, município e UF são resolvidos na construção, pelos limites administrativos do extrato
+(admin_level 10/9, 8 e 4), com os nós `place=*` mais próximos como reserva.
+"""
+
+import bisect
+import bz2
+import gzip
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from settings import data_path
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"KRUASIX1"
+_HEADER = struct.Struct("<8sIIIIdd")
+METROS_POR_GRAU_LAT = 111_320.0
+DEFAULT_TAMANHO_CELULA_M = 100.0
+DEFAULT_RAIO_M = 150.0
+
+# Vias em que um buraco faz sentido (exclui calçadas, trilhas, ciclovias isoladas etc.)
+TIPOS_VIA = frozenset({
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link', 'secondary', 'secondary_link',
+    'tertiary', 'tertiary_link', 'unclassified', 'residential', 'living_street', 'service', 'road', 'pedestrian', 'busway',
+})
+NIVEIS_ADMIN = {'4': 'uf', '8': 'municipio', '9': 'bairro', '10': 'bairro'}
+LUGARES = {'suburb': 'bairro', 'neighbourhood': 'bairro', 'quarter': 'bairro',
+           'city': 'municipio', 'town': 'municipio', 'village': 'municipio', 'municipality': 'municipio'}
+RAIO_LUGAR_GRAUS = {'bairro': 0.03, 'municipio': 0.15}  # distância máxima até um nó place=* de reserva
+_FAIXA_GRAUS = 0.001      # faixas de latitude das arestas dos limites (teste de ponto no polígono)
+_CELULA_LIMITE_GRAUS = 0.05
+
+Segmento = Tuple[float, float, float, float, str, str, str, str]  # lat1, lon1, lat2, lon2, rua, bairro, município, uf
+
+
+def _chave(linha: int, coluna: int) -> int:
+    return (linha << 32) | (coluna & 0xFFFFFFFF)
+
+
+def construir_indice(segmentos: Iterable[Segmento], caminho_saida: str, tamanho_celula_m: float = DEFAULT_TAMANHO_CELULA_M) -> int:
+    """Grava o índice binário a partir de segmentos (lat1, lon1, lat2, lon2, rua, bairro, município, uf). Retorna quantos."""
+    coords, rotulos = array('f'), array('I')
+    textos: Dict[str, int] = {'': 0}
+    for lat1, lon1, lat2, lon2, *nomes in segmentos:
+        coords.extend((lat1, lon1, lat2, lon2))
+        rotulos.extend(textos.setdefault((n or '').strip(), len(textos)) for n in nomes)
+    n = len(coords) // 4
+    lat_media = sum(coords[i] + coords[i + 2] for i in range(0, len(coords), 4)) / (2 * n) if n else 0.0
+    passo_lat = tamanho_celula_m / METROS_POR_GRAU_LAT
+    passo_lon = passo_lat / max(math.cos(math.radians(lat_media)), 0.01)
+
+    celulas: Dict[int, List[int]] = {}
+    for i in range(n):
+        lat1, lon1, lat2, lon2 = coords[4 * i:4 * i + 4]
+        for linha in range(int((min(lat1, lat2) + 90) // passo_lat), int((max(lat1, lat2) + 90) // passo_lat) + 1):
+            for coluna in range(int((min(lon1, lon2) + 180) // passo_lon), int((max(lon1, lon2) + 180) // passo_lon) + 1):
+                celulas.setdefault(_chave(linha, coluna), []).append(i)
+    chaves = array('Q', sorted(celulas))
+    inicios, lista = array('I', [0]), array('I')
+    for chave in chaves:
+        lista.extend(celulas[chave])
+        inicios.append(len(lista))
+
+    ordem = sorted(textos, key=textos.get)
+    blob = [t.encode('utf-8') for t in ordem]
+    offsets, pos = array('I', [0]), 0
+    for b in blob:
+        pos += len(b)
+        offsets.append(pos)
+
+    tmp = caminho_saida + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, n, len(chaves), len(lista), len(ordem), passo_lat, passo_lon))
+        for parte in (chaves, inicios, lista, coords, rotulos, offsets):
+            f.write(parte.tobytes())
+        f.write(b''.join(blob))
+    os.replace(tmp, caminho_saida)  # troca atômica: leitores antigos continuam no mmap anterior
+    logger.info(f"Índice de ruas gravado em {caminho_saida}: {n} segmentos, {len(chaves)} células, {len(ordem)} nomes.")
+    return n
+
+
+class ReverseGeocoder:
+    """
+    Consulta (lat, lon) -> rua/bairro/município/UF sobre o índice mmap. Segura entre threads (só leitura).
+    """
+
+    def __init__(self, caminho_indice: str):
+        self.caminho_indice = caminho_indice
+        self._mm: Optional[mmap.mmap] = None
+        self.n_segmentos = 0
+        if os.path.exists(caminho_indice) and os.path.getsize(caminho_indice) >= _HEADER.size:
+            self._abrir()
+
+    def _abrir(self) -> None:
+        with open(self.caminho_indice, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_seg, n_cel, n_lista, n_txt, self.passo_lat, self.passo_lon = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or sys.byteorder != 'little':
+            mm.close()
+            logger.error(f"Arquivo {self.caminho_indice} não é um índice de ruas válido para esta plataforma; ignorado.")
+            return
+        visao, pos = memoryview(mm), _HEADER.size
+
+        def _secao(formato: str, quantidade: int) -> memoryview:
+            nonlocal pos
+            tamanho = quantidade * struct.calcsize(formato)
+            secao = visao[pos:pos + tamanho].cast(formato)
+            pos += tamanho
+            return secao
+
+        self._chaves = _secao('Q', n_cel)
+        self._inicios = _secao('I', n_cel + 1)
+        self._lista = _secao('I', n_lista)
+        self._coords = _secao('f', 4 * n_seg)
+        self._rotulos = _secao('I', 4 * n_seg)
+        self._offsets = _secao('I', n_txt + 1)
+        self._inicio_textos = pos
+        self._mm, self.n_segmentos = mm, n_seg
+
+    @property
+    def disponivel(self) -> bool:
+        return self._mm is not None and self.n_segmentos > 0
+
+    def _texto(self, i: int) -> str:
+        ini = self._inicio_textos
+        return self._mm[ini + self._offsets[i]:ini + self._offsets[i + 1]].decode('utf-8')
+
+    def _segmentos_da_faixa(self, linha: int, coluna_ini: int, coluna_fim: int) -> Iterator[int]:
+        """Segmentos das células [coluna_ini, coluna_fim] de uma linha: uma busca binária e uma varredura contígua."""
+        chaves, fim = self._chaves, _chave(linha, coluna_fim)
+        i = bisect.bisect_left(chaves, _chave(linha, coluna_ini))
+        while i < len(chaves) and chaves[i] <= fim:
+            yield from self._lista[self._inicios[i]:self._inicios[i + 1]]
+            i += 1
+
+    def buscar(self, lat: float, lon: float, raio_max_m: float = DEFAULT_RAIO_M) -> Optional[Dict[str, Any]]:
+        """Segmento de rua mais próximo a até `raio_max_m`: {rua, bairro, municipio, uf, distancia_m}, ou None."""
+        if not self.disponivel:
+            return None
+        k_lat = METROS_POR_GRAU_LAT
+        k_lon = METROS_POR_GRAU_LAT * math.cos(math.radians(lat))
+        linha, coluna = int((lat + 90) // self.passo_lat), int((lon + 180) // self.passo_lon)
+        alcance_lin = math.ceil(raio_max_m / (self.passo_lat * k_lat))
+        alcance_col = math.ceil(raio_max_m / (self.passo_lon * k_lon))
+        melhor, melhor_d2, vistos = -1, raio_max_m * raio_max_m, set()
+        c = self._coords
+        for dl in range(-alcance_lin, alcance_lin + 1):
+            for s in self._segmentos_da_faixa(linha + dl, coluna - alcance_col, coluna + alcance_col):
+                if s in vistos: continue
+                vistos.add(s)
+                # Plano local em metros com origem no ponto consultado
+                ay, ax = (c[4 * s] - lat) * k_lat, (c[4 * s + 1] - lon) * k_lon
+                by, bx = (c[4 * s + 2] - lat) * k_lat, (c[4 * s + 3] - lon) * k_lon
+                dy, dx = by - ay, bx - ax
+                comp2 = dx * dx + dy * dy
+                t = 0.0 if comp2 == 0 else min(1.0, max(0.0, -(ax * dx + ay * dy) / comp2))
+                py, px = ay + t * dy, ax + t * dx
+                if (d2 := px * px + py * py) < melhor_d2:
+                    melhor, melhor_d2 = s, d2
+        if melhor < 0:
+            return None
+        rua, bairro, municipio, uf = (self._texto(self._rotulos[4 * melhor + k]) for k in range(4))
+        return {"rua": rua, "bairro": bairro, "municipio": municipio, "uf": uf, "distancia_m": round(math.sqrt(melhor_d2), 1)}
+
+
+# --- Construção a partir de um extrato OSM -------------------------------------------------------
+
+def _abrir_extrato(caminho: str):
+    if caminho.endswith('.bz2'): return bz2.open(caminho, 'rb')
+    if caminho.endswith('.gz'): return gzip.open(caminho, 'rb')
+    if caminho.endswith('.pbf'):
+        raise ValueError("Extratos .pbf não são lidos diretamente; converta com `osmium cat extrato.osm.pbf -o extrato.osm.bz2`.")
+    return open(caminho, 'rb')
+
+
+def _elementos(caminho: str, tipos: Tuple[str, ...] = ('node', 'way', 'relation')) -> Iterator[Tuple[str, ET.Element]]:
+    """Elementos de primeiro nível do XML OSM, em streaming (memória constante por elemento)."""
+    with _abrir_extrato(caminho) as f:
+        contexto = ET.iterparse(f, events=('start', 'end'))
+        _, raiz = next(contexto)
+        profundidade = 0
+        for evento, el in contexto:
+            if evento == 'start':
+                profundidade += 1
+                continue
+            profundidade -= 1
+            if profundidade == 0:
+                if el.tag in tipos:
+                    yield el.tag, el
+                raiz.clear()
+
+
+def _tags(el: ET.Element) -> Dict[str, str]:
+    return {t.get('k'): t.get('v') for t in el.iter('tag')}
+
+
+class _Limite:
+    """Polígono de um limite administrativo, com as arestas agrupadas em faixas de latitude."""
+
+    def __init__(self, campo: str, nome: str, aneis: List[List[Tuple[float, float]]]):
+        self.campo, self.nome = campo, nome
+        lats = [p[0] for a in aneis for p in a]
+        lons = [p[1] for a in aneis for p in a]
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        self.area = (self.bbox[2] - self.bbox[0]) * (self.bbox[3] - self.bbox[1])
+        self.faixas: Dict[int, List[Tuple[float, float, float, float]]] = {}
+        for anel in aneis:
+            for (y1, x1), (y2, x2) in zip(anel, anel[1:] + anel[:1]):
+                for f in range(int(min(y1, y2) // _FAIXA_GRAUS), int(max(y1, y2) // _FAIXA_GRAUS) + 1):
+                    self.faixas.setdefault(f, []).append((y1, x1, y2, x2))
+
+    def contem(self, lat: float, lon: float) -> bool:
+        if not (self.bbox[0] <= lat <= self.bbox[2] and self.bbox[1] <= lon <= self.bbox[3]):
+            return False
+        dentro = False
+        for y1, x1, y2, x2 in self.faixas.get(int(lat // _FAIXA_GRAUS), ()):
+            if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                dentro = not dentro
+        return dentro
+
+
+def _montar_aneis(vias: List[List[int]], coords: Dict[int, Tuple[float, float]]) -> List[List[Tuple[float, float]]]:
+    """Junta as vias de um limite (em qualquer ordem e sentido) em anéis fechados."""
+    restantes = [v for v in vias if len(v) >= 2]
+    aneis = []
+    while restantes:
+        anel = list(restantes.pop())
+        while anel[0] != anel[-1]:
+            for i, v in enumerate(restantes):
+                if v[0] == anel[-1]: anel.extend(v[1:])
+                elif v[-1] == anel[-1]: anel.extend(reversed(v[:-1]))
+                else: continue
+                restantes.pop(i)
+                break
+            else:
+                break  # anel aberto (extrato recortado no meio do limite): fecha no início
+        pontos = [coords[n] for n in anel if n in coords]
+        if len(pontos) >= 3: aneis.append(pontos)
+    return aneis
+
+
+def ler_extrato_osm(caminho: str) -> Iterator[Segmento]:
+    """
+    Segmentos de rua nomeados do extrato, já com bairro, município e UF. Lê o XML em três passagens
+    (vias/lugares/limites, vias dos limites, coordenadas dos nós) para guardar só os nós usados.
+    """
+    vias: List[Tuple[str, array]] = []
+    nos: Set[int] = set()
+    lugares: Dict[str, List[Tuple[float, float, str]]] = {'bairro': [], 'municipio': []}
+    relacoes: List[Tuple[str, str, List[int]]] = []
+    for tipo, el in _elementos(caminho):
+        tags = _tags(el)
+        if tipo == 'node':
+            if (campo := LUGARES.get(tags.get('place', ''))) and tags.get('name'):
+                lugares[campo].append((float(el.get('lat')), float(el.get('lon')), tags['name']))
+        elif tipo == 'way':
+            if tags.get('highway') in TIPOS_VIA and tags.get('name'):
+                refs = array('q', (int(nd.get('ref')) for nd in el.iter('nd')))
+                vias.append((tags['name'], refs))
+                nos.update(refs)
+        elif tags.get('boundary') == 'administrative' and (campo := NIVEIS_ADMIN.get(tags.get('admin_level', ''))) and tags.get('name'):
+            nome = tags.get('ISO3166-2', '').split('-')[-1] if campo == 'uf' and tags.get('ISO3166-2') else tags['name']
+            membros = [int(m.get('ref')) for m in el.iter('member') if m.get('type') == 'way' and m.get('role') in ('outer', 'inner', '')]
+            relacoes.append((campo, nome, membros))
+    logger.info(f"Extrato OSM: {len(vias)} vias nomeadas, {len(relacoes)} limites administrativos, {sum(map(len, lugares.values()))} lugares.")
+
+    vias_limites: Dict[int, List[int]] = {}
+    if relacoes:
+        procuradas = {w for _, _, membros in relacoes for w in membros}
+        for _, el in _elementos(caminho, ('way',)):
+            if (wid := int(el.get('id'))) in procuradas:
+                vias_limites[wid] = [int(nd.get('ref')) for nd in el.iter('nd')]
+                nos.update(vias_limites[wid])
+
+    coords: Dict[int, Tuple[float, float]] = {}
+    for tipo, el in _elementos(caminho, ('node', 'way')):
+        if tipo == 'way': break  # no formato OSM os nós vêm antes das vias
+        if (nid := int(el.get('id'))) in nos:
+            coords[nid] = (float(el.get('lat')), float(el.get('lon')))
+
+    limites = [_Limite(campo, nome, aneis) for campo, nome, membros in relacoes
+               if (aneis := _montar_aneis([vias_limites[w] for w in membros if w in vias_limites], coords))]
+    limites.sort(key=lambda l: l.area)  # o menor limite que contém o ponto vence (bairro dentro de distrito)
+    grade: Dict[Tuple[int, int], List[_Limite]] = {}
+    for lim in limites:
+        for i in range(int(lim.bbox[0] // _CELULA_LIMITE_GRAUS), int(lim.bbox[2] // _CELULA_LIMITE_GRAUS) + 1):
+            for j in range(int(lim.bbox[1] // _CELULA_LIMITE_GRAUS), int(lim.bbox[3] // _CELULA_LIMITE_GRAUS) + 1):
+                grade.setdefault((i, j), []).append(lim)
+
+    def _rotulo(campo: str, lat: float, lon: float) -> str:
+        for lim in grade.get((int(lat // _CELULA_LIMITE_GRAUS), int(lon // _CELULA_LIMITE_GRAUS)), ()):
+            if lim.campo == campo and lim.contem(lat, lon): return lim.nome
+        if campo == 'uf': return ''
+        raio = RAIO_LUGAR_GRAUS[campo]
+        perto = [(abs(la - lat) + abs(lo - lon), nome) for la, lo, nome in lugares[campo] if abs(la - lat) < raio and abs(lo - lon) < raio]
+        return min(perto)[1] if perto else ''
+
+    for nome, refs in vias:
+        pontos = [coords[n] for n in refs if n in coords]
+        if len(pontos) < 2: continue
+        lat_m, lon_m = pontos[len(pontos) // 2]
+        bairro, municipio, uf = _rotulo('bairro', lat_m, lon_m), _rotulo('municipio', lat_m, lon_m), _rotulo('uf', lat_m, lon_m)
+        for (lat1, lon1), (lat2, lon2) in zip(pontos, pontos[1:]):
+            if (lat1, lon1) != (lat2, lon2):
+                yield lat1, lon1, lat2, lon2, nome, bairro, municipio, uf
+
+
+_geocoder: Optional[ReverseGeocoder] = None
+_geocoder_lock = threading.Lock()
+
+
+def get_reverse_geocoder() -> ReverseGeocoder:
+    """Geocodificador reverso único por processo (índice em KRATERAS_RUAS_INDEX_PATH ou na base local)."""
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            _geocoder = ReverseGeocoder(os.environ.get("KRATERAS_RUAS_INDEX_PATH", data_path("ruas_index.bin")))
+        return _geocoder
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Configurações compartilhadas do Krateras (diretório de dados locais, caches e índices).
+"""
+
+import os
+
+# Diretório raiz para caches e bases locais. Pode ser sobrescrito via variável de ambiente.
+DATA_DIR = os.environ.get(
+    "KRATERAS_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".krateras_data")
+)
+
+
+def data_path(nome: str) -> str:
+    """Retorna o caminho de um arquivo dentro de DATA_DIR, criando o diretório se necessário."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, nome)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Índice espacial em grade para agrupar denúncias do mesmo buraco.
+
+Os pontos ficam em células de tamanho fixo (em graus de latitude), cada célula com arrays
+compactos de lat/lon/timestamp/cluster. "Denúncias a até R metros nos últimos N dias" só
+examina as poucas células que cobrem o círculo, então o custo não depende do total de pontos.
+Pontos e clusters são persistidos em SQLite e recarregados na inicialização.
+"""
+
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from settings import data_path
+
+logger = logging.getLogger(__name__)
+
+METROS_POR_GRAU_LAT = 111_320.0
+DEFAULT_TAMANHO_CELULA_M = 50.0
+DEFAULT_RAIO_M = 15.0
+DEFAULT_JANELA_DIAS = 30
+
+
+def distancia_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distância haversine em metros."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6_371_000.0 * math.asin(math.sqrt(a))
+
+
+class _Celula:
+    __slots__ = ("lat", "lon", "ts", "cluster", "ids")
+
+    def __init__(self):
+        self.lat, self.lon, self.ts = array('d'), array('d'), array('d')
+        self.cluster: List[str] = []
+        self.ids: List[str] = []
+
+
+class SpatialIndex:
+    """
+    Grade de células + clusters de denúncias, segura para uso entre threads.
+    """
+
+    def __init__(self, db_path: str, tamanho_celula_m: float = DEFAULT_TAMANHO_CELULA_M):
+        self.passo = tamanho_celula_m / METROS_POR_GRAU_LAT
+        self._celulas: Dict[Tuple[int, int], _Celula] = {}
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pontos (
+                id_denuncia TEXT PRIMARY KEY,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                ts REAL NOT NULL,
+                cluster_id TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS clusters (
+                cluster_id TEXT PRIMARY KEY,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                criado_em REAL NOT NULL,
+                atualizado_em REAL NOT NULL,
+                n_denuncias INTEGER NOT NULL,
+                resultado_ia TEXT
+            )"""
+        )
+        for id_den, lat, lon, ts, cluster_id in self._conn.execute("SELECT id_denuncia, lat, lon, ts, cluster_id FROM pontos"):
+            self._inserir_memoria(id_den, lat, lon, ts, cluster_id)
+
+    def _celula_de(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.passo)), int(math.floor(lon / self.passo))
+
+    def _inserir_memoria(self, id_den: str, lat: float, lon: float, ts: float, cluster_id: str) -> None:
+        cel = self._celulas.setdefault(self._celula_de(lat, lon), _Celula())
+        cel.lat.append(lat); cel.lon.append(lon); cel.ts.append(ts)
+        cel.cluster.append(cluster_id); cel.ids.append(id_den)
+
+    def __len__(self) -> int:
+        return sum(len(c.ids) for c in self._celulas.values())
+
+    def buscar_raio(self, lat: float, lon: float, raio_m: float, desde_ts: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Denúncias a até `raio_m` metros (e com timestamp >= desde_ts), da mais próxima à mais distante."""
+        d_lat = raio_m / METROS_POR_GRAU_LAT
+        d_lon = raio_m / (METROS_POR_GRAU_LAT * max(math.cos(math.radians(lat)), 1e-6))
+        i0, j0 = self._celula_de(lat - d_lat, lon - d_lon)
+        i1, j1 = self._celula_de(lat + d_lat, lon + d_lon)
+        achados = []
+        with self._lock:
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    cel = self._celulas.get((i, j))
+                    if cel is None: continue
+                    for k in range(len(cel.ids)):
+                        if desde_ts is not None and cel.ts[k] < desde_ts: continue
+                        if abs(cel.lat[k] - lat) > d_lat or abs(cel.lon[k] - lon) > d_lon: continue
+                        d = distancia_m(lat, lon, cel.lat[k], cel.lon[k])
+                        if d <= raio_m:
+                            achados.append({"id_denuncia": cel.ids[k], "cluster_id": cel.cluster[k], "distancia_m": round(d, 2),
+                                            "lat": cel.lat[k], "lon": cel.lon[k], "ts": cel.ts[k]})
+        return sorted(achados, key=lambda a: a["distancia_m"])
+
+    def agrupar(self, id_denuncia: str, lat: float, lon: float, ts: Optional[float] = None,
+                raio_m: float = DEFAULT_RAIO_M, janela_dias: float = DEFAULT_JANELA_DIAS) -> Dict[str, Any]:
+        """
+        Registra a denúncia e a anexa ao cluster da denúncia mais próxima dentro do raio/janela,
+        ou cria um cluster novo. Retorna {cluster_id, novo, n_denuncias, distancia_m, resultado_ia}.
+        """
+        ts = ts if ts is not None else time.time()
+        agora = time.time()
+        with self._lock:
+            vizinhos = [v for v in self.buscar_raio(lat, lon, raio_m, ts - janela_dias * 86400) if v["id_denuncia"] != id_denuncia]
+            existente = self._conn.execute("SELECT cluster_id FROM pontos WHERE id_denuncia = ?", (id_denuncia,)).fetchone()
+            if existente:
+                # Reenvio/nova tentativa da mesma denúncia: quem fundou o cluster continua sendo "novo"
+                cluster_id = existente[0]
+                novo, distancia = cluster_id == id_denuncia, None
+            elif vizinhos:
+                cluster_id, novo, distancia = vizinhos[0]["cluster_id"], False, vizinhos[0]["distancia_m"]
+            else:
+                cluster_id, novo, distancia = id_denuncia, True, None
+            if not existente:
+                self._conn.execute("INSERT INTO pontos (id_denuncia, lat, lon, ts, cluster_id) VALUES (?, ?, ?, ?, ?)",
+                                   (id_denuncia, lat, lon, ts, cluster_id))
+                self._inserir_memoria(id_denuncia, lat, lon, ts, cluster_id)
+                if novo:
+                    self._conn.execute("INSERT INTO clusters (cluster_id, lat, lon, criado_em, atualizado_em, n_denuncias) VALUES (?, ?, ?, ?, ?, 1)",
+                                       (cluster_id, lat, lon, agora, agora))
+                else:
+                    self._conn.execute("UPDATE clusters SET n_denuncias = n_denuncias + 1, atualizado_em = ? WHERE cluster_id = ?",
+                                       (agora, cluster_id))
+            n, resultado_ia = self._conn.execute("SELECT n_denuncias, resultado_ia FROM clusters WHERE cluster_id = ?", (cluster_id,)).fetchone()
+        return {"cluster_id": cluster_id, "novo": novo, "n_denuncias": n, "distancia_m": distancia,
+                "resultado_ia": json.loads(resultado_ia) if resultado_ia else None}
+
+    def salvar_resultado_cluster(self, cluster_id: str, resultado_ia: Dict[str, Any]) -> None:
+        """Guarda as análises de IA de referência do cluster, reaproveitadas pelas próximas denúncias dele."""
+        with self._lock:
+            self._conn.execute("UPDATE clusters SET resultado_ia = ?, atualizado_em = ? WHERE cluster_id = ?",
+                               (json.dumps(resultado_ia, ensure_ascii=False), time.time(), cluster_id))
+
+
+_index: Optional[SpatialIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_spatial_index() -> SpatialIndex:
+    """Índice espacial único por processo."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SpatialIndex(os.environ.get("KRATERAS_SPATIAL_INDEX_PATH", data_path("spatial_index.sqlite3")))
+        return _index
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# Os módulos do Krateras ficam na raiz do repositório (sem pacote): deixa-os importáveis nos testes
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Leitura offline de coordenadas: decimais, DMS, plus codes, links de mapa e URIs geo:."""
+
+import pytest
+
+from location_parser import (
+    TIPO_COORDENADAS_LINK, TIPO_COORDENADAS_MANUAIS, decodificar_plus_code, extrair_localizacao, tem_plus_code_curto,
+)
+
+SE = (-23.5505, -46.6333)  # Praça da Sé, São Paulo
+PLUS_SE = (-23.5504375, -46.6339375)  # centro da área de 588MC9X8+RC (14 m x 14 m), na Sé
+
+
+@pytest.mark.parametrize("texto, formato, esperado", [
+    ("-23.5505, -46.6333", "decimal", SE),
+    ("-23.5505 -46.6333", "decimal", SE),
+    ("Lat: -23.5505; Long: -46.6333", "decimal", SE),
+    ("23°33'01.8\"S 46°37'59.9\"W", "dms", (-23.5505, -46.6333)),
+    ("S 23° 33.030' O 46° 37.998'", "graus_minutos", (-23.5505, -46.6333)),
+    ("46°37'59.9\"W 23°33'01.8\"S", "dms", (-23.5505, -46.6333)),
+    ("23.5505 S, 46.6333 W", "graus_hemisferio", SE),
+])
+def test_coordenadas_digitadas(texto, formato, esperado):
+    loc = extrair_localizacao(texto)
+    assert loc["formato"] == formato and loc["tipo"] == TIPO_COORDENADAS_MANUAIS
+    assert (loc["latitude"], loc["longitude"]) == pytest.approx(esperado, abs=1e-4)
+
+
+@pytest.mark.parametrize("texto, formato", [
+    ("https://www.google.com/maps/place/Pra%C3%A7a+da+S%C3%A9/@-23.55,-46.63,17z/data=!3m1!4b1!4m6!3m5!1s0x0:0x0!8m2!3d-23.5505!4d-46.6333", "google_pino"),
+    ("https://www.google.com/maps/@-23.5505,-46.6333,17z", "google_centro"),
+    ("https://maps.google.com/?q=-23.5505,-46.6333", "google_consulta"),
+    ("https://www.openstreetmap.org/?mlat=-23.5505&mlon=-46.6333#map=17/-23.55/-46.63", "osm_marcador"),
+    ("https://www.openstreetmap.org/#map=17/-23.5505/-46.6333", "osm_mapa"),
+    ("https://waze.com/ul?ll=-23.5505,-46.6333&navigate=yes", "waze"),
+    ("geo:-23.5505,-46.6333", "geo_uri"),
+    ("geo:0,0?q=-23.5505,-46.6333(Buraco)", "geo_uri_q"),
+])
+def test_links(texto, formato):
+    loc = extrair_localizacao(texto)
+    assert loc["formato"] == formato and loc["tipo"] == TIPO_COORDENADAS_LINK
+    assert (loc["latitude"], loc["longitude"]) == pytest.approx(SE)
+
+
+@pytest.mark.parametrize("texto, formato, esperado", [
+    ("https://plus.codes/588MC9X8+RC", "plus_code", PLUS_SE),
+    ("https://plus.codes/588MC9X8%2BRC", "plus_code", PLUS_SE),
+    ("https://maps.google.com/?foo -23.5505,-46.6333", "decimal", SE),
+])
+def test_link_sem_padrao_conhecido_ainda_le_plus_code_e_decimal(texto, formato, esperado):
+    loc = extrair_localizacao(texto)
+    assert loc["formato"] == formato and loc["tipo"] == TIPO_COORDENADAS_MANUAIS
+    assert (loc["latitude"], loc["longitude"]) == pytest.approx(esperado)
+
+
+def test_link_encurtado_sem_coordenadas():
+    assert extrair_localizacao("https://goo.gl/maps/AbC123xyz") is None
+
+
+def test_plus_code_completo():
+    assert decodificar_plus_code("588MC9X8+RC") == pytest.approx(PLUS_SE)
+    assert decodificar_plus_code("588MC9X8") is None
+    loc = extrair_localizacao("Buraco em 588MC9X8+RC, perto da catedral")
+    assert loc["formato"] == "plus_code"
+
+
+def test_plus_code_curto_precisa_de_referencia():
+    assert tem_plus_code_curto("C9X8+RC São Paulo")
+    assert extrair_localizacao("C9X8+RC São Paulo") is None
+    loc = extrair_localizacao("C9X8+RC São Paulo", referencia=(-23.56, -46.64))
+    assert loc["formato"] == "plus_code_curto"
+    assert (loc["latitude"], loc["longitude"]) == pytest.approx(PLUS_SE)
+
+
+@pytest.mark.parametrize("texto", [
+    "-95.0, -46.6333",                        # latitude fora de [-90, 90]
+    "-23.5505, -186.6333",                    # longitude fora de [-180, 180]
+    "geo:91.0,10.0",
+    "https://maps.google.com/?q=-23.5,200.5",
+    "23°61'00\"S 46°38'00\"W",                # minutos >= 60
+    "23°33'01\"N 46°38'00\"S",                # dois hemisférios de latitude
+])
+def test_coordenadas_invalidas_sao_descartadas(texto):
+    assert extrair_localizacao(texto) is None
+
+
+@pytest.mark.parametrize("texto", ["", "   ", None, "Rua das Flores, 123", "perto do número 42 e 43",
+                                   "Perto do poste 12 N 5 L", "buraco na frente do nº 23 S 46 O"])
+def test_texto_sem_coordenadas(texto):
+    assert extrair_localizacao(texto) is None
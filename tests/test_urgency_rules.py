@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Classificação local de urgência: regras decisivas, pontuação com margem e casos ambíguos."""
+
+import pytest
+
+from urgency_rules import ORIGEM_REGRAS, RegrasUrgencia, categoria_urgencia, urgencia_por_regras
+
+
+def _denuncia(observacoes: str = '', **carac) -> dict:
+    return {"buraco": {"caracteristicas_estruturadas": carac, "observacoes_adicionais": observacoes}}
+
+
+CRATERA_ESCOLAR = {'Tamanho Estimado': 'Crítico', 'Perigo Estimado': 'Médio', 'Profundidade Estimada': 'Médio',
+                   'Tráfego Estimado na Via': 'Muito Alto', 'Contexto da Via': ['Área Escolar']}
+DEFEITO_ESTETICO = {'Tamanho Estimado': 'Pequeno', 'Perigo Estimado': 'Baixo', 'Profundidade Estimada': 'Raso',
+                    'Tráfego Estimado na Via': 'Baixo'}
+
+
+@pytest.fixture
+def regras():
+    return RegrasUrgencia()
+
+
+def test_regra_decisiva_eleva_categoria(regras):
+    r = regras.classificar(_denuncia(**CRATERA_ESCOLAR))
+    assert r["confiante"] and r["regra"] == "cratera_em_area_sensivel"
+    assert r["categoria"] == 'Imediata/Crítica'
+
+
+def test_regra_que_eleva_ignora_observacoes(regras):
+    r = regras.classificar(_denuncia("Já houve acidente aqui ontem.", **CRATERA_ESCOLAR))
+    assert r["confiante"] and r["categoria"] == 'Imediata/Crítica'
+
+
+@pytest.mark.parametrize("perigo, pontuacao", [("Alto (risco acidente/dano sério)", 14), ("Altíssimo (risco grave iminente)", 16)])
+def test_regra_decide_com_observacoes_quando_pontuacao_ja_alcanca_a_categoria(regras, perigo, pontuacao):
+    # Rótulos como no formulário do app, onde as observações são obrigatórias
+    carac = {'Tamanho Estimado': 'Crítico (risco grave)', 'Perigo Estimado': perigo, 'Profundidade Estimada': 'Fundo',
+             'Tráfego Estimado na Via': 'Muito Alto', 'Contexto da Via': ['Área escolar']}
+    r = regras.classificar(_denuncia("Buraco perto da escola.", **carac))
+    assert r["pontuacao"] == pontuacao and r["categoria"] == 'Imediata/Crítica'
+    assert r["confiante"] and r["regra"] is not None
+    assert categoria_urgencia(urgencia_por_regras(_denuncia("Buraco perto da escola.", **carac))) == 'Imediata/Crítica'
+
+
+def test_observacoes_bloqueiam_regra_abaixo_da_pontuacao():
+    regras = RegrasUrgencia(regras_decisivas=[{"nome": "via_principal", "categoria": "Média",
+                                               "condicoes": {'Contexto da Via': ['via principal']}}])
+    carac = {'Tamanho Estimado': 'Enorme', 'Perigo Estimado': 'Alto', 'Profundidade Estimada': 'Fundo',
+             'Tráfego Estimado na Via': 'Médio', 'Contexto da Via': ['Via principal']}
+    r = regras.classificar(_denuncia("Já tem placa de sinalização.", **carac))
+    assert r["categoria"] == 'Alta' and r["regra"] == "via_principal" and not r["confiante"]
+    assert regras.classificar(_denuncia(**carac))["confiante"]
+
+
+def test_regra_baixa_decide_sem_observacoes(regras):
+    r = regras.classificar(_denuncia(**DEFEITO_ESTETICO))
+    assert r["confiante"] and r["regra"] == "defeito_estetico_via_calma" and r["categoria"] == 'Baixa'
+
+
+def test_observacoes_bloqueiam_regra_que_nao_eleva(regras):
+    r = regras.classificar(_denuncia("Motociclista caiu aqui na semana passada.", **DEFEITO_ESTETICO))
+    assert not r["confiante"]
+    assert urgencia_por_regras(_denuncia("Motociclista caiu aqui na semana passada.", **DEFEITO_ESTETICO)) is None
+
+
+def test_observacoes_nao_bloqueiam_se_desligado():
+    r = RegrasUrgencia(observacoes_bloqueiam=False).classificar(_denuncia("Qualquer coisa.", **DEFEITO_ESTETICO))
+    assert r["confiante"]
+
+
+def test_pontuacao_longe_dos_limiares_e_confiante(regras):
+    # 2 + 3 + 2 + 1 = 8: Média, mas a 1 ponto de Alta (dentro da margem) -> ambígua
+    carac = {'Tamanho Estimado': 'Grande', 'Perigo Estimado': 'Alto', 'Profundidade Estimada': 'Fundo', 'Tráfego Estimado na Via': 'Médio'}
+    assert not regras.classificar(_denuncia(**carac))["confiante"]
+    # 0 + 1 + 1 + 0.5 = 2.5: Baixa, longe de Média (5)
+    carac = {'Tamanho Estimado': 'Pequeno', 'Perigo Estimado': 'Médio', 'Profundidade Estimada': 'Médio', 'Tráfego Estimado na Via': 'Baixo'}
+    r = regras.classificar(_denuncia(**carac))
+    assert r["confiante"] and r["regra"] is None and r["categoria"] == 'Baixa' and r["pontuacao"] == 2.5
+
+
+def test_campo_obrigatorio_faltando_e_ambiguo(regras):
+    carac = {'Tamanho Estimado': 'Pequeno', 'Perigo Estimado': 'Médio', 'Profundidade Estimada': 'Selecione', 'Tráfego Estimado na Via': 'Baixo'}
+    assert not regras.classificar(_denuncia(**carac))["confiante"]
+
+
+def test_observacoes_tornam_pontuacao_ambigua(regras):
+    carac = {'Tamanho Estimado': 'Pequeno', 'Perigo Estimado': 'Médio', 'Profundidade Estimada': 'Médio', 'Tráfego Estimado na Via': 'Baixo'}
+    assert not regras.classificar(_denuncia("Fica alagado quando chove.", **carac))["confiante"]
+
+
+def test_urgencia_por_regras_gera_texto_com_categoria():
+    urgencia = urgencia_por_regras(_denuncia(**CRATERA_ESCOLAR))
+    assert urgencia["origem"] == ORIGEM_REGRAS
+    assert categoria_urgencia(urgencia) == 'Imediata/Crítica'
+
+
+def test_regra_com_categoria_invalida():
+    with pytest.raises(ValueError):
+        RegrasUrgencia(regras_decisivas=[{"nome": "x", "categoria": "Urgentíssima", "condicoes": {}}])
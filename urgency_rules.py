@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Classificação local de urgência por regras, para as denúncias que os campos do formulário já decidem.
+
+Cada opção de Tamanho, Perigo, Profundidade, Água, Tráfego e Contexto vale pontos (tabela de pesos);
+a soma cai numa faixa de categoria (limiares). O resultado só é usado sem o Gemini quando é de alta
+confiança: casou uma regra decisiva acima de 'Baixa' que a pontuação não supera (ex.: "Crítico" + "Área
+escolar" + tráfego "Muito Alto"), ou não há observações em texto livre e uma regra decisiva casou ou todos
+os campos obrigatórios foram preenchidos com a pontuação longe (margem) dos limiares vizinhos. Os demais
+casos são ambíguos e continuam indo para o Gemini.
+Pesos, limiares e regras podem ser trocados por um JSON em KRATERAS_URGENCIA_REGRAS.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import cronometrado
+
+logger = logging.getLogger(__name__)
+
+CATEGORIAS = ['Baixa', 'Média', 'Alta', 'Imediata/Crítica']
+ORIGEM_REGRAS = "regras_locais"
+
+# Chave em `caracteristicas_estruturadas` -> {rótulo curto normalizado: pontos}. Opções com texto entre
+# parênteses no formulário ("Médio (dano leve)") são comparadas só pelo rótulo antes do parêntese.
+PESOS_PADRAO: Dict[str, Dict[str, float]] = {
+    'Tamanho Estimado': {'pequeno': 0, 'médio': 1, 'grande': 2, 'enorme': 3, 'crítico': 4},
+    'Perigo Estimado': {'baixo': 0, 'médio': 1, 'alto': 3, 'altíssimo': 5},
+    'Profundidade Estimada': {'raso': 0, 'médio': 1, 'fundo': 2, 'muito fundo': 3},
+    'Presença de Água/Alagamento': {'seco': 0, 'pouca água': 0.5, 'drenagem visível': 0.5, 'muita água': 1.5},
+    'Tráfego Estimado na Via': {'muito baixo': 0, 'baixo': 0.5, 'médio': 1, 'alto': 2, 'muito alto': 3},
+    'Contexto da Via': {'curva': 1, 'cruzamento': 1, 'descida': 1, 'perto faixa pedestre': 1, 'perto semáforo/lombada': 0.5,
+                        'área escolar': 2, 'área hospitalar': 2, 'via principal': 1, 'perto pto. ônibus': 0.5, 'perto ciclovia': 1},
+}
+MAX_PONTOS_CONTEXTO = 3.0
+
+# Pontuação mínima de cada categoria (a maior que couber vence)
+LIMIARES_PADRAO: Dict[str, float] = {'Baixa': 0, 'Média': 5, 'Alta': 9, 'Imediata/Crítica': 13}
+MARGEM_PADRAO = 1.5
+CAMPOS_OBRIGATORIOS = ('Tamanho Estimado', 'Perigo Estimado', 'Profundidade Estimada', 'Tráfego Estimado na Via')
+
+# Regras decisivas: se todas as condições casam, a categoria é no mínimo a da regra, sem consultar o Gemini.
+# Cada condição é {campo: [rótulos aceitos]}; para 'Contexto da Via' basta um dos rótulos estar marcado.
+REGRAS_DECISIVAS_PADRAO: List[Dict[str, Any]] = [
+    {"nome": "cratera_em_area_sensivel", "categoria": "Imediata/Crítica",
+     "condicoes": {'Tamanho Estimado': ['crítico', 'enorme'], 'Contexto da Via': ['área escolar', 'área hospitalar'],
+                   'Tráfego Estimado na Via': ['alto', 'muito alto']}},
+    {"nome": "risco_iminente_trafego_intenso", "categoria": "Imediata/Crítica",
+     "condicoes": {'Perigo Estimado': ['altíssimo'], 'Tráfego Estimado na Via': ['alto', 'muito alto']}},
+    {"nome": "defeito_estetico_via_calma", "categoria": "Baixa",
+     "condicoes": {'Tamanho Estimado': ['pequeno'], 'Perigo Estimado': ['baixo'], 'Profundidade Estimada': ['raso'],
+                   'Tráfego Estimado na Via': ['muito baixo', 'baixo']}},
+]
+
+
+def _rotulo(valor: Any) -> str:
+    return str(valor).split('(')[0].strip().lower()
+
+
+def _preenchido(valor: Any) -> bool:
+    if isinstance(valor, list): return any(v and v != 'Selecione' for v in valor)
+    return bool(valor) and valor != 'Selecione'
+
+
+class RegrasUrgencia:
+    """
+    Tabela de pesos + limiares + regras decisivas. `classificar(denuncia)` não faz I/O (microssegundos).
+    """
+
+    def __init__(self, pesos: Optional[Dict[str, Dict[str, float]]] = None, limiares: Optional[Dict[str, float]] = None,
+                 regras_decisivas: Optional[List[Dict[str, Any]]] = None, margem: float = MARGEM_PADRAO,
+                 campos_obrigatorios: Tuple[str, ...] = CAMPOS_OBRIGATORIOS, observacoes_bloqueiam: bool = True,
+                 max_pontos_contexto: float = MAX_PONTOS_CONTEXTO):
+        self.pesos = {campo: {_rotulo(k): float(v) for k, v in tabela.items()} for campo, tabela in (pesos or PESOS_PADRAO).items()}
+        self.limiares = sorted(((float(v), c) for c, v in (limiares or LIMIARES_PADRAO).items()), reverse=True)
+        self.regras_decisivas = [{**r, "condicoes": {c: [_rotulo(v) for v in vs] for c, vs in r["condicoes"].items()}}
+                                 for r in (REGRAS_DECISIVAS_PADRAO if regras_decisivas is None else regras_decisivas)]
+        self.margem = float(margem)
+        self.campos_obrigatorios = tuple(campos_obrigatorios)
+        self.observacoes_bloqueiam = observacoes_bloqueiam
+        self.max_pontos_contexto = float(max_pontos_contexto)
+        for r in self.regras_decisivas:
+            if r["categoria"] not in CATEGORIAS: raise ValueError(f"Categoria inválida na regra '{r.get('nome')}': {r['categoria']!r}")
+
+    @classmethod
+    def de_arquivo(cls, caminho: str) -> "RegrasUrgencia":
+        """Carrega um JSON com qualquer subconjunto de: pesos, limiares, regras_decisivas, margem, campos_obrigatorios, observacoes_bloqueiam."""
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+    def _categoria(self, pontos: float) -> Tuple[str, float]:
+        """Categoria da pontuação e a distância até o limiar vizinho mais próximo."""
+        for i, (limiar, categoria) in enumerate(self.limiares):
+            if pontos >= limiar:
+                acima = self.limiares[i - 1][0] - pontos if i > 0 else float('inf')
+                abaixo = pontos - limiar if i < len(self.limiares) - 1 else float('inf')
+                return categoria, min(acima, abaixo)
+        return self.limiares[-1][1], 0.0
+
+    @staticmethod
+    def _casa(condicoes: Dict[str, List[str]], carac: Dict[str, Any]) -> bool:
+        for campo, aceitos in condicoes.items():
+            valor = carac.get(campo)
+            rotulos = {_rotulo(v) for v in valor} if isinstance(valor, list) else {_rotulo(valor)} if _preenchido(valor) else set()
+            if not rotulos & set(aceitos): return False
+        return True
+
+    def classificar(self, denuncia: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Retorna {"categoria", "pontuacao", "confiante", "regra", "motivos"}. `confiante` False significa
+        que a denúncia é ambígua para as regras e deve ir para o Gemini.
+        """
+        bur = denuncia.get('buraco', {})
+        carac = bur.get('caracteristicas_estruturadas', {}) or {}
+        pontos, motivos = 0.0, []
+        for campo, tabela in self.pesos.items():
+            valor = carac.get(campo)
+            if isinstance(valor, list):
+                soma = sum(tabela.get(_rotulo(v), 0.0) for v in valor if v)
+                if campo == 'Contexto da Via': soma = min(soma, self.max_pontos_contexto)
+                if soma: motivos.append(f"{campo}: {', '.join(valor)} (+{soma:g})")
+                pontos += soma
+            elif _preenchido(valor) and (p := tabela.get(_rotulo(valor))) is not None:
+                if p: motivos.append(f"{campo}: {valor} (+{p:g})")
+                pontos += p
+        categoria, distancia = self._categoria(pontos)
+        obs = (bur.get('observacoes_adicionais') or denuncia.get('observacoes_adicionais') or '').strip()
+        bloqueada = bool(obs) and self.observacoes_bloqueiam
+
+        for regra in self.regras_decisivas:
+            if self._casa(regra["condicoes"], carac):
+                # A categoria da regra é um piso: a pontuação ainda pode elevá-la
+                final = max(categoria, regra["categoria"], key=CATEGORIAS.index)
+                # Uma regra de urgência que a pontuação não supera decide mesmo com observações (obrigatórias no app);
+                # 'Baixa' e regras abaixo da pontuação podem ser desmentidas por elas
+                decide = regra["categoria"] != CATEGORIAS[0] and CATEGORIAS.index(regra["categoria"]) >= CATEGORIAS.index(categoria)
+                return {"categoria": final, "pontuacao": pontos, "confiante": decide or not bloqueada, "regra": regra.get("nome"), "motivos": motivos}
+
+        faltantes = [c for c in self.campos_obrigatorios if not _preenchido(carac.get(c)) or _rotulo(carac.get(c)) not in self.pesos.get(c, {})]
+        confiante = not faltantes and distancia >= self.margem and not bloqueada
+        return {"categoria": categoria, "pontuacao": pontos, "confiante": confiante, "regra": None, "motivos": motivos}
+
+
+def texto_urgencia(resultado: Dict[str, Any]) -> str:
+    """Texto no mesmo formato da sugestão do Gemini, com a marca de origem local."""
+    regra = f" (regra '{resultado['regra']}')" if resultado.get("regra") else ""
+    motivos = "; ".join(resultado["motivos"]) or "campos do formulário"
+    return (f"Categoria Sugerida: {resultado['categoria']}\n"
+            f"Justificativa: Classificada pelos campos do formulário{regra}, pontuação {resultado['pontuacao']:g}: {motivos}.\n\n"
+            f"⚙️ Origem: regras locais (sem chamada ao Gemini).")
+
+
+_RE_CATEGORIA = re.compile(r"Categoria Sugerida:\W*(" + "|".join(re.escape(c) for c in sorted(CATEGORIAS, key=len, reverse=True)) + ")", re.IGNORECASE)
+
+
+def categoria_urgencia(urgencia: Any) -> Optional[str]:
+    """Categoria ('Baixa' … 'Imediata/Crítica') do texto de urgência do Gemini ou das regras locais (ou do dict `urgencia_ia`)."""
+    texto = urgencia.get('urgencia_ia') if isinstance(urgencia, dict) else urgencia
+    achado = _RE_CATEGORIA.search(texto) if isinstance(texto, str) else None
+    return next((c for c in CATEGORIAS if c.lower() == achado.group(1).lower()), None) if achado else None
+
+
+_regras: Optional[RegrasUrgencia] = None
+_regras_lock = threading.Lock()
+
+
+def get_regras_urgencia() -> RegrasUrgencia:
+    """Regras do processo: as padrão ou as do JSON em KRATERAS_URGENCIA_REGRAS."""
+    global _regras
+    with _regras_lock:
+        if _regras is None:
+            caminho = os.environ.get("KRATERAS_URGENCIA_REGRAS")
+            _regras = RegrasUrgencia.de_arquivo(caminho) if caminho else RegrasUrgencia()
+        return _regras
+
+
+def _resultado_classificacao(retorno: Optional[Dict[str, Any]]) -> str:
+    return 'decidida' if retorno is not None else 'ambigua'
+
+
+@cronometrado("urgencia_regras", _resultado_classificacao)
+def urgencia_por_regras(denuncia: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    `urgencia_ia` pronto quando as regras decidem com confiança, ou None (caso ambíguo: usar o Gemini).
+    Desligado com KRATERAS_URGENCIA_LOCAL=0.
+    """
+    if os.environ.get("KRATERAS_URGENCIA_LOCAL", "1").lower() in ("0", "false", "nao", "não"):
+        return None
+    try:
+        resultado = get_regras_urgencia().classificar(denuncia)
+    except Exception as e:
+        logger.warning(f"Classificação de urgência por regras falhou; usando o Gemini: {e}")
+        return None
+    if not resultado["confiante"]:
+        return None
+    return {"urgencia_ia": texto_urgencia(resultado), "origem": ORIGEM_REGRAS,
+            "categoria": resultado["categoria"], "pontuacao": resultado["pontuacao"], "regra": resultado["regra"]}